@@ -0,0 +1,98 @@
+import time
+
+# 画质档位：(码率系数, max_size, max_fps)，0 表示不限制
+QUALITY_LADDER = [
+    (1.0, 0, 0),
+    (0.5, 1280, 60),
+    (0.25, 1024, 30),
+    (0.125, 720, 24),
+]
+SAMPLE_INTERVAL = 2.0      # 采样间隔（秒）
+DEGRADE_SAMPLES = 2        # 连续多少次采样不健康后降档
+UPGRADE_SAMPLES = 15       # 连续多少次采样健康后升档
+CHANGE_COOLDOWN = 10.0     # 两次调整之间的最短间隔（秒）
+DROP_RATE_DEGRADE = 0.05   # 丢帧率超过该值视为不健康
+LATENCY_DEGRADE = 0.5      # 发送延迟超过该值（秒）视为不健康
+LATENCY_HEALTHY = 0.15     # 发送延迟低于该值（秒）才允许升档
+MIN_BIT_RATE = 128000
+
+
+class QualityState:
+    """单个会话的自适应状态"""
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.bad_samples = 0
+        self.good_samples = 0
+        self.last_change = time.monotonic()
+        self.counters = {}  # sid -> (sent_frames, dropped_frames)
+
+
+class AdaptiveQualityController:
+    """
+    自适应画质控制器
+    周期性采样每个会话中所有观看者的积压、发送延迟与丢帧率，按最差的观看者决定画质：
+    连续 DEGRADE_SAMPLES 次不健康则降一档，连续 UPGRADE_SAMPLES 次健康则升一档，
+    两次调整之间至少间隔 CHANGE_COOLDOWN 秒，避免来回抖动
+    """
+
+    def __init__(self, base_bit_rate, ladder=QUALITY_LADDER):
+        self.base_bit_rate = int(base_bit_rate)
+        self.ladder = ladder
+        self.states = {}
+
+    def params(self, level):
+        """返回档位对应的 (video_bit_rate, max_size, max_fps)"""
+        factor, max_size, max_fps = self.ladder[level]
+        bit_rate = max(int(self.base_bit_rate * factor), MIN_BIT_RATE)
+        return str(bit_rate), max_size, max_fps
+
+    def _viewer_health(self, state, stats, max_backlog):
+        """返回 (是否不健康, 是否健康)，两者都为 False 表示处于滞回区间"""
+        unhealthy = False
+        healthy = True
+        counters = {}
+        for sid, viewer in stats["viewers"].items():
+            sent, dropped = viewer["sent_frames"], viewer["dropped_frames"]
+            last_sent, last_dropped = state.counters.get(sid, (sent, dropped))
+            counters[sid] = (sent, dropped)
+            delta_dropped = dropped - last_dropped
+            total = (sent - last_sent) + delta_dropped
+            drop_rate = delta_dropped / total if total else 0.0
+            if (drop_rate > DROP_RATE_DEGRADE or viewer["latency"] > LATENCY_DEGRADE
+                    or viewer["backlog"] > max_backlog // 2):
+                unhealthy = True
+            if delta_dropped or viewer["latency"] > LATENCY_HEALTHY or viewer["backlog"] > max_backlog // 4:
+                healthy = False
+        state.counters = counters
+        return unhealthy, healthy and not unhealthy
+
+    def evaluate(self, broadcaster):
+        """采样一次会话，需要调整时返回新的档位，否则返回 None"""
+        state = self.states.get(broadcaster.device_id)
+        if state is None or state.broadcaster is not broadcaster:
+            state = QualityState(broadcaster)
+            self.states[broadcaster.device_id] = state
+        if broadcaster.restarting:
+            return None
+
+        unhealthy, healthy = self._viewer_health(state, broadcaster.get_stats(), broadcaster.max_backlog)
+        state.bad_samples = state.bad_samples + 1 if unhealthy else 0
+        state.good_samples = state.good_samples + 1 if healthy else 0
+
+        if time.monotonic() - state.last_change < CHANGE_COOLDOWN:
+            return None
+        level = broadcaster.quality_level
+        if state.bad_samples >= DEGRADE_SAMPLES and level < len(self.ladder) - 1:
+            new_level = level + 1
+        elif state.good_samples >= UPGRADE_SAMPLES and level > 0:
+            new_level = level - 1
+        else:
+            return None
+        state.bad_samples = 0
+        state.good_samples = 0
+        state.last_change = time.monotonic()
+        return new_level
+
+    def forget(self, device_id):
+        self.states.pop(device_id, None)
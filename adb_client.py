@@ -0,0 +1,251 @@
+import os
+import socket
+import struct
+import threading
+import time
+
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_IDLE = 2        # 连接池中保留的空闲连接数
+IDLE_CONNECTION_TTL = 30.0  # 空闲连接的最长保留时间（秒）
+SYNC_DATA_MAX = 64 * 1024   # sync 协议单个 DATA 块的最大长度
+
+
+class ADBError(Exception):
+    """ADB server 返回 FAIL（如设备不存在、端口被占用）"""
+
+
+class ADBClient:
+    """
+    ADB server 智能套接字（smart socket）协议的纯 Python 客户端，替代逐条启动 adb 子进程
+    请求格式为 4 位十六进制长度 + 服务名，应答为 OKAY 或 FAIL + 错误信息。
+    协议规定每个连接只承载一个请求（之后由 server 关闭或切换为设备数据流），
+    因此用过的连接不能放回连接池；连接池保存的是预先建立、尚未发出请求的空闲连接，
+    由后台线程补充，把 connect 开销移出请求路径
+    """
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=DEFAULT_TIMEOUT,
+                 max_idle=DEFAULT_MAX_IDLE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = []  # [(socket, created_at)]
+        self.refilling = False  # 是否有后台线程正在补充连接
+
+    # ---- 连接与基础协议 ----
+
+    def _open(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _acquire(self):
+        """从连接池取出一个空闲连接，没有可用连接时新建"""
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                sock, created = self.idle.pop()
+                if now - created < IDLE_CONNECTION_TTL:
+                    return sock
+                sock.close()
+        return self._open()
+
+    def _schedule_refill(self):
+        """连接池不足时启动后台线程补充，请求线程不等待 connect"""
+        with self.lock:
+            if self.refilling or len(self.idle) >= self.max_idle:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, name='adb-pool-refill', daemon=True).start()
+
+    def _refill(self):
+        """补充空闲连接，server 不可用时静默放弃"""
+        try:
+            while True:
+                with self.lock:
+                    if len(self.idle) >= self.max_idle:
+                        return
+                try:
+                    sock = self._open()
+                except OSError:
+                    return
+                with self.lock:
+                    self.idle.append((sock, time.monotonic()))
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def close(self):
+        with self.lock:
+            for sock, _ in self.idle:
+                sock.close()
+            self.idle = []
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def _read_string(self, sock):
+        length = int(self._recv_exact(sock, 4), 16)
+        return self._recv_exact(sock, length).decode('utf-8', errors='replace')
+
+    def _read_status(self, sock):
+        status = self._recv_exact(sock, 4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise ADBError(self._read_string(sock))
+        raise ADBError(f"unexpected adb response: {status!r}")
+
+    def _request(self, sock, service):
+        payload = service.encode('utf-8')
+        sock.sendall(b'%04x' % len(payload) + payload)
+        self._read_status(sock)
+
+    def _connect_service(self, service, serial=None):
+        """
+        建立到设备服务的连接：先切换到目标设备的 transport，再请求服务，返回已就绪的连接
+        调用方负责关闭返回的连接
+        """
+        sock = self._acquire()
+        try:
+            self._request(sock, f"host:transport:{serial}" if serial else "host:transport-any")
+            self._request(sock, service)
+            return sock
+        except Exception:
+            sock.close()
+            raise
+        finally:
+            self._schedule_refill()
+
+    def _host_command(self, service, reply=True):
+        """执行 host 服务，reply 为 True 时读取长度前缀的应答内容"""
+        sock = self._acquire()
+        try:
+            self._request(sock, service)
+            return self._read_string(sock) if reply else ''
+        finally:
+            sock.close()
+            self._schedule_refill()
+
+    # ---- host 服务 ----
+
+    def version(self):
+        return int(self._host_command("host:version"), 16)
+
+    def devices(self):
+        """返回 [(serial, state)]"""
+        return self.parse_devices(self._host_command("host:devices"))
+
+    @staticmethod
+    def parse_devices(output):
+        return [tuple(line.split('\t')[:2]) for line in output.splitlines() if '\t' in line]
+
+    def open_track_devices(self):
+        """
+        打开 host:track-devices 长连接，server 会先发送一次完整列表，之后每次变化再发送完整列表
+        返回的连接不进入连接池，用 read_device_list() 读取，调用方负责关闭
+        """
+        sock = self._open()
+        try:
+            self._request(sock, "host:track-devices")
+            sock.settimeout(None)
+            return sock
+        except Exception:
+            sock.close()
+            raise
+
+    def read_device_list(self, sock):
+        """阻塞读取 track-devices 连接上的下一份设备列表，返回 [(serial, state)]"""
+        return self.parse_devices(self._read_string(sock))
+
+    def connect(self, address):
+        return self._host_command(f"host:connect:{address}")
+
+    def disconnect(self, address=''):
+        return self._host_command(f"host:disconnect:{address}")
+
+    def get_state(self, serial=None):
+        prefix = f"host-serial:{serial}" if serial else "host"
+        return self._host_command(f"{prefix}:get-state")
+
+    def forward(self, serial, local, remote):
+        """
+        建立端口转发，local 为 tcp:0 时由 server 分配端口并返回端口号
+        forward 的应答为两次 OKAY：第一次表示已找到设备，第二次表示转发已建立
+        """
+        prefix = f"host-serial:{serial}" if serial else "host"
+        sock = self._acquire()
+        try:
+            self._request(sock, f"{prefix}:forward:{local};{remote}")
+            self._read_status(sock)
+            if local == 'tcp:0':
+                return int(self._read_string(sock))
+            return int(local.split(':', 1)[1]) if local.startswith('tcp:') else None
+        finally:
+            sock.close()
+            self._schedule_refill()
+
+    def kill_forward(self, serial, local):
+        prefix = f"host-serial:{serial}" if serial else "host"
+        sock = self._acquire()
+        try:
+            self._request(sock, f"{prefix}:killforward:{local}")
+            self._read_status(sock)
+        finally:
+            sock.close()
+            self._schedule_refill()
+
+    def list_forward(self, serial=None):
+        """返回 [(serial, local, remote)]，serial 为 None 时列出所有设备的转发"""
+        prefix = f"host-serial:{serial}" if serial else "host"
+        output = self._host_command(f"{prefix}:list-forward")
+        return [tuple(line.split()[:3]) for line in output.splitlines() if len(line.split()) >= 3]
+
+    # ---- 设备服务 ----
+
+    def shell(self, serial, command, timeout=None):
+        """执行 shell 命令并返回输出（v1 shell 协议，stdout 与 stderr 合并）"""
+        sock = self._connect_service(f"shell:{command}", serial)
+        try:
+            sock.settimeout(timeout or self.timeout)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return b''.join(chunks).decode('utf-8', errors='replace')
+        finally:
+            sock.close()
+
+    def push(self, serial, local_path, remote_path, mode=0o644):
+        """通过 sync 协议推送文件：SEND 路径与权限，若干 DATA 块，DONE 携带修改时间"""
+        sock = self._connect_service("sync:", serial)
+        try:
+            target = f"{remote_path},{mode}".encode('utf-8')
+            sock.sendall(b'SEND' + struct.pack('<I', len(target)) + target)
+            with open(local_path, 'rb') as f:
+                while True:
+                    chunk = f.read(SYNC_DATA_MAX)
+                    if not chunk:
+                        break
+                    sock.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+            sock.sendall(b'DONE' + struct.pack('<I', int(os.path.getmtime(local_path))))
+            status = self._recv_exact(sock, 4)
+            length = struct.unpack('<I', self._recv_exact(sock, 4))[0]
+            if status != b'OKAY':
+                message = self._recv_exact(sock, length).decode('utf-8', errors='replace')
+                raise ADBError(f"push failed: {message}")
+            sock.sendall(b'QUIT' + struct.pack('<I', 0))
+        finally:
+            sock.close()
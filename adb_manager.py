@@ -3,16 +3,32 @@ import re
 import time
 import platform
 import os
+import threading
 from typing import Optional, Tuple
+from adb_client import ADBClient, ADBError
+from metrics import ADB_COMMAND_DURATION
+
+NATIVE_RETRY_INTERVAL = 30.0  # 原生协议不可用后，多久再尝试一次（秒）
+
+# 所有 ADBManager 共享一个原生客户端（及其连接池）
+_native_client = ADBClient()
+_native_state = {"disabled_until": 0.0, "server_started": False}
+_native_lock = threading.Lock()
 
 class ADBManager:
+    use_native = True  # 通过 ADB server 协议直接通信，失败时回退到 adb 子进程
+    tracker = None     # 设备跟踪器（DeviceTracker），运行时 get_devices() 直接读取其设备表
+
     def __init__(self):
         self.adb_path = self._get_adb_path()
         self.current_device = None
         self.is_tcp_mode = False
+        self.client = _native_client
 
     def _get_adb_path(self) -> str:
-        """获取adb路径"""
+        """获取adb路径，可通过环境变量 ADB_PATH 指定（如基准测试使用的模拟 adb）"""
+        if os.environ.get('ADB_PATH'):
+            return os.environ['ADB_PATH']
         system = platform.system().lower()
         current_dir = os.path.dirname(os.path.abspath(__file__))
         
@@ -45,11 +61,99 @@ class ADBManager:
         except Exception as e:
             return False, str(e)
 
-    def get_devices(self) -> list:
-        """获取已连接的设备列表"""
-        success, output = self._run_adb_command(['devices'])
+    def native_available(self) -> bool:
+        return ADBManager.use_native and time.monotonic() >= _native_state["disabled_until"]
+
+    def _run(self, native, command: list, device_id: str = None) -> Tuple[bool, str]:
+        """
+        优先通过原生协议执行（native 为无参函数，返回输出），返回 (success, output)
+        ADB server 未运行时先用 adb start-server 拉起一次；仍不可用则在一段时间内回退到 adb 子进程
+        """
+        started = time.monotonic()
+        method = 'subprocess'
+        try:
+            if self.native_available():
+                method = 'native'
+                for attempt in range(2):
+                    try:
+                        return True, native()
+                    except ADBError as e:
+                        return False, str(e)
+                    except OSError as e:
+                        with _native_lock:
+                            if attempt == 0 and not _native_state["server_started"]:
+                                _native_state["server_started"] = True
+                                self._run_adb_command(['start-server'])
+                                continue
+                            print(f"ADB server protocol unavailable ({e}), falling back to adb executable")
+                            _native_state["disabled_until"] = time.monotonic() + NATIVE_RETRY_INTERVAL
+                        break
+                method = 'subprocess'
+            return self._run_adb_command(command, device_id)
+        finally:
+            ADB_COMMAND_DURATION.observe(time.monotonic() - started, command[0], method)
+
+    def get_state(self, device_id: str = None) -> Tuple[bool, str]:
+        """获取设备状态（device / offline / unauthorized）"""
+        success, output = self._run(lambda: self.client.get_state(device_id), ['get-state'], device_id)
+        return success, output.strip()
+
+    def shell(self, command: str, device_id: str = None, timeout: float = None) -> Tuple[bool, str]:
+        """执行 shell 命令，原生协议下 stdout 与 stderr 合并返回"""
+        return self._run(lambda: self.client.shell(device_id, command, timeout),
+                         ['shell', command], device_id)
+
+    def push(self, local_path: str, remote_path: str, device_id: str = None) -> Tuple[bool, str]:
+        return self._run(lambda: self.client.push(device_id, local_path, remote_path) or '',
+                         ['push', local_path, remote_path], device_id)
+
+    def forward(self, local: str, remote: str, device_id: str = None) -> Tuple[bool, str]:
+        return self._run(lambda: str(self.client.forward(device_id, local, remote)),
+                         ['forward', local, remote], device_id)
+
+    def remove_forward(self, local: str, device_id: str = None) -> Tuple[bool, str]:
+        return self._run(lambda: self.client.kill_forward(device_id, local) or '',
+                         ['forward', '--remove', local], device_id)
+
+    def list_forwards(self) -> list:
+        """列出所有设备的端口转发 [(serial, local, remote)]"""
+        success, output = self._run(
+            lambda: ''.join(f'{serial} {local} {remote}\n' for serial, local, remote in self.client.list_forward()),
+            ['forward', '--list'])
         if not success:
             return []
+        return [tuple(line.split()[:3]) for line in output.splitlines() if len(line.split()) >= 3]
+
+    def reclaim_forwards(self, remote: str) -> int:
+        """
+        移除指向 remote 的所有端口转发，返回移除数量
+        启动时调用，回收上次异常退出的进程遗留的 scrcpy 转发
+        """
+        removed = 0
+        for serial, local, target in self.list_forwards():
+            if target == remote:
+                success, output = self.remove_forward(local, serial)
+                if success:
+                    removed += 1
+                else:
+                    print(f"Failed to remove stale forward {serial} {local}: {output}")
+        return removed
+
+    def get_devices(self) -> list:
+        """获取已连接的设备列表，设备跟踪器在线时直接返回内存中的设备表"""
+        tracker = ADBManager.tracker
+        if tracker is not None and tracker.synced:
+            return [{'id': serial, 'state': state, 'is_tcp': ':' in serial}
+                    for serial, state in tracker.get_devices()]
+        return self.refresh_devices() or []
+
+    def refresh_devices(self) -> Optional[list]:
+        """向 ADB server 查询设备列表，失败时返回 None"""
+        success, output = self._run(
+            lambda: 'List of devices attached\n' + ''.join(f'{serial}\t{state}\n' for serial, state in self.client.devices()),
+            ['devices'])
+        if not success:
+            return None
         
         devices = []
         for line in output.split('\n')[1:]:  # 跳过第一行 "List of devices attached"
@@ -65,7 +169,7 @@ class ADBManager:
 
     def get_device_ip(self) -> Optional[str]:
         """获取设备IP地址"""
-        success, output = self._run_adb_command(['shell', 'ip', 'route'])
+        success, output = self.shell('ip route')
         if not success:
             return None
 
@@ -79,7 +183,7 @@ class ADBManager:
     def connect_to_device(self, ip: str, port: int = 5555):
         """通过TCP/IP连接设备，返回 (success, output)"""
         address = f"{ip}:{port}"
-        success, output = self._run_adb_command(['connect', address])
+        success, output = self._run(lambda: self.client.connect(address), ['connect', address])
         out_lower = (output or '').lower()
         if success and ('connected' in out_lower or 'already connected' in out_lower):
             self.current_device = address
@@ -91,9 +195,9 @@ class ADBManager:
         """断开TCP/IP连接"""
         if ip:
             address = f"{ip}:{port}"
-            success, _ = self._run_adb_command(['disconnect', address])
+            success, _ = self._run(lambda: self.client.disconnect(address), ['disconnect', address])
         else:
-            success, _ = self._run_adb_command(['disconnect'])
+            success, _ = self._run(lambda: self.client.disconnect(), ['disconnect'])
         
         if success:
             self.current_device = None
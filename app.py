@@ -1,16 +1,43 @@
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit, send
-from scrcpy import Scrcpy
-from adb_manager import ADBManager
 import argparse
-import queue
+import sys
+
+ASYNC_MODES = ('threading', 'gevent')
+
+
+def parse_async_mode(argv):
+    """提前解析 --async_mode：gevent 模式需要在导入 Flask、socket 等模块之前完成 monkey patch"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--async_mode', choices=ASYNC_MODES, default='threading')
+    return parser.parse_known_args(argv)[0].async_mode
+
+
+ASYNC_MODE = parse_async_mode(sys.argv[1:]) if __name__ == '__main__' else 'threading'
+if ASYNC_MODE == 'gevent':
+    # 线程、socket、subprocess 等替换为协程版本，每个连接与后台任务只占用一个 greenlet
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, Response, render_template, request
+from flask_socketio import SocketIO, emit, send, join_room, leave_room
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from broadcaster import VideoBroadcaster, TRANSPORTS
+from adaptive import AdaptiveQualityController, SAMPLE_INTERVAL
+from adb_manager import ADBManager
+from scrcpy import Scrcpy, SCRCPY_SOCKET_NAME, MAX_CONTROL_QUEUE
+from reactor import ReactorPool
+from device_tracker import DeviceTracker
+from config_store import ConfigStore
+from device_worker import WorkerScrcpy
+from metrics import REGISTRY, CONTENT_TYPE
 import atexit
+from functools import partial
 import os
-import sys
 import threading
+import time
 from pathlib import Path
 import re
-from dotenv import load_dotenv, dotenv_values
+from dotenv import load_dotenv
 
 # 确保 data 目录存在
 os.makedirs('data', exist_ok=True)
@@ -21,6 +48,9 @@ ENV_FILE_PATH = os.path.join('data', '.env')
 # 加载 .env 文件
 load_dotenv(ENV_FILE_PATH)
 
+# 配置缓存：文件未变化时不重复解析，写入为原子替换
+config_store = ConfigStore(ENV_FILE_PATH)
+
 import json
 
 # 读取和写入 .env 文件中的 ADB 地址
@@ -29,8 +59,7 @@ def get_saved_devices():
     从 data/.env 文件中读取保存的所有设备 ADB 地址
     支持旧格式（逗号分隔）和新格式（JSON）
     """
-    config = dotenv_values(ENV_FILE_PATH)
-    devices_str = config.get('ADB_DEVICES', '')
+    devices_str = config_store.get('ADB_DEVICES', '')
     if not devices_str:
         return []
     
@@ -50,8 +79,7 @@ def get_auto_stop_time():
     从 data/.env 文件中读取自动停止时间（分钟）
     如果未设置，返回默认值15分钟
     """
-    config = dotenv_values(ENV_FILE_PATH)
-    auto_stop_time = config.get('AUTO_STOP_TIME', '15')
+    auto_stop_time = config_store.get('AUTO_STOP_TIME', '15')
     try:
         return int(auto_stop_time)
     except (ValueError, TypeError):
@@ -62,8 +90,7 @@ def get_demo_mode():
     从 data/.env 文件中读取演示模式配置
     如果未设置，返回默认值False
     """
-    config = dotenv_values(ENV_FILE_PATH)
-    demo_mode = config.get('DEMO_MODE', 'False')
+    demo_mode = config_store.get('DEMO_MODE', 'False')
     return demo_mode.lower() in ('true')
 
 def save_devices(devices):
@@ -71,21 +98,24 @@ def save_devices(devices):
     将所有已连接的设备 ADB 地址保存到 data/.env 文件中
     使用 JSON 格式存储设备名称和地址的映射关系
     """
-    config = dotenv_values(ENV_FILE_PATH)
-    
     # 转换为字典格式：{"设备名称": "ADB地址"}
     devices_dict = {device['name']: device['address'] for device in devices}
-    config['ADB_DEVICES'] = json.dumps(devices_dict)
-    
-    with open(ENV_FILE_PATH, 'w') as f:
-        for key, value in config.items():
-            f.write(f'{key}={value}\n')
+    config_store.update(ADB_DEVICES=json.dumps(devices_dict))
+
+DEFAULT_MAX_SESSIONS = 16  # 默认最多同时镜像的设备数量
+DEFAULT_MAX_CONNECTIONS = 1000  # gevent 模式下默认最多同时处理的连接数
+DEFAULT_BACKLOG = 1024     # gevent 模式下监听队列长度
+IDLE_REAPER_INTERVAL = 10  # 空闲会话检查间隔（秒）
+AUTO_STOP_WARNING = 60     # 自动停止前多久发出警告（秒）
+WEBSOCKET_CLOSE_TIMEOUT = 2.0  # 关闭 WebSocket 时等待客户端关闭应答的时间（秒）
 
 # 设备管理器
 class DeviceManager:
-    def __init__(self):
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
         self.devices = {}  # 存储所有连接的设备
         self.adb_manager = ADBManager()
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()  # 保护会话计数，设备自身的状态变更由设备锁保护
 
     def add_device(self, device_id, state="device", name=None):
         # 检查设备是否已存在
@@ -97,7 +127,9 @@ class DeviceManager:
                 "name": device_name,
                 "state": state,
                 "is_mirroring": False,
-                "scrcpy": None
+                "is_starting": False,
+                "broadcaster": None,
+                "lock": threading.RLock()
             }
             return True
         return False
@@ -112,38 +144,95 @@ class DeviceManager:
         return False
 
     def remove_device(self, device_id):
-        if device_id in self.devices:
-            if self.devices[device_id]["scrcpy"]:
-                self.devices[device_id]["scrcpy"].scrcpy_stop()
-            del self.devices[device_id]
-
-    def start_mirror(self, device_id, callback):
-        if device_id in self.devices and not self.devices[device_id]["is_mirroring"]:
-            scpy = Scrcpy()
-            scpy.device_id = device_id  # 设置设备ID
-            if scpy.scrcpy_start(callback, video_bit_rate):
-                self.devices[device_id]["scrcpy"] = scpy
-                self.devices[device_id]["is_mirroring"] = True
+        device = self.devices.get(device_id)
+        if device:
+            with device["lock"]:
+                if device["broadcaster"]:
+                    device["broadcaster"].stop()
+            self.devices.pop(device_id, None)
+
+    def active_session_count(self):
+        return sum(1 for d in self.devices.values() if d["is_mirroring"] or d["is_starting"])
+
+    def start_mirror(self, device_id, sid, transport='socketio', audio=False, control=True):
+        """
+        为观看者开启镜像，返回 (success, message)
+        设备未在镜像时启动新的 scrcpy 会话，已在镜像时直接加入现有会话；
+        会话只开启观看者需要的流：无人需要音频时不采集音频，全部为仅观看时不建立控制通道；
+        不同设备的会话可并行启动，同时镜像的设备数量受 max_sessions 限制
+        """
+        device = self.devices.get(device_id)
+        if device is None:
+            return False, '设备未找到'
+        with device["lock"]:
+            if device["is_mirroring"]:
+                broadcaster = device["broadcaster"]
+                broadcaster.add_viewer(sid, transport, audio, control)
+                if not broadcaster.ensure_streams(audio, control):
+                    print(f"Failed to enable audio/control for device {device_id}")
+                return True, None
+            with self.lock:
+                if self.max_sessions and self.active_session_count() >= self.max_sessions:
+                    return False, f'已达到最大同时镜像数量 ({self.max_sessions})'
+                device["is_starting"] = True
+            try:
+                broadcaster = VideoBroadcaster(device_id, socketio)
+                broadcaster.add_viewer(sid, transport, audio, control)
+                if not broadcaster.start(video_bit_rate, audio=audio, control=control):
+                    print(f"Failed to start scrcpy for device {device_id}")
+                    return False, '启动镜像失败'
+                device["broadcaster"] = broadcaster
+                device["is_mirroring"] = True
+                return True, None
+            finally:
+                device["is_starting"] = False
+
+    def leave_mirror(self, device_id, sid):
+        """
+        观看者离开镜像，最后一个观看者离开时停止会话
+        返回会话是否已停止
+        """
+        device = self.devices.get(device_id)
+        if device is None:
+            return False
+        with device["lock"]:
+            if device["is_mirroring"] and device["broadcaster"].remove_viewer(sid) == 0:
+                self.stop_mirror(device_id)
                 return True
-            else:
-                print(f"Failed to start scrcpy for device {device_id}")
         return False
 
     def stop_mirror(self, device_id):
-        if device_id in self.devices and self.devices[device_id]["is_mirroring"]:
-            self.devices[device_id]["scrcpy"].scrcpy_stop()
-            self.devices[device_id]["scrcpy"] = None
-            self.devices[device_id]["is_mirroring"] = False
-            return True
+        device = self.devices.get(device_id)
+        if device is None:
+            return False
+        with device["lock"]:
+            if device["is_mirroring"]:
+                device["broadcaster"].stop()
+                device["broadcaster"] = None
+                device["is_mirroring"] = False
+                return True
         return False
 
+    def get_broadcaster(self, device_id):
+        device = self.devices.get(device_id)
+        if device and device["is_mirroring"]:
+            return device["broadcaster"]
+        return None
+
+    def get_scrcpy(self, device_id):
+        device = self.devices.get(device_id)
+        if device and device["is_mirroring"] and device["broadcaster"]:
+            return device["broadcaster"].scrcpy
+        return None
+
     def get_device_list(self):
         return [
             {
                 "id": d["id"],
                 "name": d["name"],
                 "state": d["state"],
-                "is_mirroring": d["is_mirroring"]
+                "is_mirroring": d["is_mirroring"],
+                "viewers": d["broadcaster"].viewer_count() if d["broadcaster"] else 0
             }
             for d in self.devices.values()
         ]
@@ -153,10 +242,10 @@ class DeviceManager:
             self.remove_device(device_id)
         self.adb_manager.disconnect_device()
 
-client_sid = None
-message_queue = queue.Queue()
 video_bit_rate = "1024000"
 device_manager = DeviceManager()
+quality_controller = None  # 自适应画质控制器，在启动参数解析后创建
+control_debug = False      # 是否打印每个控制事件批次，由 --control_debug 开启
 
 # 注册退出时的清理函数
 def cleanup_on_exit():
@@ -168,37 +257,116 @@ atexit.register(cleanup_on_exit)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-# 显式使用线程模式，避免不必要的依赖探测带来的启动开销
-socketio = SocketIO(app, async_mode='threading')
+# 显式指定异步模式（默认线程模式），避免不必要的依赖探测带来的启动开销
+socketio = SocketIO(app, async_mode=ASYNC_MODE)
+# 专用的二进制视频 WebSocket 通道，Socket.IO 仅用于控制与信令
+sock = Sock(app)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-def video_send_task():
-    global client_sid
-    while client_sid is not None:
-        try:
-            message = message_queue.get(timeout=0.01)
-            if client_sid:  # 确保客户端仍然连接
-                socketio.emit('video_data', message, to=client_sid)
-        except queue.Empty:
-            pass
-        except Exception as e:
-            print(f"Error sending data: {e}")
-        finally:
-            socketio.sleep(0.001)
-    print(f"video_send_task stopped")
-
-def send_video_data(data):
-    if not message_queue.full():
-        message_queue.put(data)
+# (指标名, 类型, 说明, VideoBroadcaster.get_metrics() 中的字段)
+DEVICE_METRICS = [
+    ('scrcpy_video_frames_total', 'counter', '从设备接收的视频包数', 'video_frames'),
+    ('scrcpy_video_bytes_total', 'counter', '从设备接收的视频负载字节数', 'video_bytes'),
+    ('scrcpy_audio_bytes_total', 'counter', '从设备接收的音频负载字节数', 'audio_bytes'),
+    ('scrcpy_dropped_frames_total', 'counter', '因观看者积压而丢弃的视频包数', 'dropped_frames'),
+    ('scrcpy_keyframe_requests_total', 'counter', '向设备请求关键帧的次数', 'keyframe_requests'),
+    ('scrcpy_control_events_total', 'counter', '浏览器发来的控制事件数', 'control_events'),
+    ('scrcpy_control_messages_total', 'counter', '写入控制通道的控制消息数', 'control_messages'),
+    ('scrcpy_control_writes_total', 'counter', '控制通道写入次数', 'control_writes'),
+    ('scrcpy_control_rejected_total', 'counter', '因控制队列已满被拒绝的批次数', 'control_rejected'),
+    ('scrcpy_control_write_seconds_total', 'counter', '控制通道累计写入耗时', 'control_write_seconds'),
+    ('scrcpy_control_queue_depth', 'gauge', '控制写入队列中待写的消息数', 'control_queue_depth'),
+    ('scrcpy_viewers', 'gauge', '观看者数量', 'viewers'),
+    ('scrcpy_viewer_backlog_frames', 'gauge', '所有观看者积压的视频包总数', 'viewer_backlog_frames'),
+    ('scrcpy_viewer_backlog_max_frames', 'gauge', '单个观看者积压视频包数的最大值', 'viewer_backlog_max_frames'),
+    ('scrcpy_history_frames', 'gauge', '广播历史中缓存的视频包数', 'history_frames'),
+    ('scrcpy_recorder_queue_frames', 'gauge', '录制写入队列中的帧数', 'recorder_queue_frames'),
+    ('scrcpy_recorder_dropped_frames_total', 'counter', '录制因写盘跟不上丢弃的帧数', 'recorder_dropped_frames'),
+]
+
+def collect_device_metrics():
+    """/metrics 的采集函数：读取每个镜像中设备的广播器统计"""
+    snapshots = []
+    for device_id in list(device_manager.devices):
+        broadcaster = device_manager.get_broadcaster(device_id)
+        if broadcaster:
+            snapshots.append((device_id, broadcaster.get_metrics()))
+    families = [('scrcpy_sessions', 'gauge', '正在镜像的设备数', (), [((), len(snapshots))])]
+    for name, metric_type, help_text, field in DEVICE_METRICS:
+        samples = [((device_id,), metrics[field]) for device_id, metrics in snapshots if field in metrics]
+        families.append((name, metric_type, help_text, ('device',), samples))
+    if Scrcpy.reactors:
+        loops = Scrcpy.reactors.get_metrics()
+        families.append(('scrcpy_reactor_sessions', 'gauge', '分配到每个 I/O 循环的会话与发送任务数', ('reactor',),
+                         [((loop['name'],), loop['sessions']) for loop in loops]))
+        families.append(('scrcpy_reactor_events_total', 'counter', '每个 I/O 循环处理的就绪事件数', ('reactor',),
+                         [((loop['name'],), loop['events']) for loop in loops]))
+    return families
+
+REGISTRY.register_collector(collect_device_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def restart_with_quality(broadcaster, level):
+    bit_rate, max_size, max_fps = quality_controller.params(level)
+    if broadcaster.restart(bit_rate, max_size, max_fps, quality_level=level):
+        socketio.emit('quality_changed', {
+            'device_id': broadcaster.device_id,
+            'level': level,
+            'video_bit_rate': int(bit_rate),
+            'max_size': max_size,
+            'max_fps': max_fps
+        }, to=broadcaster.room)
+
+def adaptive_quality_task():
+    """定期评估所有镜像会话的观看质量，必要时以新的画质参数重启会话"""
+    while True:
+        socketio.sleep(SAMPLE_INTERVAL)
+        for device_id, info in list(device_manager.devices.items()):
+            broadcaster = info["broadcaster"]
+            if not broadcaster:
+                quality_controller.forget(device_id)
+                continue
+            try:
+                level = quality_controller.evaluate(broadcaster)
+                if level is not None:
+                    socketio.start_background_task(restart_with_quality, broadcaster, level)
+            except Exception as e:
+                print(f"Error evaluating quality for {device_id}: {e}")
+
+@sock.route('/ws/video/<path:device_id>')
+def video_websocket(ws, device_id):
+    """
+    设备视频的原始二进制 WebSocket 通道
+    客户端需先通过 Socket.IO 以 transport='websocket' 加入镜像，并在查询参数中携带其 sid
+    """
+    sid = request.args.get('sid')
+    broadcaster = device_manager.get_broadcaster(device_id)
+    if not broadcaster or not broadcaster.stream_to_websocket(sid, ws):
+        close_websocket(ws, reason=1008, message='device is not mirroring for this client')
+    else:
+        close_websocket(ws)
+
+def close_websocket(ws, reason=None, message=None):
+    """
+    完成关闭握手：发送关闭帧后等待读取线程收到客户端的关闭应答，
+    否则应答留在连接中，处理函数返回后由 WSGI 服务器读到
+    """
+    try:
+        ws.close(reason=reason, message=message)
+    except ConnectionClosed:
+        pass  # 客户端已先发起关闭
+    ws.thread.join(timeout=WEBSOCKET_CLOSE_TIMEOUT)
 
 @socketio.on('connect')
 def handle_connect():
-    global client_sid
     print('Client connected')
-    client_sid = request.sid
     # 发送当前设备列表
     emit('device_list_update', device_manager.get_device_list())
     # 发送保存的设备列表
@@ -212,6 +380,103 @@ def handle_connect():
     emit('demo_mode', {'enabled': demo_mode})
     return True
 
+def get_transport(data):
+    transport = data.get('transport', 'socketio')
+    return transport if transport in TRANSPORTS else 'socketio'
+
+def get_stream_options(data):
+    """返回 (audio, control)：audio 为是否开启音频，view_only 为真时不允许控制设备"""
+    return bool(data.get('audio', False)), not data.get('view_only', False)
+
+def leave_rooms(device_id, broadcaster):
+    leave_room(device_id)
+    leave_room(broadcaster.audio_room)
+
+def join_mirror(device_id, transport='socketio', audio=False, control=True):
+    """
+    当前客户端加入设备镜像，并退出其正在观看的其他设备（其他客户端的镜像不受影响）
+    返回 (success, message)
+    """
+    for did, info in list(device_manager.devices.items()):
+        broadcaster = info["broadcaster"]
+        if did != device_id and broadcaster and broadcaster.has_viewer(request.sid):
+            leave_rooms(did, broadcaster)
+            device_manager.leave_mirror(did, request.sid)
+            emit('mirror_stopped', {'device_id': did})
+    success, message = device_manager.start_mirror(device_id, request.sid, transport, audio, control)
+    if success:
+        join_room(device_id)
+        broadcaster = device_manager.get_broadcaster(device_id)
+        if audio and broadcaster:
+            join_room(broadcaster.audio_room)
+            if broadcaster.audio_config:
+                emit('audio_config', broadcaster.audio_config)
+        elif broadcaster:
+            leave_room(broadcaster.audio_room)
+    return success, message
+
+def broadcast_device_list():
+    """镜像状态变化时通知所有客户端"""
+    socketio.emit('device_list_update', device_manager.get_device_list())
+
+def terminate_mirror(device_id, broadcaster, reason):
+    """由服务器主动停止镜像：通知所有观看者并关闭其房间"""
+    socketio.emit('mirror_stopped', {'device_id': device_id, 'reason': reason}, to=broadcaster.room)
+    socketio.close_room(broadcaster.room)
+    socketio.close_room(broadcaster.audio_room)
+    device_manager.stop_mirror(device_id)
+
+def idle_reaper_task():
+    """
+    定期检查所有镜像会话，空闲达到 AUTO_STOP_TIME 分钟的会话由服务器停止，
+    停止前 AUTO_STOP_WARNING 秒向观看者发送 auto_stop_warning 事件；AUTO_STOP_TIME 为 0 时不回收
+    """
+    while True:
+        socketio.sleep(IDLE_REAPER_INTERVAL)
+        limit = get_auto_stop_time() * 60
+        if limit <= 0:
+            continue
+        warning_lead = min(AUTO_STOP_WARNING, limit / 2)
+        stopped = False
+        for device_id in list(device_manager.devices):
+            broadcaster = device_manager.get_broadcaster(device_id)
+            if not broadcaster:
+                continue
+            idle = broadcaster.idle_time()
+            if idle >= limit:
+                print(f"Stopping idle mirror for {device_id} after {idle:.0f}s")
+                terminate_mirror(device_id, broadcaster, 'idle')
+                stopped = True
+            elif idle >= limit - warning_lead and not broadcaster.idle_warned:
+                broadcaster.idle_warned = True
+                socketio.emit('auto_stop_warning', {'device_id': device_id, 'seconds': int(limit - idle)},
+                              to=broadcaster.room)
+        if stopped:
+            broadcast_device_list()
+
+def handle_device_changes(changes):
+    """
+    设备跟踪器回调：同步已连接设备的状态并推送变化，
+    设备离线、未授权或消失时停止其镜像，避免残留无效会话
+    """
+    updated = []
+    for serial, previous, state in changes:
+        device = device_manager.devices.get(serial)
+        if device is None:
+            continue
+        state = state or 'offline'
+        if device["state"] == state:
+            continue
+        device["state"] = state
+        updated.append({'id': serial, 'state': state, 'previous': previous})
+        print(f'Device state changed: {serial} {previous} -> {state}')
+        broadcaster = device_manager.get_broadcaster(serial)
+        if state != 'device' and broadcaster:
+            terminate_mirror(serial, broadcaster, 'device_state')
+    if updated:
+        socketio.emit('device_state_changed', updated)
+        broadcast_device_list()
+
 def get_current_mirroring_device_id():
     for did, info in device_manager.devices.items():
         if info.get("is_mirroring"):
@@ -261,27 +526,16 @@ def handle_device_connect(data):
                     # 添加新设备，名称默认为地址
                     saved_devices.append({'name': device_id, 'address': device_id})
                     save_devices(saved_devices)
-                emit('device_list_update', device_manager.get_device_list())
+                broadcast_device_list()
                 print(f'Device connected successfully: {device_id}')
                 
-                # 若已有其他设备在镜像，先关闭它们
-                try:
-                    for did, info in list(device_manager.devices.items()):
-                        if info["is_mirroring"] and did != device_id:
-                            device_manager.stop_mirror(did)
-                            emit('mirror_stopped', {'device_id': did})
-                    # 更新设备列表（状态变更）
-                    emit('device_list_update', device_manager.get_device_list())
-                except Exception as e:
-                    print(f"Error stopping previous mirrors: {e}")
-                
-                # 自动开始镜像
-                if device_manager.start_mirror(device_id, send_video_data):
-                    socketio.start_background_task(video_send_task)
-                    emit('device_list_update', device_manager.get_device_list())
+                # 自动开始镜像（其他设备的镜像保持运行）
+                success, message = join_mirror(device_id, get_transport(data), *get_stream_options(data))
+                if success:
+                    broadcast_device_list()
                     emit('mirror_started', {'device_id': device_id})
                 else:
-                    emit('mirror_error', '启动镜像失败')
+                    emit('mirror_error', message)
             else:
                 device_manager.adb_manager.disconnect_device(ip, port)
                 emit('connection_error', '设备添加失败')
@@ -296,11 +550,13 @@ def handle_device_connect(data):
 def handle_device_disconnect(data):
     device_id = data.get('device_id')
     if device_id in device_manager.devices:
+        if device_manager.devices[device_id]["is_mirroring"]:
+            socketio.emit('mirror_stopped', {'device_id': device_id}, to=device_id)
         device_manager.remove_device(device_id)
         device_manager.adb_manager.disconnect_device(
             *device_id.split(':') if ':' in device_id else (device_id, None)
         )
-        emit('device_list_update', device_manager.get_device_list())
+        broadcast_device_list()
         print(f'Device disconnected: {device_id}')
 
 @socketio.on('delete_saved_device')
@@ -402,16 +658,6 @@ def handle_rename_device(data):
 @socketio.on('start_mirror')
 def handle_start_mirror(data):
     device_id = data.get('device_id')
-    # 若已有其他设备在镜像，先关闭它们
-    try:
-        for did, info in list(device_manager.devices.items()):
-            if info["is_mirroring"] and did != device_id:
-                device_manager.stop_mirror(did)
-                emit('mirror_stopped', {'device_id': did})
-        # 更新设备列表（状态变更）
-        emit('device_list_update', device_manager.get_device_list())
-    except Exception as e:
-        print(f"Error stopping previous mirrors: {e}")
 
     # 确保设备被保存到 .env 文件
     saved_devices = get_saved_devices()
@@ -424,57 +670,144 @@ def handle_start_mirror(data):
         emit('saved_devices', saved_devices)
         print(f'Device saved to .env: {device_id}')
 
-    if device_manager.start_mirror(device_id, send_video_data):
-        socketio.start_background_task(video_send_task)
-        emit('device_list_update', device_manager.get_device_list())
+    success, message = join_mirror(device_id, get_transport(data), *get_stream_options(data))
+    if success:
+        broadcast_device_list()
         emit('mirror_started', {'device_id': device_id})
     else:
-        emit('mirror_error', '启动镜像失败')
+        emit('mirror_error', message)
 
 @socketio.on('stop_mirror')
 def handle_stop_mirror(data):
     device_id = data.get('device_id')
-    if device_manager.stop_mirror(device_id):
-        emit('device_list_update', device_manager.get_device_list())
+    info = device_manager.devices.get(device_id)
+    if info and info["is_mirroring"] and info["broadcaster"].has_viewer(request.sid):
+        # 仅当前客户端退出观看，最后一个观看者退出时才真正停止镜像
+        leave_rooms(device_id, info["broadcaster"])
+        device_manager.leave_mirror(device_id, request.sid)
+        broadcast_device_list()
         emit('mirror_stopped', {'device_id': device_id})
     else:
         emit('mirror_error', '停止镜像失败')
 
+@socketio.on('video_transport')
+def handle_video_transport(data):
+    """切换当前客户端的视频通道，用于专用 WebSocket 不可用时回退到 Socket.IO"""
+    device_id = data.get('device_id')
+    broadcaster = device_manager.get_broadcaster(device_id)
+    if not broadcaster or not broadcaster.set_transport(request.sid, get_transport(data)):
+        emit('mirror_error', '切换视频通道失败')
+
+@socketio.on('start_recording')
+def handle_start_recording(data):
+    """开始录制设备镜像（原样封装为 fragmented MP4，保存在 data/recordings）"""
+    device_id = data.get('device_id')
+    broadcaster = device_manager.get_broadcaster(device_id)
+    if not broadcaster:
+        emit('recording_error', '设备未在镜像状态')
+        return
+    success, message = broadcaster.start_recording()
+    if success:
+        socketio.emit('recording_started', {'device_id': device_id}, to=broadcaster.room)
+    else:
+        emit('recording_error', message)
+
+@socketio.on('stop_recording')
+def handle_stop_recording(data):
+    device_id = data.get('device_id')
+    broadcaster = device_manager.get_broadcaster(device_id)
+    info = broadcaster.stop_recording() if broadcaster else None
+    if info is None:
+        emit('recording_error', '设备未在录制')
+        return
+    socketio.emit('recording_stopped', info, to=broadcaster.room)
+
 @socketio.on('disconnect')
 def handle_disconnect():
-    global client_sid
-    client_sid = None
     print('Client disconnected')
-    # 停止所有正在镜像的设备
+    # 仅移除该客户端的观看，无人观看的镜像会被停止
+    stopped = False
     for device_id in list(device_manager.devices.keys()):
-        if device_manager.devices[device_id]["is_mirroring"]:
-            device_manager.stop_mirror(device_id)
+        stopped = device_manager.leave_mirror(device_id, request.sid) or stopped
+    if stopped:
+        broadcast_device_list()
     print('Session cleaned up')
 
+@socketio.on('viewer_activity')
+def handle_viewer_activity(data):
+    """仅观看的客户端不发送控制事件，由其定期上报用户操作，避免会话被当作空闲回收"""
+    broadcaster = device_manager.get_broadcaster(data.get('device_id'))
+    if broadcaster and broadcaster.has_viewer(request.sid):
+        broadcaster.record_activity()
+
+@socketio.on('request_keyframe')
+def handle_request_keyframe(data):
+    """浏览器解码积压丢帧后请求关键帧，由广播器限频后经控制通道发给设备"""
+    broadcaster = device_manager.get_broadcaster(data.get('device_id'))
+    if broadcaster and broadcaster.has_viewer(request.sid):
+        broadcaster.request_keyframe()
+
+@socketio.on('clock_sync')
+def handle_clock_sync(data=None):
+    """返回服务器时间（毫秒），浏览器据往返时间估计两端时钟差，用于换算网络传输延迟"""
+    return time.time() * 1000
+
+@socketio.on('latency_report')
+def handle_latency_report(data):
+    """浏览器上报的分阶段画面延迟样本，记录到 scrcpy_frame_latency_seconds 直方图"""
+    broadcaster = device_manager.get_broadcaster(data.get('device_id'))
+    samples = data.get('samples')
+    if broadcaster and broadcaster.has_viewer(request.sid) and isinstance(samples, list):
+        broadcaster.record_frame_latency(samples)
+
+def parse_event_count(value):
+    """浏览器上报的批次事件数：非法值按 1 计，上限为控制写入队列的长度"""
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return 1
+    return min(max(count, 1), MAX_CONTROL_QUEUE)
+
 @socketio.on('control_data')
 def handle_control_data(data):
-    print(f"Received control data: {data}")  # 添加调试信息
+    """
+    接收浏览器发来的控制事件批次（若干条 scrcpy 控制消息首尾相接），放入该设备的控制写入队列
+    返回值（是否已入队，多进程模式下为是否已交给工作进程）作为 Socket.IO 确认，在写入设备之前发出，
+    浏览器据此统计控制事件到服务器入队的延迟
+    """
     device_id = data.get('device_id')
+    control_data = data.get('data')
+    count = parse_event_count(data.get('count', 1))
+    if control_debug:
+        print(f"Received control data for {device_id}: {len(control_data or b'')} bytes, {count} events")
     if device_id and device_id in device_manager.devices:
-        device_info = device_manager.devices[device_id]
-        if device_info["is_mirroring"] and device_info["scrcpy"]:
+        broadcaster = device_manager.get_broadcaster(device_id)
+        if broadcaster and not broadcaster.can_control(request.sid):
+            emit('control_error', '当前为仅观看模式，不能控制设备')
+            return False
+        scpy = device_manager.get_scrcpy(device_id)
+        if scpy:
             try:
-                control_data = data.get('data')
-                if control_data:
-                    print(f"Sending control data to device {device_id}: {len(control_data)} bytes")  # 调试信息
-                    device_info["scrcpy"].scrcpy_send_control(control_data)
-                    print("Control data sent successfully")  # 调试信息
-                else:
-                    print("No control data found in request")  # 调试信息
+                if not control_data:
+                    return False
+                accepted = scpy.scrcpy_send_control(control_data)
+                if accepted:
+                    broadcaster.record_input(count)
+                elif control_debug:
+                    print(f"Control queue full for {device_id}, dropped {count} events")
+                return accepted
             except Exception as e:
                 print(f"Error sending control data: {e}")
                 emit('control_error', f'发送控制数据失败: {e}')
         else:
-            print(f"Device {device_id} is not mirroring or scrcpy instance not found")  # 调试信息
+            if control_debug:
+                print(f"Device {device_id} is not mirroring or scrcpy instance not found")
             emit('control_error', '设备未在镜像状态')
     else:
-        print(f"Device {device_id} not found in device manager")  # 调试信息
+        if control_debug:
+            print(f"Device {device_id} not found in device manager")
         emit('control_error', '设备未找到')
+    return False
 
 
 
@@ -482,6 +815,70 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Web server for scrcpy')
     parser.add_argument('--video_bit_rate', default="1024000", help='scrcpy video bit rate')
     parser.add_argument('--port', type=int, default=5000, help='port to bind the web server to')
+    parser.add_argument('--async_mode', choices=ASYNC_MODES, default='threading',
+                        help='threading runs the Werkzeug development server with a thread per connection; '
+                             'gevent runs the gevent WSGI server with a greenlet per connection (production)')
+    parser.add_argument('--max_connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help='maximum number of concurrent HTTP/WebSocket connections in gevent mode (0 = unlimited)')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help='listen backlog of the server socket in gevent mode')
+    parser.add_argument('--max_sessions', type=int, default=DEFAULT_MAX_SESSIONS,
+                        help='maximum number of devices mirrored at the same time (0 = unlimited)')
+    parser.add_argument('--disable_adaptive_quality', action='store_true',
+                        help='keep the configured bit rate instead of adapting to slow viewers')
+    parser.add_argument('--control_debug', action='store_true',
+                        help='log every control event batch received from browsers')
+    parser.add_argument('--worker_processes', action='store_true',
+                        help='run each device session in its own worker process, sharing video through shared memory')
+    parser.add_argument('--worker_ring_size', type=int, default=64,
+                        help='shared-memory ring buffer size per device in MiB (with --worker_processes)')
+    parser.add_argument('--io_reactors', type=int, default=0,
+                        help='multiplex all device sockets on this many selector-based I/O loops '
+                             'instead of several threads per session (0 = thread per stream)')
+    parser.add_argument('--disable_native_adb', action='store_true',
+                        help='run the adb executable for every command instead of talking to the adb server directly')
     args = parser.parse_args()
     video_bit_rate = args.video_bit_rate
-    socketio.run(app, host='0.0.0.0', port=args.port, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    device_manager.max_sessions = args.max_sessions
+    control_debug = args.control_debug
+    ADBManager.use_native = not args.disable_native_adb
+    if args.worker_processes:
+        VideoBroadcaster.session_factory = partial(WorkerScrcpy, args.worker_ring_size * 1024 * 1024)
+    if args.io_reactors > 0:
+        Scrcpy.reactors = ReactorPool(args.io_reactors)
+        Scrcpy.reactors.start()
+    # 回收上次异常退出遗留的 scrcpy 端口转发
+    stale_forwards = device_manager.adb_manager.reclaim_forwards(SCRCPY_SOCKET_NAME)
+    if stale_forwards:
+        print(f"Removed {stale_forwards} stale scrcpy forwards")
+    # 跟踪设备上下线与授权状态，设备表变化时推送给客户端
+    ADBManager.tracker = DeviceTracker(device_manager.adb_manager, on_change=handle_device_changes)
+    ADBManager.tracker.start()
+    socketio.start_background_task(idle_reaper_task)
+    if not args.disable_adaptive_quality:
+        quality_controller = AdaptiveQualityController(video_bit_rate)
+        socketio.start_background_task(adaptive_quality_task)
+    if ASYNC_MODE == 'gevent':
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIHandler
+
+        class WebSocketHandler(WSGIHandler):
+            """
+            WebSocket 处理函数返回后结束连接：pywsgi 默认按 keep-alive 继续读取，
+            会把客户端随后发来的 WebSocket 帧（如关闭帧）当作 HTTP 请求解析并记录错误
+            """
+            def handle_one_response(self):
+                super().handle_one_response()
+                if self.environ.get('HTTP_UPGRADE', '').lower() == 'websocket':
+                    self.close_connection = True
+
+        print(f"Serving with gevent on port {args.port} "
+              f"(max connections: {args.max_connections or 'unlimited'}, backlog: {args.backlog})")
+        try:
+            socketio.run(app, host='0.0.0.0', port=args.port, backlog=args.backlog,
+                         handler_class=WebSocketHandler,
+                         spawn=Pool(args.max_connections) if args.max_connections > 0 else 'default')
+        except KeyboardInterrupt:
+            pass  # 与 Werkzeug 一样，Ctrl+C 正常退出而不打印异常栈
+    else:
+        socketio.run(app, host='0.0.0.0', port=args.port, allow_unsafe_werkzeug=True)
\ No newline at end of file
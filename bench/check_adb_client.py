@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+用模拟 ADB server（fake_adb_server.py）检查原生 ADB 客户端（adb_client.py）的协议实现：
+get-state、forward / list-forward / killforward、transport + shell、sync 推送、track-devices 以及连接池的后台补充。
+不需要真机或 adb 可执行文件，全部检查通过时退出码为 0
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+STATE_DIR = tempfile.mkdtemp(prefix='fake-adb-check-')
+os.environ['FAKE_ADB_STATE'] = STATE_DIR  # fake_adb 在导入时读取状态目录
+
+from adb_client import ADBClient, ADBError  # noqa: E402
+from fake_adb_server import FakeADBServer  # noqa: E402
+
+SERIAL = '127.0.0.1:5555'
+
+
+def expect_error(func, *args):
+    try:
+        func(*args)
+    except ADBError as e:
+        return str(e)
+    raise AssertionError(f"{func.__name__}{args} did not fail")
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def run_checks(client, server):
+    checks = []
+
+    def check(name, condition):
+        checks.append(name)
+        assert condition, name
+        print(f"ok   {name}")
+
+    check("version", client.version() == 0x29)
+    check("no devices before connect", client.devices() == [])
+    check("connect", 'connected' in client.connect(SERIAL))
+    check("devices", client.devices() == [(SERIAL, 'device')])
+
+    check("host-serial get-state", client.get_state(SERIAL) == 'device')
+    check("get-state request uses host-serial", f"host-serial:{SERIAL}:get-state" in server.requests)
+    check("get-state of unknown device fails", 'not found' in expect_error(client.get_state, '10.0.0.1:5555'))
+
+    port = client.forward(SERIAL, 'tcp:0', 'localabstract:scrcpy')
+    check("forward tcp:0 returns a port", isinstance(port, int) and port > 0)
+    check("forward with fixed port", client.forward(SERIAL, 'tcp:27183', 'localabstract:other') == 27183)
+    forwards = client.list_forward(SERIAL)
+    check("list-forward", (SERIAL, f'tcp:{port}', 'localabstract:scrcpy') in forwards and len(forwards) == 2)
+    client.kill_forward(SERIAL, f'tcp:{port}')
+    check("killforward", client.list_forward() == [(SERIAL, 'tcp:27183', 'localabstract:other')])
+    check("killforward of unknown port fails", 'not found' in expect_error(client.kill_forward, SERIAL, f'tcp:{port}'))
+
+    check("transport + shell", 'default via' in client.shell(SERIAL, 'ip route'))
+    check("transport request precedes shell", f"host:transport:{SERIAL}" in server.requests)
+    check("transport to unknown device fails", 'not found' in expect_error(client.shell, '10.0.0.1:5555', 'ip route'))
+
+    # 大于一个 DATA 块的文件，检查分块与 DONE 应答
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(150 * 1024))
+        local_path = f.name
+    try:
+        with open(local_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        client.push(SERIAL, local_path, '/data/local/tmp/check.bin')
+        output = client.shell(SERIAL, 'sha256sum /data/local/tmp/check.bin')
+        check("sync push", output.split()[0] == digest)
+    finally:
+        os.remove(local_path)
+
+    sock = client.open_track_devices()
+    try:
+        check("track-devices initial list", client.read_device_list(sock) == [(SERIAL, 'device')])
+        client.connect('127.0.0.1:5556')
+        check("track-devices change", client.read_device_list(sock) == [(SERIAL, 'device'), ('127.0.0.1:5556', 'device')])
+    finally:
+        sock.close()
+    client.disconnect('127.0.0.1:5556')
+
+    # 连接池：请求线程不补充连接，补充由后台线程完成
+    client.version()
+    check("pool refilled in background", wait_until(lambda: len(client.idle) == client.max_idle))
+    refills = [t for t in threading.enumerate() if t.name == 'adb-pool-refill']
+    check("refill threads finish", wait_until(lambda: not any(t.is_alive() for t in refills)))
+    return checks
+
+
+def main():
+    server = FakeADBServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ADBClient(port=server.port, timeout=5.0)
+    try:
+        checks = run_checks(client, server)
+    except AssertionError as e:
+        print(f"FAIL {e}")
+        return 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
+    print(f"{len(checks)} checks passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+模拟 adb 可执行文件，供基准测试通过环境变量 ADB_PATH 注入 web 服务器
+支持 connect / disconnect / devices / get-state / push / forward / shell，设备状态保存在 FAKE_ADB_STATE 目录。
+启动 scrcpy-server 的 shell 命令会在本进程内运行模拟服务端，进程存活即服务端存活，与真实 adb shell 一致
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shlex
+import socket
+import sys
+
+from fake_scrcpy_server import create_server, parse_server_options
+
+STATE_DIR = os.environ.get('FAKE_ADB_STATE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.fake_adb')
+STATE_FILE = os.path.join(STATE_DIR, 'state.json')
+LOCK_FILE = os.path.join(STATE_DIR, 'state.lock')
+
+
+def lock_state():
+    """多个 adb 进程会并发读写状态文件，整条命令持有排他锁"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    lock = open(LOCK_FILE, 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"devices": [], "pushed": {}, "forwards": []}
+
+
+def save_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = f"{STATE_FILE}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def fail(message):
+    print(f"error: {message}", file=sys.stderr)
+    return 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def forward(state, serial, args):
+    if args[0] == '--list':
+        for item in state['forwards']:
+            print(f"{item[0]} {item[1]} {item[2]}")
+        return 0
+    if args[0] == '--remove':
+        state['forwards'] = [item for item in state['forwards'] if item[1] != args[1]]
+        save_state(state)
+        return 0
+    if args[0] == '--remove-all':
+        state['forwards'] = [item for item in state['forwards'] if item[0] != serial]
+        save_state(state)
+        return 0
+    local, remote = args[0], args[1]
+    if local == 'tcp:0':
+        local = f"tcp:{free_port()}"
+        print(local.split(':', 1)[1])
+    state['forwards'] = [item for item in state['forwards'] if item[1] != local] + [[serial, local, remote]]
+    save_state(state)
+    return 0
+
+
+def shell(state, serial, command, lock):
+    args = shlex.split(command)
+    if not args:
+        return fail("interactive shell is not supported")
+    if args[0] == 'sha256sum':
+        digest = state['pushed'].get(serial, {}).get(args[1])
+        if not digest:
+            return fail(f"{args[1]}: No such file or directory")
+        print(f"{digest}  {args[1]}")
+        return 0
+    if args[0] == 'ip':
+        print("default via 127.0.0.1 dev wlan0\n127.0.0.0/8 dev wlan0 proto kernel scope link src 127.0.0.1")
+        return 0
+    if any(arg.startswith('CLASSPATH=') for arg in args) and 'app_process' in args:
+        forwards = [item for item in state['forwards'] if item[0] == serial and item[2] == 'localabstract:scrcpy']
+        if not forwards:
+            return fail("no scrcpy forward for device")
+        port = int(forwards[-1][1].split(':', 1)[1])
+        lock.close()  # 服务端运行期间不占用状态锁
+        print(f"[server] INFO: fake scrcpy-server listening on {port}", file=sys.stderr, flush=True)
+        try:
+            create_server(port, parse_server_options(args)).serve()
+        except (OSError, KeyboardInterrupt):
+            pass
+        return 0
+    return fail(f"unsupported shell command: {command}")
+
+
+def main(argv):
+    serial = None
+    if len(argv) >= 2 and argv[0] == '-s':
+        serial, argv = argv[1], argv[2:]
+    if not argv:
+        return fail("no command")
+    command, args = argv[0], argv[1:]
+    lock = lock_state()
+    state = load_state()
+    if serial is None and state['devices']:
+        serial = state['devices'][0]
+    if command in ('start-server', 'kill-server'):
+        return 0
+    if command == 'version':
+        print("Android Debug Bridge version 1.0.41 (fake)")
+        return 0
+    if command == 'devices':
+        print("List of devices attached")
+        for device in state['devices']:
+            print(f"{device}\tdevice")
+        return 0
+    if command == 'connect':
+        if args[0] not in state['devices']:
+            state['devices'].append(args[0])
+            save_state(state)
+        print(f"connected to {args[0]}")
+        return 0
+    if command == 'disconnect':
+        state['devices'] = [d for d in state['devices'] if args and d != args[0]]
+        save_state(state)
+        print("disconnected")
+        return 0
+    if serial not in state['devices']:
+        return fail(f"device '{serial}' not found")
+    if command == 'get-state':
+        print("device")
+        return 0
+    if command == 'push':
+        with open(args[0], 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        state['pushed'].setdefault(serial, {})[args[1]] = digest
+        save_state(state)
+        print(f"{args[0]}: 1 file pushed")
+        return 0
+    if command == 'forward':
+        return forward(state, serial, args)
+    if command == 'shell':
+        return shell(state, serial, ' '.join(args), lock)
+    return fail(f"unsupported command: {command}")
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+模拟 ADB server 的智能套接字（smart socket）协议，供原生 ADB 客户端（adb_client.py）的检查与基准测试使用
+请求为 4 位十六进制长度 + 服务名，应答为 OKAY 或 FAIL + 长度前缀的错误信息。
+设备状态与 fake_adb.py 共用 FAKE_ADB_STATE 目录，因此通过本服务建立的转发可被模拟 adb 的 shell 命令
+（启动模拟 scrcpy-server）读取。支持 host:version / devices / track-devices / connect / disconnect、
+host-serial:<serial>:get-state / forward / killforward / list-forward，以及 transport 之后的 shell: 与 sync: 推送
+"""
+import argparse
+import hashlib
+import json
+import shlex
+import socket
+import socketserver
+import struct
+import time
+
+from fake_adb import free_port, load_state, lock_state, save_state
+
+TRACK_POLL_INTERVAL = 0.2  # track-devices 检查状态文件变化的间隔（秒）
+
+
+def encode_string(text):
+    payload = text.encode('utf-8')
+    return b'%04x' % len(payload) + payload
+
+
+class ProtocolError(Exception):
+    """请求无法处理，以 FAIL 应答"""
+
+
+class FakeADBHandler(socketserver.BaseRequestHandler):
+    def recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_request(self):
+        length = int(self.recv_exact(4), 16)
+        return self.recv_exact(length).decode('utf-8')
+
+    def okay(self, reply=None):
+        self.request.sendall(b'OKAY' + (encode_string(reply) if reply is not None else b''))
+
+    def fail(self, message):
+        self.request.sendall(b'FAIL' + encode_string(message))
+
+    def handle(self):
+        serial = None
+        try:
+            while True:
+                service = self.read_request()
+                self.server.requests.append(service)
+                if service.startswith('host:transport'):
+                    serial = self.select_transport(service)
+                    self.okay()
+                    continue
+                if serial is not None:
+                    self.device_service(serial, service)
+                else:
+                    self.host_service(service)
+                return
+        except ProtocolError as e:
+            self.fail(str(e))
+        except (ConnectionError, OSError, ValueError):
+            pass
+
+    # ---- host 服务 ----
+
+    @staticmethod
+    def require_device(state, serial):
+        if serial is None:
+            if not state['devices']:
+                raise ProtocolError("no devices/emulators found")
+            return state['devices'][0]
+        if serial not in state['devices']:
+            raise ProtocolError(f"device '{serial}' not found")
+        return serial
+
+    def select_transport(self, service):
+        with lock_state():
+            state = load_state()
+        serial = None if service == 'host:transport-any' else service.split(':', 2)[2]
+        return self.require_device(state, serial)
+
+    def host_service(self, service):
+        if service.startswith('host-serial:'):
+            # host-serial:<serial>:<command>，serial 本身可能包含冒号（ip:port）
+            rest = service[len('host-serial:'):]
+            for command in ('get-state', 'forward:', 'killforward:', 'list-forward'):
+                index = rest.find(':' + command)
+                if index >= 0:
+                    serial, command = rest[:index], rest[index + 1:]
+                    break
+            else:
+                raise ProtocolError(f"unsupported service: {service}")
+        elif service.startswith('host:'):
+            serial, command = None, service[len('host:'):]
+        else:
+            raise ProtocolError(f"unsupported service: {service}")
+
+        if command == 'version':
+            self.okay('0029')
+        elif command == 'devices':
+            self.okay(self.device_list())
+        elif command == 'track-devices':
+            self.track_devices()
+        else:
+            with lock_state():
+                state = load_state()
+                self.host_command(state, serial, command)
+
+    @staticmethod
+    def device_list():
+        with lock_state():
+            state = load_state()
+        return ''.join(f"{device}\tdevice\n" for device in state['devices'])
+
+    def track_devices(self):
+        self.okay()
+        last = None
+        while True:
+            devices = self.device_list()
+            if devices != last:
+                self.request.sendall(encode_string(devices))
+                last = devices
+            time.sleep(TRACK_POLL_INTERVAL)
+
+    def host_command(self, state, serial, command):
+        """调用方持有状态锁"""
+        if command.startswith('connect:'):
+            address = command.split(':', 1)[1]
+            if address not in state['devices']:
+                state['devices'].append(address)
+                save_state(state)
+            self.okay(f"connected to {address}")
+        elif command.startswith('disconnect'):
+            address = command.partition(':')[2]
+            state['devices'] = [d for d in state['devices'] if address and d != address]
+            save_state(state)
+            self.okay("disconnected")
+        elif command == 'get-state':
+            self.require_device(state, serial)
+            self.okay('device')
+        elif command == 'list-forward':
+            forwards = [item for item in state['forwards'] if serial is None or item[0] == serial]
+            self.okay(''.join(f"{item[0]} {item[1]} {item[2]}\n" for item in forwards))
+        elif command.startswith('forward:'):
+            serial = self.require_device(state, serial)
+            local, _, remote = command[len('forward:'):].partition(';')
+            port = None
+            if local == 'tcp:0':
+                port = free_port()
+                local = f"tcp:{port}"
+            state['forwards'] = [item for item in state['forwards'] if item[1] != local] + [[serial, local, remote]]
+            save_state(state)
+            # 第一次 OKAY 表示找到设备，第二次表示转发已建立，tcp:0 时随后返回分配的端口
+            self.request.sendall(b'OKAY' + b'OKAY' + (encode_string(str(port)) if port else b''))
+        elif command.startswith('killforward:'):
+            local = command.split(':', 1)[1]
+            if not any(item[1] == local for item in state['forwards']):
+                raise ProtocolError(f"listener '{local}' not found")
+            state['forwards'] = [item for item in state['forwards'] if item[1] != local]
+            save_state(state)
+            self.request.sendall(b'OKAY' + b'OKAY')
+        else:
+            raise ProtocolError(f"unsupported host command: {command}")
+
+    # ---- 设备服务 ----
+
+    def device_service(self, serial, service):
+        if service.startswith('shell:'):
+            output = self.shell(serial, service[len('shell:'):])
+            self.okay()
+            self.request.sendall(output.encode('utf-8'))
+        elif service == 'sync:':
+            self.okay()
+            self.sync(serial)
+        else:
+            raise ProtocolError(f"unsupported device service: {service}")
+
+    @staticmethod
+    def shell(serial, command):
+        """v1 shell 协议没有退出码，错误信息与输出一样写入数据流"""
+        args = shlex.split(command)
+        if args and args[0] == 'sha256sum' and len(args) > 1:
+            with lock_state():
+                digest = load_state()['pushed'].get(serial, {}).get(args[1])
+            if not digest:
+                return f"sha256sum: {args[1]}: No such file or directory\n"
+            return f"{digest}  {args[1]}\n"
+        if args and args[0] == 'ip':
+            return "default via 127.0.0.1 dev wlan0\n127.0.0.0/8 dev wlan0 proto kernel scope link src 127.0.0.1\n"
+        return f"/system/bin/sh: unsupported command: {command}\n"
+
+    def sync(self, serial):
+        """sync 协议：SEND 路径,权限；若干 DATA 块；DONE 修改时间，应答 OKAY；QUIT 结束"""
+        path = None
+        digest = hashlib.sha256()
+        while True:
+            command = self.recv_exact(4)
+            length = struct.unpack('<I', self.recv_exact(4))[0]
+            if command == b'SEND':
+                path = self.recv_exact(length).decode('utf-8').rsplit(',', 1)[0]
+                digest = hashlib.sha256()
+            elif command == b'DATA':
+                digest.update(self.recv_exact(length))
+            elif command == b'DONE':
+                with lock_state():
+                    state = load_state()
+                    state['pushed'].setdefault(serial, {})[path] = digest.hexdigest()
+                    save_state(state)
+                self.request.sendall(b'OKAY' + struct.pack('<I', 0))
+            elif command == b'QUIT':
+                return
+            else:
+                message = f"unknown sync command {command!r}".encode('utf-8')
+                self.request.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+                return
+
+
+class FakeADBServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), FakeADBHandler)
+        self.requests = []  # 收到的服务名，供检查脚本断言
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake adb server speaking the smart-socket protocol')
+    parser.add_argument('--port', type=int, default=5037)
+    args = parser.parse_args()
+    server = FakeADBServer(args.port)
+    print(json.dumps({"port": server.port}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
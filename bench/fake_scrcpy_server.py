@@ -0,0 +1,197 @@
+"""
+模拟 scrcpy-server：在本机 TCP 端口上按 scrcpy 3.1 tunnel_forward 协议输出视频（可选音频），
+读取并丢弃控制消息。视频可以是合成数据，也可以循环回放 Annex-B 格式的 H.264 文件。
+每个视频包的 pts 填写发送时刻的系统时间（微秒），观看者据此计算端到端延迟
+"""
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recorder import split_annexb  # noqa: E402
+from scrcpy import CONTROL_MSG_TYPE_RESET_VIDEO, DEVICE_NAME_LENGTH, split_control_messages  # noqa: E402
+
+CODEC_H264 = 0x68323634
+CODEC_OPUS = 0x6f707573
+FLAG_CONFIG = 1 << 63
+FLAG_KEY_FRAME = 1 << 62
+ACCEPT_TIMEOUT = 30.0  # 等待 web 服务器连接的时间，超时后退出，避免遗留进程
+
+# 合成流使用的 SPS/PPS（Baseline 720x1280），帧数据为填充字节，只用于压测传输链路
+SYNTHETIC_CONFIG = (b'\x00\x00\x00\x01\x67\x42\xc0\x1f\xda\x01\x40\x16\xe8\x06\xd0\xa1\x35'
+                    b'\x00\x00\x00\x01\x68\xce\x06\xe2')
+
+
+def packet(pts, payload, config=False, keyframe=False):
+    flags = (FLAG_CONFIG if config else 0) | (FLAG_KEY_FRAME if keyframe else 0)
+    return struct.pack('>QI', flags | pts, len(payload)) + payload
+
+
+def wall_clock_us():
+    return time.time_ns() // 1000
+
+
+def synthetic_stream(frame_size, keyframe_interval):
+    """返回 (config, frames)，frames 为 [(keyframe, annexb)]，每个 GOP 一个关键帧"""
+    frames = []
+    for i in range(keyframe_interval):
+        keyframe = i == 0
+        header = b'\x00\x00\x00\x01' + (b'\x65' if keyframe else b'\x41')
+        frames.append((keyframe, header + bytes(frame_size * (4 if keyframe else 1))))
+    return SYNTHETIC_CONFIG, frames
+
+
+def load_annexb(path):
+    """
+    把 Annex-B 文件拆分为 (config, frames)
+    每个图像 NAL（类型 1 / 5）视为一帧，之前的 SEI / AUD 等附加到该帧；多 slice 编码的流不适用
+    """
+    with open(path, 'rb') as f:
+        nals = split_annexb(f.read())
+    config = b''
+    frames = []
+    pending = b''
+    for nal in nals:
+        nal_type = nal[0] & 0x1f
+        data = b'\x00\x00\x00\x01' + nal
+        if nal_type in (7, 8):
+            if not frames:
+                config += data
+        elif nal_type in (1, 5):
+            frames.append((nal_type == 5, pending + data))
+            pending = b''
+        else:
+            pending += data
+    if not config or not frames:
+        raise ValueError(f"{path} does not contain SPS/PPS and frames")
+    return config, frames
+
+
+class FakeScrcpyServer:
+    def __init__(self, port, config, frames, fps=60, width=720, height=1280, audio=True, control=True,
+                 device_name='BenchPhone'):
+        self.port = port
+        self.config = config
+        self.frames = frames
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.audio = audio
+        self.control = control
+        self.device_name = device_name
+        self.reset_video = threading.Event()
+        self.control_messages = 0
+
+    def serve(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', self.port))
+        server.listen(4)
+        server.settimeout(ACCEPT_TIMEOUT)
+        try:
+            # 与真实服务端一致：第一个连接建立后立即发送 1 字节的 dummy byte
+            video = server.accept()[0]
+            video.sendall(b'\x00')
+            audio = server.accept()[0] if self.audio else None
+            control = server.accept()[0] if self.control else None
+        finally:
+            server.close()
+        for sock in (video, audio, control):
+            if sock:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if audio:
+            threading.Thread(target=self.audio_task, args=(audio,), daemon=True).start()
+        if control:
+            threading.Thread(target=self.control_task, args=(control,), daemon=True).start()
+        self.video_task(video)
+
+    def video_task(self, sock):
+        name = self.device_name.encode('utf-8')[:DEVICE_NAME_LENGTH - 1]
+        sock.sendall(name.ljust(DEVICE_NAME_LENGTH, b'\x00') + struct.pack('>III', CODEC_H264, self.width, self.height))
+        sock.sendall(packet(wall_clock_us(), self.config, config=True))
+        interval = 1.0 / self.fps
+        next_time = time.monotonic()
+        index = 0
+        try:
+            while True:
+                if self.reset_video.is_set():
+                    # 模拟编码器重启：重新发送配置包，从关键帧开始
+                    self.reset_video.clear()
+                    sock.sendall(packet(wall_clock_us(), self.config, config=True))
+                    index = 0
+                keyframe, data = self.frames[index % len(self.frames)]
+                sock.sendall(packet(wall_clock_us(), data, keyframe=keyframe))
+                index += 1
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+        except OSError:
+            pass
+
+    def audio_task(self, sock):
+        # Opus，每 20ms 一个包
+        try:
+            sock.sendall(struct.pack('>I', CODEC_OPUS))
+            sock.sendall(packet(0, b'OpusHead' + bytes(11), config=True))
+            while True:
+                sock.sendall(packet(wall_clock_us(), bytes(120)))
+                time.sleep(0.02)
+        except OSError:
+            pass
+
+    def control_task(self, sock):
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                for _, message in split_control_messages(data):
+                    self.control_messages += 1
+                    if message[0] == CONTROL_MSG_TYPE_RESET_VIDEO:
+                        self.reset_video.set()
+        except OSError:
+            pass
+
+
+def parse_server_options(args):
+    """解析 scrcpy-server 的 key=value 启动参数"""
+    options = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if sep:
+            options[key] = value
+    return options
+
+
+def create_server(port, server_options=None):
+    """按环境变量（由基准测试脚本设置）与 scrcpy-server 启动参数创建模拟服务端"""
+    server_options = server_options or {}
+    video = os.environ.get('FAKE_SCRCPY_VIDEO')
+    if video:
+        config, frames = load_annexb(video)
+    else:
+        config, frames = synthetic_stream(int(os.environ.get('FAKE_SCRCPY_FRAME_SIZE', 8000)),
+                                          int(os.environ.get('FAKE_SCRCPY_KEYFRAME_INTERVAL', 60)))
+    fps = int(os.environ.get('FAKE_SCRCPY_FPS', 60))
+    if int(server_options.get('max_fps', 0) or 0):
+        fps = min(fps, int(server_options['max_fps']))
+    width, height = (int(v) for v in os.environ.get('FAKE_SCRCPY_SIZE', '720x1280').split('x'))
+    return FakeScrcpyServer(port, config, frames, fps=fps, width=width, height=height,
+                            audio=server_options.get('audio', 'true') != 'false',
+                            control=server_options.get('control', 'true') != 'false')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake scrcpy server for benchmarks')
+    parser.add_argument('port', type=int)
+    parser.add_argument('options', nargs='*', help='scrcpy-server key=value options')
+    args = parser.parse_args()
+    create_server(args.port, parse_server_options(args.options)).serve()
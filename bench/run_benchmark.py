@@ -0,0 +1,472 @@
+"""
+流媒体基准测试
+在临时目录中启动 app.py（通过 ADB_PATH 使用模拟 adb 与模拟 scrcpy-server），
+连接 N 个 Socket.IO 合成观看者，统计帧率、端到端延迟分位数以及服务器进程的 CPU 和内存。
+视频可经 Socket.IO 事件或专用二进制 WebSocket 通道（--transport websocket）接收；结束后检查服务器日志，
+出现异常栈或无法解析的请求时以非零退出码结束。
+
+端到端延迟 = 观看者收到视频包的时刻 - 模拟服务端发送该包的时刻（写在 pts 中），两者在同一台机器上。
+
+依赖：python-socketio[client]，psutil（可选，用于 CPU / 内存统计），simple-websocket（WebSocket 通道，随 flask-sock 安装）
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+try:
+    import socketio
+except ImportError:
+    sys.exit("python-socketio is required: pip install 'python-socketio[client]'")
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import simple_websocket
+except ImportError:
+    simple_websocket = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SESSION_HEADER_LENGTH = 64 + 12
+PACKET_HEADER_LENGTH = 12
+PACKET_FLAG_CONFIG = 1 << 63
+PACKET_PTS_MASK = (1 << 62) - 1
+DEVICE_BASE_PORT = 5555
+TRANSPORTS = ('socketio', 'websocket')
+# 服务器日志中出现即视为失败：未处理的异常，以及 keep-alive 连接把残留数据当作 HTTP 请求解析
+LOG_ERROR_MARKERS = ('Traceback (most recent call last)', 'Invalid HTTP method')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class SyntheticViewer:
+    """
+    合成观看者：与浏览器一样加入镜像并确认每个 video_data 批次，或打开专用 WebSocket 视频通道，不解码，
+    只按 scrcpy 分帧解析批次，记录收到的帧数和每帧的端到端延迟
+    """
+
+    def __init__(self, index, url, device_id, transport='socketio'):
+        self.index = index
+        self.url = url
+        self.device_id = device_id
+        self.transport = transport
+        self.client = socketio.Client(reconnection=False)
+        self.video_socket = None
+        self.reader = None
+        self.primed = False
+        self.recording = False
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []  # 毫秒
+        self.errors = []
+        self.started = threading.Event()
+        self.client.on('video_data', self.on_video_data)
+        self.client.on('mirror_started', self.on_mirror_started)
+        self.client.on('mirror_error', self.on_error)
+        self.client.on('connection_error', self.on_error)
+
+    def on_mirror_started(self, data):
+        if data.get('device_id') != self.device_id:
+            return
+        if self.transport == 'websocket' and self.video_socket is None:
+            try:
+                self.open_video_socket()
+            except Exception as e:
+                self.errors.append(f"video WebSocket: {e}")
+        self.started.set()
+
+    def on_error(self, message):
+        self.errors.append(message)
+        self.started.set()
+
+    def on_video_data(self, data):
+        self.handle_batch(data)
+        return True  # 确认批次，服务器据此做流控
+
+    def open_video_socket(self):
+        """与浏览器一样携带 Socket.IO 的 sid 打开二进制视频通道，在独立线程中读取"""
+        device = urllib.parse.quote(self.device_id, safe='')
+        url = f"{self.url.replace('http://', 'ws://', 1)}/ws/video/{device}?sid={self.client.get_sid()}"
+        self.video_socket = simple_websocket.Client.connect(url)
+        self.reader = threading.Thread(target=self.read_video_socket, daemon=True)
+        self.reader.start()
+
+    def read_video_socket(self):
+        try:
+            while True:
+                data = self.video_socket.receive()
+                # 文本消息为采样帧的时间信息，此处不使用
+                if isinstance(data, bytes):
+                    self.handle_batch(data)
+        except simple_websocket.ConnectionClosed:
+            pass
+
+    def handle_batch(self, data):
+        now_us = time.time_ns() // 1000
+        view = memoryview(data)
+        offset = 0
+        if not self.primed:
+            offset = SESSION_HEADER_LENGTH
+            self.primed = True
+        while offset + PACKET_HEADER_LENGTH <= len(view):
+            pts_flags, size = struct.unpack_from('>QI', view, offset)
+            offset += PACKET_HEADER_LENGTH + size
+            if offset > len(view):
+                break
+            if self.recording and not pts_flags & PACKET_FLAG_CONFIG:
+                self.frames += 1
+                self.latencies.append((now_us - (pts_flags & PACKET_PTS_MASK)) / 1000.0)
+        if self.recording:
+            self.bytes += len(data)
+
+    def connect(self, start_device):
+        self.client.connect(self.url, transports=['websocket'])
+        ip, port = self.device_id.rsplit(':', 1)
+        if start_device:
+            self.client.emit('connect_device', {'ip': ip, 'port': int(port), 'transport': self.transport})
+        else:
+            self.client.emit('start_mirror', {'device_id': self.device_id, 'transport': self.transport})
+
+    def reset(self):
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.recording = True
+
+    def leave(self):
+        """先退出镜像再断开，避免断开时仍有视频批次在途"""
+        self.recording = False
+        if self.client.connected:
+            self.client.emit('stop_mirror', {'device_id': self.device_id})
+
+    def close(self):
+        if self.video_socket is not None:
+            try:
+                self.video_socket.close()
+            except Exception:
+                pass
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+class ProcessSampler:
+    """每秒采样一次服务器进程的 CPU 占用与常驻内存"""
+
+    def __init__(self, pid, interval=1.0):
+        self.process = psutil.Process(pid) if psutil else None
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if not self.process:
+            return
+        self.process.cpu_percent(None)
+        self.running = True
+        self.thread = threading.Thread(target=self.sample_task, daemon=True)
+        self.thread.start()
+
+    def sample_task(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.cpu.append(self.process.cpu_percent(None))
+                self.rss.append(self.process.memory_info().rss / (1024 * 1024))
+            except psutil.Error:
+                break
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+
+def wait_for_server(url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/metrics", timeout=1).read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def read_metrics(url):
+    """读取 /metrics，返回 {指标名: 所有设备的合计值}"""
+    totals = {}
+    try:
+        body = urllib.request.urlopen(f"{url}/metrics", timeout=5).read().decode('utf-8')
+    except OSError:
+        return totals
+    for line in body.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name_labels, _, value = line.rpartition(' ')
+        name = name_labels.split('{', 1)[0]
+        try:
+            totals[name] = totals.get(name, 0.0) + float(value)
+        except ValueError:
+            pass
+    return totals
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def bench_env(args, workdir):
+    env = dict(os.environ)
+    env.update({
+        'ADB_PATH': os.path.join(BENCH_DIR, 'fake_adb.py'),
+        'FAKE_ADB_STATE': os.path.join(workdir, 'fake_adb'),
+        'FAKE_SCRCPY_FPS': str(args.fps),
+        'FAKE_SCRCPY_FRAME_SIZE': str(args.frame_size),
+        'FAKE_SCRCPY_KEYFRAME_INTERVAL': str(args.keyframe_interval),
+        'FAKE_SCRCPY_SIZE': args.size,
+        'PYTHONUNBUFFERED': '1',
+    })
+    if args.video:
+        env['FAKE_SCRCPY_VIDEO'] = os.path.abspath(args.video)
+    return env
+
+
+def start_adb_server(args, workdir):
+    """启动模拟 ADB server（智能套接字协议），与模拟 adb 共用状态目录"""
+    port = free_port()
+    log = open(os.path.join(workdir, 'adb_server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_adb_server.py'), '--port', str(port)],
+                               env=bench_env(args, workdir), stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"fake adb server did not start, see {workdir}/adb_server.log")
+
+
+def start_app(args, workdir, port, adb_port=None):
+    """
+    在临时工作目录中启动 app.py，data/.env 等运行时文件不会写入仓库
+    adb_port 为模拟 ADB server 的端口时使用原生 ADB 客户端，否则每条命令都运行模拟 adb
+    """
+    os.symlink(os.path.join(ROOT_DIR, 'scrcpy-server'), os.path.join(workdir, 'scrcpy-server'))
+    env = bench_env(args, workdir)
+    cmd = [sys.executable, os.path.join(ROOT_DIR, 'app.py'), '--port', str(port)]
+    if adb_port:
+        env['ANDROID_ADB_SERVER_PORT'] = str(adb_port)
+    else:
+        cmd.append('--disable_native_adb')
+    if not args.adaptive:
+        cmd.append('--disable_adaptive_quality')
+    cmd.extend(args.app_arg)
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def check_server_log(path, limit=5):
+    """返回服务器日志中最多 limit 行错误"""
+    errors = []
+    try:
+        with open(path, errors='replace') as f:
+            for line in f:
+                if any(marker in line for marker in LOG_ERROR_MARKERS):
+                    errors.append(line.strip())
+                    if len(errors) >= limit:
+                        break
+    except OSError as e:
+        errors.append(f"cannot read {path}: {e}")
+    return errors
+
+
+def stop_app(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='scrcpy-bench-')
+    port = args.port or free_port()
+    url = f"http://127.0.0.1:{port}"
+    adb_server, adb_port = start_adb_server(args, workdir) if args.native_adb else (None, None)
+    app = start_app(args, workdir, port, adb_port)
+    viewers = []
+    sampler = None
+    try:
+        if not wait_for_server(url):
+            raise RuntimeError(f"web server did not start, see {workdir}/app.log")
+        device_ids = [f"127.0.0.1:{DEVICE_BASE_PORT + i}" for i in range(args.devices)]
+        viewers = [SyntheticViewer(i, url, device_ids[i % len(device_ids)], args.transport) for i in range(args.viewers)]
+        # 每个设备的第一个观看者连接设备并启动会话，其余观看者加入已有会话
+        for viewer in viewers[:len(device_ids)]:
+            viewer.connect(start_device=True)
+        for viewer in viewers[:len(device_ids)]:
+            if not viewer.started.wait(timeout=20) or viewer.errors:
+                raise RuntimeError(f"mirror for {viewer.device_id} failed to start: {viewer.errors}")
+        for viewer in viewers[len(device_ids):]:
+            viewer.connect(start_device=False)
+        for viewer in viewers[len(device_ids):]:
+            viewer.started.wait(timeout=20)
+        failed = [viewer for viewer in viewers if viewer.errors]
+        if failed:
+            raise RuntimeError(f"viewer {failed[0].index} failed to join: {failed[0].errors}")
+
+        time.sleep(args.warmup)
+        before = read_metrics(url)
+        sampler = ProcessSampler(app.pid)
+        for viewer in viewers:
+            viewer.reset()
+        sampler.start()
+        started = time.monotonic()
+        time.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        for viewer in viewers:
+            viewer.recording = False
+        sampler.stop()
+        after = read_metrics(url)
+    finally:
+        for viewer in viewers:
+            viewer.leave()
+        time.sleep(1.0)
+        for viewer in viewers:
+            viewer.close()
+        # 等服务器处理完断开的连接再停止，否则 SIGINT 可能打断正在关闭连接的协程并留下异常栈
+        time.sleep(1.0)
+        stop_app(app)
+        log_errors = check_server_log(os.path.join(workdir, 'app.log'))
+        if adb_server:
+            adb_server.kill()
+            adb_server.wait()
+        if args.keep_workdir:
+            print(f"Work directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [value for viewer in viewers for value in viewer.latencies]
+    viewer_fps = [viewer.frames / elapsed for viewer in viewers]
+
+    def delta(name):
+        return after.get(name, 0.0) - before.get(name, 0.0)
+
+    return {
+        "config": {
+            "devices": args.devices,
+            "viewers": args.viewers,
+            "source_fps": args.fps,
+            "frame_size": args.frame_size,
+            "video": args.video,
+            "native_adb": args.native_adb,
+            "transport": args.transport,
+            "duration": round(elapsed, 2),
+        },
+        "source_fps": round(delta('scrcpy_video_frames_total') / elapsed / max(args.devices, 1), 2),
+        "viewer_fps": {
+            "mean": round(sum(viewer_fps) / len(viewer_fps), 2) if viewer_fps else 0.0,
+            "min": round(min(viewer_fps), 2) if viewer_fps else 0.0,
+        },
+        "throughput_mbps": round(sum(viewer.bytes for viewer in viewers) * 8 / elapsed / 1e6, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p90": round(percentile(latencies, 0.90), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(max(latencies), 2) if latencies else 0.0,
+        },
+        "dropped_frames": int(delta('scrcpy_dropped_frames_total')),
+        "cpu_percent": {
+            "mean": round(sum(sampler.cpu) / len(sampler.cpu), 1) if sampler and sampler.cpu else None,
+            "max": round(max(sampler.cpu), 1) if sampler and sampler.cpu else None,
+        },
+        "rss_mb_max": round(max(sampler.rss), 1) if sampler and sampler.rss else None,
+        "server_log_errors": log_errors,
+    }
+
+
+def print_report(result):
+    config = result["config"]
+    source = f"file {config['video']}" if config['video'] else f"synthetic {config['frame_size']} B/frame"
+    adb = 'native adb client' if config['native_adb'] else 'adb executable'
+    print(f"\n{config['devices']} device(s), {config['viewers']} viewer(s) over {config['transport']}, "
+          f"{config['duration']}s, source {config['source_fps']} fps ({source}, {adb})")
+    print(f"  source fps (per device) : {result['source_fps']}")
+    print(f"  viewer fps mean / min   : {result['viewer_fps']['mean']} / {result['viewer_fps']['min']}")
+    print(f"  throughput to viewers   : {result['throughput_mbps']} Mbit/s")
+    latency = result["latency_ms"]
+    print(f"  latency p50/p90/p99/max : {latency['p50']} / {latency['p90']} / {latency['p99']} / {latency['max']} ms")
+    print(f"  dropped frames          : {result['dropped_frames']}")
+    if result["cpu_percent"]["mean"] is None:
+        print("  cpu / memory            : install psutil to sample the server process")
+    else:
+        print(f"  cpu mean / max          : {result['cpu_percent']['mean']}% / {result['cpu_percent']['max']}%")
+        print(f"  rss max                 : {result['rss_mb_max']} MiB")
+    if result["server_log_errors"]:
+        print("  server log              : errors found")
+        for line in result["server_log_errors"]:
+            print(f"    {line}")
+    else:
+        print("  server log              : clean")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the web server with a fake scrcpy server and synthetic viewers')
+    parser.add_argument('--viewers', type=int, default=4, help='number of synthetic Socket.IO viewers')
+    parser.add_argument('--devices', type=int, default=1, help='number of fake devices, viewers are spread across them')
+    parser.add_argument('--duration', type=float, default=20.0, help='measurement duration in seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds to wait after all viewers joined')
+    parser.add_argument('--fps', type=int, default=60, help='frame rate of the fake scrcpy server')
+    parser.add_argument('--frame-size', type=int, default=8000,
+                        help='synthetic P-frame size in bytes (key frames are 4x)')
+    parser.add_argument('--keyframe-interval', type=int, default=60, help='synthetic GOP length in frames')
+    parser.add_argument('--video', help='replay an Annex-B H.264 file instead of synthetic frames')
+    parser.add_argument('--size', default='720x1280', help='video size reported by the fake server')
+    parser.add_argument('--adaptive', action='store_true', help='keep adaptive quality enabled on the server')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='socketio',
+                        help='receive video as Socket.IO events or over the dedicated WebSocket channel')
+    parser.add_argument('--native-adb', action='store_true',
+                        help='use the native adb client against bench/fake_adb_server.py instead of the fake adb executable')
+    parser.add_argument('--port', type=int, default=0, help='web server port (default: a free port)')
+    parser.add_argument('--app-arg', action='append', default=[], help='extra argument passed to app.py')
+    parser.add_argument('--json', help='also write the result as JSON to this file')
+    parser.add_argument('--keep-workdir', action='store_true', help='keep the temporary directory with app.log')
+    args = parser.parse_args()
+    if args.transport == 'websocket' and simple_websocket is None:
+        sys.exit("simple-websocket is required for --transport websocket: pip install simple-websocket")
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if result["server_log_errors"] else 0)
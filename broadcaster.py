@@ -0,0 +1,687 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from metrics import EMIT_LATENCY, FRAME_LATENCY
+from recorder import SessionRecorder, CODEC_H264
+from scrcpy import Scrcpy, DEVICE_NAME_LENGTH
+
+DEFAULT_HISTORY_SIZE = 300   # 广播历史中保留的视频包数量
+DEFAULT_MAX_IN_FLIGHT = 4    # 每个观看者允许未确认的批次数
+DEFAULT_MAX_BACKLOG = 60     # 每个观看者允许积压的视频包数量，超过后跳到最新关键帧
+ACK_TIMEOUT = 5.0            # 批次确认超时（秒），超时后视为已送达
+DEFAULT_MAX_GOP_REPLAY = 30  # 新观看者加入时最多回放的 GOP 帧数，更长时改为请求新关键帧
+MAX_GOP_CACHE = 1200         # GOP 缓存上限，超过后丢弃缓存直到下一个关键帧
+KEYFRAME_REQUEST_INTERVAL = 1.0  # 两次关键帧请求之间的最小间隔（秒）
+LATENCY_SMOOTHING = 0.2      # 发送延迟的指数平滑系数
+TIMING_INTERVAL = 0.25       # 每个观看者附带帧时间信息（延迟采样）的最小间隔（秒）
+MAX_LATENCY_REPORT = 50      # 单次延迟上报最多处理的样本数
+MAX_STAGE_LATENCY = 60.0     # 上报的单阶段延迟上限（秒），超出视为无效
+LATENCY_STAGES = ('device', 'queue', 'network', 'decode')
+TRANSPORTS = ('socketio', 'websocket')
+
+
+class Viewer:
+    """
+    单个观看者（Socket.IO 客户端）的读取游标
+    transport 为 'socketio' 时由发送任务通过 video_data 事件推送，
+    为 'websocket' 时由专用 WebSocket 连接推送，为 None 时暂停推送
+    """
+
+    def __init__(self, sid, cursor, transport='socketio'):
+        self.sid = sid
+        self.transport = transport
+        self.cursor = cursor      # 下一个待发送的视频包序号
+        self.primed = False       # 是否已发送会话头
+        self.in_flight = 0        # 已发送但未确认的批次数
+        self.last_send = 0.0
+        self.waiting_keyframe = False
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.send_times = deque()  # 未确认批次的发送时间
+        self.latency = 0.0         # 平滑后的发送延迟（秒）
+        self.audio = False         # 是否订阅音频
+        self.control = True        # False 表示仅观看，不允许发送控制事件
+        self.last_timing = 0.0     # 最近一次附带帧时间信息的时间
+        self.timing_unit = None    # 本批次要附带时间信息的视频包 (pts, 接收时间, 设备延迟)
+
+    def record_latency(self, latency):
+        self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+
+
+class VideoBroadcaster:
+    """
+    单设备视频广播器
+    持有一个 Scrcpy 会话，把每个视频包分发给任意数量的观看者。
+    每个观看者拥有独立游标，慢速客户端不会阻塞其他客户端。
+    """
+    # 创建 scrcpy 会话的工厂，默认在本进程内运行；工作进程模式下替换为 WorkerScrcpy
+    session_factory = Scrcpy
+
+    def __init__(self, device_id, socketio, history_size=DEFAULT_HISTORY_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_backlog=DEFAULT_MAX_BACKLOG,
+                 max_gop_replay=DEFAULT_MAX_GOP_REPLAY):
+        self.device_id = device_id
+        self.room = device_id
+        self.audio_room = f"{device_id}/audio"
+        self.socketio = socketio
+        self.max_in_flight = max_in_flight
+        self.max_backlog = min(max_backlog, history_size)
+        self.max_gop_replay = max_gop_replay
+        self.dropped_frames = 0
+        self.keyframe_requests = 0
+        self.control_events = 0  # 转发到设备的控制事件数
+        self.last_keyframe_request = 0.0
+        self.scrcpy = None
+        self.running = False
+        self.restarting = False
+        self.sender = None
+        self.sender_reactor = None   # reactor 模式下执行发送的 I/O 循环
+        self.pump_scheduled = False  # reactor 模式下是否已投递发送
+        # 当前会话参数，自适应画质调整时通过 restart() 修改
+        self.video_bit_rate = None
+        self.max_size = 0
+        self.max_fps = 0
+        self.quality_level = 0
+        self.audio = False   # 会话是否开启了音频流
+        self.control = True  # 会话是否开启了控制通道
+        self.audio_config = None  # 最近的音频配置 {"codec", "config"}，给中途加入的听众
+        # 空闲回收：最近一次用户操作（控制事件、加入、仅观看者的活动上报）与最近一次有观看者收到视频的时间
+        self.last_input = time.monotonic()
+        self.last_viewer_seen = self.last_input
+        self.idle_warned = False
+
+        self.lock = threading.Lock()
+        # 有新数据、确认或观看者变化时唤醒发送任务
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = False
+        self.viewers = {}
+        self.history = deque(maxlen=history_size)
+        self.next_seq = 0
+        self.session_header = None
+        self.config_packet = None
+        self.config_seq = None
+        # GOP 缓存：最近关键帧及其后的所有视频包，用于新观看者秒开
+        self.gop = []
+        self.recorder = None
+
+    def _create_session(self, video_bit_rate, max_size, max_fps, audio, control):
+        scpy = self.session_factory()
+        scpy.device_id = self.device_id
+        scpy.max_size = max_size
+        scpy.max_fps = max_fps
+        scpy.audio = audio
+        scpy.control = control
+        scpy.audio_callback = partial(self.publish_audio, scpy)
+        self.audio_config = None
+        if not scpy.scrcpy_start(self.publish, video_bit_rate, header_callback=self.set_session_header):
+            return None
+        self.video_bit_rate = video_bit_rate
+        self.max_size = max_size
+        self.max_fps = max_fps
+        self.audio = audio
+        self.control = control
+        return scpy
+
+    def start(self, video_bit_rate, max_size=0, max_fps=0, audio=False, control=True):
+        scpy = self._create_session(video_bit_rate, max_size, max_fps, audio, control)
+        if scpy is None:
+            return False
+        self.scrcpy = scpy
+        self.running = True
+        self.start_sender()
+        return True
+
+    def restart(self, video_bit_rate=None, max_size=None, max_fps=None, quality_level=None,
+                audio=None, control=None):
+        """
+        以新的参数重启 scrcpy 会话，为 None 的参数沿用当前值，观看者保持订阅
+        新会话的配置包与关键帧会被正常转发，观看者等待关键帧后继续播放；
+        启动失败时回退到原参数
+        """
+        with self.lock:
+            if not self.running or self.restarting:
+                return False
+            self.restarting = True
+        previous = (self.video_bit_rate, self.max_size, self.max_fps, self.audio, self.control)
+        settings = tuple(current if value is None else value
+                         for value, current in zip((video_bit_rate, max_size, max_fps, audio, control), previous))
+        print(f"Restarting session {self.device_id}: bit_rate={settings[0]} max_size={settings[1]} "
+              f"max_fps={settings[2]} audio={settings[3]} control={settings[4]}")
+        try:
+            if self.scrcpy:
+                self.scrcpy.scrcpy_stop()
+                self.scrcpy = None
+            with self.lock:
+                self._reset_gop()
+                for viewer in self.viewers.values():
+                    viewer.waiting_keyframe = True
+            scpy = self._create_session(*settings)
+            if scpy is None:
+                print(f"Failed to restart session {self.device_id}, restoring previous settings")
+                scpy = self._create_session(*previous)
+            elif quality_level is not None:
+                self.quality_level = quality_level
+            with self.lock:
+                stopped = not self.running
+            if stopped and scpy is not None:
+                # 重启期间会话已被停止
+                scpy.scrcpy_stop()
+                return False
+            self.scrcpy = scpy
+            if scpy is None:
+                self.socketio.emit('mirror_error', '镜像会话重启失败', to=self.room)
+            return scpy is not None
+        finally:
+            with self.lock:
+                self.restarting = False
+
+    def start_sender(self):
+        """
+        启动发送任务，每个会话只会存在一个
+        配置了 I/O 循环池（Scrcpy.reactors）时不单独占用线程，改为在 I/O 循环中按需执行 pump
+        """
+        with self.lock:
+            if self.sender is not None:
+                return
+            if Scrcpy.reactors:
+                self.sender = self.sender_reactor = Scrcpy.reactors.acquire()
+                self.pump_scheduled = True
+                self.sender_reactor.call_soon(self._reactor_pump)
+                self.sender_reactor.call_later(ACK_TIMEOUT, self._reactor_tick)
+            else:
+                self.sender = self.socketio.start_background_task(self.send_task)
+
+    def notify(self):
+        """标记有待发送的数据并唤醒发送任务，调用方需持有锁"""
+        self.pending = True
+        self.wakeup.notify_all()
+        if self.sender_reactor is not None and not self.pump_scheduled:
+            self.pump_scheduled = True
+            self.sender_reactor.call_soon(self._reactor_pump)
+
+    def stop(self):
+        self.stop_recording()
+        with self.lock:
+            self.running = False
+            self.notify()
+        if self.scrcpy:
+            self.scrcpy.scrcpy_stop()
+            self.scrcpy = None
+        with self.lock:
+            self.viewers.clear()
+            for unit in self.history:
+                unit.release()
+            self.history.clear()
+            if self.config_packet is not None:
+                self.config_packet.release()
+                self.config_packet = None
+            self._reset_gop()
+
+    def add_viewer(self, sid, transport='socketio', audio=False, control=True):
+        with self.lock:
+            viewer = self.viewers.get(sid)
+            if viewer is None:
+                viewer = Viewer(sid, self.next_seq, transport)
+                self.viewers[sid] = viewer
+                self.notify()
+            viewer.audio = audio
+            viewer.control = control
+        self.record_activity()
+        return True
+
+    def record_input(self, count=1):
+        """记录转发到设备的控制事件"""
+        self.control_events += count
+        self.record_activity()
+
+    def record_activity(self):
+        now = time.monotonic()
+        self.last_input = now
+        self.last_viewer_seen = now
+        self.idle_warned = False
+
+    def idle_time(self):
+        """
+        会话空闲时长（秒）：距最近一次用户操作的时间，与距最近一次有观看者收到视频的时间取较大者
+        标签页被冻结或网络中断时观看者不再确认视频，后者同样会持续增长
+        """
+        now = time.monotonic()
+        return max(now - self.last_input, now - self.last_viewer_seen)
+
+    def ensure_streams(self, audio=False, control=True):
+        """
+        确保会话开启了观看者需要的音频流/控制通道，缺少时带上该流重启会话
+        已开启的流不会因观看者离开而关闭
+        """
+        need_audio = audio and not self.audio
+        need_control = control and not self.control
+        if not need_audio and not need_control:
+            return True
+        return self.restart(audio=True if need_audio else None, control=True if need_control else None)
+
+    def can_control(self, sid):
+        """观看者是否允许发送控制事件"""
+        viewer = self.viewers.get(sid)
+        return viewer is not None and viewer.control and self.control
+
+    def set_transport(self, sid, transport):
+        """
+        切换观看者的视频通道
+        切换后从会话头重新开始推送，并等待下一个关键帧，避免两个通道的数据交错
+        """
+        with self.lock:
+            viewer = self.viewers.get(sid)
+            if viewer is None:
+                return False
+            if viewer.transport != transport:
+                viewer.transport = transport
+                viewer.primed = False
+                viewer.in_flight = 0
+                viewer.cursor = self.next_seq
+                viewer.waiting_keyframe = False
+                self.notify()
+            return True
+
+    def remove_viewer(self, sid):
+        """移除观看者，返回剩余观看者数量"""
+        with self.lock:
+            self.viewers.pop(sid, None)
+            return len(self.viewers)
+
+    def has_viewer(self, sid):
+        return sid in self.viewers
+
+    def viewer_count(self):
+        return len(self.viewers)
+
+    def set_session_header(self, header):
+        with self.lock:
+            self.session_header = header
+            if self.recorder:
+                # 尺寸取自会话头本身：restart() 重建会话期间 self.scrcpy 为 None
+                meta = header[DEVICE_NAME_LENGTH:]
+                self.recorder.set_video_size(int.from_bytes(meta[4:8], 'big'), int.from_bytes(meta[8:12], 'big'))
+            self.notify()
+
+    def start_recording(self):
+        """
+        开始录制当前会话，返回 (success, message)
+        以缓存的配置包和当前 GOP 作为开头，无需等待下一个关键帧
+        """
+        with self.lock:
+            if self.recorder:
+                return False, '该设备正在录制'
+            scpy = self.scrcpy
+            if not scpy or self.session_header is None:
+                return False, '镜像会话尚未就绪'
+            if scpy.codec_id != CODEC_H264:
+                return False, '仅支持录制 H.264 视频'
+            recorder = SessionRecorder(self.device_id, scpy.width, scpy.height)
+            recorder.start()
+            if self.config_packet is not None:
+                recorder.feed(self.config_packet)
+            for unit in self.gop:
+                recorder.feed(unit)
+            self.recorder = recorder
+            need_keyframe = not self.gop
+        if need_keyframe:
+            self.request_keyframe()
+        return True, None
+
+    def stop_recording(self):
+        """停止录制，返回录制信息，未在录制时返回 None"""
+        with self.lock:
+            recorder = self.recorder
+            self.recorder = None
+        if recorder is None:
+            return None
+        recorder.stop()
+        return recorder.get_info()
+
+    def publish(self, unit):
+        """由 Scrcpy 视频线程调用，每次传入一个完整的 AccessUnit"""
+        with self.lock:
+            if len(self.history) == self.history.maxlen:
+                self.history[0].release()
+            self.history.append(unit.retain())
+            if self.recorder:
+                self.recorder.feed(unit)
+            # 缓存最近的配置包（SPS/PPS）与当前 GOP 给中途加入的观看者
+            if unit.config:
+                if self.config_packet is not None:
+                    self.config_packet.release()
+                self.config_packet = unit.retain()
+                self.config_seq = self.next_seq
+                # 新配置之后旧 GOP 已无法解码
+                self._reset_gop()
+            elif unit.keyframe:
+                self._reset_gop()
+                self.gop.append(unit.retain())
+            elif self.gop:
+                if len(self.gop) < MAX_GOP_CACHE:
+                    self.gop.append(unit.retain())
+                else:
+                    self._reset_gop()
+            self.next_seq += 1
+            self.notify()
+
+    def publish_audio(self, scpy, unit):
+        """
+        由 Scrcpy 音频线程调用，音频包体积小且不做重传，直接广播到音频房间
+        配置包（Opus 头 / AAC AudioSpecificConfig）缓存后随 audio_config 事件下发
+        """
+        if unit.config:
+            self.audio_config = {"codec": scpy.audio_codec, "config": bytes(unit.payload)}
+            self.socketio.emit('audio_config', self.audio_config, to=self.audio_room)
+            return
+        self.socketio.emit('audio_data', unit.data.tobytes(), to=self.audio_room)
+
+    def _reset_gop(self):
+        for unit in self.gop:
+            unit.release()
+        self.gop = []
+
+    def request_keyframe(self):
+        """
+        请求设备输出新的关键帧，按 KEYFRAME_REQUEST_INTERVAL 限频
+        关键帧请求经由控制通道发送，仅观看会话没有控制通道时只能等待设备的下一个关键帧
+        """
+        now = time.monotonic()
+        if not self.scrcpy or not self.control or now - self.last_keyframe_request < KEYFRAME_REQUEST_INTERVAL:
+            return False
+        self.last_keyframe_request = now
+        self.keyframe_requests += 1
+        return self.scrcpy.request_keyframe()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "dropped_frames": self.dropped_frames,
+                "keyframe_requests": self.keyframe_requests,
+                "gop_frames": len(self.gop),
+                "control_events": self.control_events,
+                "control_writes": self.scrcpy.control_writes if self.scrcpy else 0,
+                "control_write_time": self.scrcpy.control_write_time if self.scrcpy else 0.0,
+                "control_messages": self.scrcpy.control_messages if self.scrcpy else 0,
+                "control_rejected": self.scrcpy.control_rejected if self.scrcpy else 0,
+                "viewers": {
+                    sid: {
+                        "backlog": self.next_seq - v.cursor,
+                        "sent_frames": v.sent_frames,
+                        "dropped_frames": v.dropped_frames,
+                        "latency": v.latency
+                    }
+                    for sid, v in self.viewers.items()
+                }
+            }
+
+    def get_metrics(self):
+        """/metrics 抓取时调用，返回计数器与瞬时值快照"""
+        scpy = self.scrcpy
+        with self.lock:
+            backlogs = [self.next_seq - v.cursor for v in self.viewers.values()]
+            metrics = {
+                "viewers": len(self.viewers),
+                "viewer_backlog_frames": sum(backlogs),
+                "viewer_backlog_max_frames": max(backlogs, default=0),
+                "history_frames": len(self.history),
+                "dropped_frames": self.dropped_frames,
+                "keyframe_requests": self.keyframe_requests,
+                "control_events": self.control_events,
+            }
+        recorder = self.recorder
+        metrics["recorder_queue_frames"] = recorder.queue.qsize() if recorder else 0
+        metrics["recorder_dropped_frames"] = recorder.dropped_frames if recorder else 0
+        if scpy:
+            metrics.update({
+                "video_frames": scpy.video_frames,
+                "video_bytes": scpy.video_bytes,
+                "audio_bytes": scpy.audio_bytes,
+                "control_writes": scpy.control_writes,
+                "control_messages": scpy.control_messages,
+                "control_rejected": scpy.control_rejected,
+                "control_write_seconds": scpy.control_write_time,
+                "control_queue_depth": scpy.control_queue_depth(),
+            })
+        return metrics
+
+    def _drop(self, viewer, count):
+        viewer.dropped_frames += count
+        self.dropped_frames += count
+
+    def _latest_keyframe(self, start):
+        """在历史中查找 start 之后最新的关键帧下标"""
+        for i in range(len(self.history) - 1, start - 1, -1):
+            if self.history[i].keyframe:
+                return i
+        return None
+
+    def _collect(self, viewer):
+        """
+        收集观看者游标之后的数据，调用方需持有锁
+        首次发送时先发会话头、配置包和 GOP 缓存，GOP 过长时改为请求新关键帧；
+        丢帧策略：积压超过一半上限时丢弃非参考帧；超过上限（或已落出历史）时
+        直接跳到最新的关键帧，历史中没有关键帧则等待下一个关键帧，配置包始终保留
+        """
+        if self.session_header is None:
+            return None
+        parts = []
+        last = None  # 本批次最后一个视频帧，用于延迟采样
+        if not viewer.primed:
+            parts.append(self.session_header)
+            if self.config_packet is not None:
+                parts.append(self.config_packet.data)
+            if self.gop and len(self.gop) <= self.max_gop_replay:
+                parts.extend(unit.data for unit in self.gop)
+                last = self.gop[-1]
+                viewer.sent_frames += len(self.gop)
+                viewer.waiting_keyframe = False
+            else:
+                viewer.waiting_keyframe = True
+                if self.next_seq > 0:
+                    self.request_keyframe()
+            viewer.cursor = self.next_seq
+            viewer.primed = True
+        base_seq = self.next_seq - len(self.history)
+        backlog = self.next_seq - viewer.cursor
+        start = max(viewer.cursor - base_seq, 0)
+        if viewer.cursor < base_seq or backlog > self.max_backlog:
+            viewer.waiting_keyframe = True
+        if viewer.waiting_keyframe:
+            keyframe = self._latest_keyframe(start)
+            end = keyframe if keyframe is not None else len(self.history)
+            for i in range(start, end):
+                unit = self.history[i]
+                if unit.config:
+                    parts.append(unit.data)
+                else:
+                    self._drop(viewer, 1)
+            if viewer.cursor < base_seq:
+                self._drop(viewer, base_seq - viewer.cursor)
+            start = end
+            backlog = len(self.history) - start
+            viewer.waiting_keyframe = keyframe is None
+            if viewer.waiting_keyframe:
+                self.request_keyframe()
+        soft_limit = self.max_backlog // 2
+        for i in range(start, len(self.history)):
+            unit = self.history[i]
+            if backlog > soft_limit and unit.droppable:
+                self._drop(viewer, 1)
+                continue
+            parts.append(unit.data)
+            viewer.sent_frames += 1
+            if not unit.config:
+                last = unit
+        viewer.cursor = self.next_seq
+        now = time.monotonic()
+        if last is not None and now - viewer.last_timing >= TIMING_INTERVAL:
+            viewer.last_timing = now
+            viewer.timing_unit = (last.pts, last.received, last.device_delay)
+        return b''.join(parts) if parts else None
+
+    def _take_timing(self, viewer):
+        """
+        取出本批次的帧时间信息，在发送视频数据之前调用；时间均为服务器时钟的毫秒数
+        浏览器按 pts 匹配到该帧，记录收到与显示的时间后通过 latency_report 上报
+        """
+        sample, viewer.timing_unit = viewer.timing_unit, None
+        if sample is None:
+            return None
+        pts, received, device_delay = sample
+        return {
+            "pts": pts,
+            "device": None if device_delay is None else device_delay * 1000,
+            "received": received * 1000,
+            "sent": time.time() * 1000,
+        }
+
+    def record_frame_latency(self, samples):
+        """
+        记录浏览器上报的延迟样本，每个样本为各阶段毫秒数 {"device", "queue", "network", "decode"}
+        返回接受的样本数；缺少某阶段的样本只记录已有阶段，不计入合计
+        """
+        accepted = 0
+        for sample in samples[:MAX_LATENCY_REPORT]:
+            if not isinstance(sample, dict):
+                continue
+            stages = {}
+            for stage in LATENCY_STAGES:
+                value = sample.get(stage)
+                if isinstance(value, (int, float)) and math.isfinite(value):
+                    stages[stage] = min(max(value / 1000, 0.0), MAX_STAGE_LATENCY)
+            if not stages:
+                continue
+            for stage, value in stages.items():
+                FRAME_LATENCY.observe(value, self.device_id, stage)
+            if len(stages) == len(LATENCY_STAGES):
+                FRAME_LATENCY.observe(sum(stages.values()), self.device_id, 'total')
+            accepted += 1
+        return accepted
+
+    def _on_ack(self, sid, *args):
+        with self.lock:
+            viewer = self.viewers.get(sid)
+            if viewer and viewer.in_flight > 0:
+                viewer.in_flight -= 1
+                self.last_viewer_seen = time.monotonic()
+                if viewer.send_times:
+                    latency = time.monotonic() - viewer.send_times.popleft()
+                    viewer.record_latency(latency)
+                    EMIT_LATENCY.observe(latency, self.device_id, 'socketio')
+                self.notify()
+
+    def pump(self):
+        """为每个观看者发送一个批次，返回是否有数据被发送"""
+        batches = []
+        now = time.monotonic()
+        with self.lock:
+            for viewer in self.viewers.values():
+                if viewer.transport != 'socketio':
+                    continue
+                if viewer.in_flight >= self.max_in_flight:
+                    if now - viewer.last_send < ACK_TIMEOUT:
+                        continue
+                    viewer.in_flight = 0
+                    viewer.send_times.clear()
+                    viewer.record_latency(ACK_TIMEOUT)
+                batch = self._collect(viewer)
+                if batch:
+                    viewer.in_flight += 1
+                    viewer.last_send = now
+                    viewer.send_times.append(now)
+                    batches.append((viewer.sid, batch, self._take_timing(viewer)))
+        for sid, batch, timing in batches:
+            try:
+                if timing:
+                    self.socketio.emit('video_timing', timing, to=sid)
+                self.socketio.emit('video_data', batch, to=sid,
+                                   callback=partial(self._on_ack, sid))
+            except Exception as e:
+                print(f"Error sending data to {sid}: {e}")
+        return bool(batches)
+
+    def _has_pending(self, viewer):
+        if not viewer.primed:
+            return self.session_header is not None
+        return viewer.cursor < self.next_seq
+
+    def stream_to_websocket(self, sid, ws):
+        """
+        在 WebSocket 连接的处理线程中为单个观看者推送视频
+        每条二进制消息为若干个按 scrcpy 格式分帧（12 字节包头含负载长度）的视频包，
+        发送阻塞即形成背压，不需要确认机制
+        """
+        with self.lock:
+            viewer = self.viewers.get(sid)
+            if viewer is None or viewer.transport != 'websocket':
+                return False
+        print(f"WebSocket video stream attached: {self.device_id} -> {sid}")
+        try:
+            while ws.connected:
+                with self.lock:
+                    if self.running and self.viewers.get(sid) is viewer and not self._has_pending(viewer):
+                        self.wakeup.wait(timeout=ACK_TIMEOUT)
+                    if not self.running or self.viewers.get(sid) is not viewer or viewer.transport != 'websocket':
+                        break
+                    batch = self._collect(viewer)
+                    timing = self._take_timing(viewer)
+                if batch:
+                    started = time.monotonic()
+                    if timing:
+                        # 文本消息携带下一条二进制消息中最后一帧的时间信息
+                        ws.send(json.dumps(timing))
+                    ws.send(batch)
+                    self.last_viewer_seen = time.monotonic()
+                    latency = self.last_viewer_seen - started
+                    viewer.record_latency(latency)
+                    EMIT_LATENCY.observe(latency, self.device_id, 'websocket')
+        except Exception as e:
+            if ws.connected:
+                print(f"WebSocket video stream error for {sid}: {e}")
+        finally:
+            with self.lock:
+                if self.viewers.get(sid) is viewer and viewer.transport == 'websocket':
+                    viewer.transport = None
+        print(f"WebSocket video stream detached: {self.device_id} -> {sid}")
+        return True
+
+    def send_task(self):
+        """事件驱动的发送循环：仅在有数据或确认到达时唤醒，超时唤醒用于处理确认超时"""
+        while True:
+            with self.lock:
+                if self.running and not self.pending:
+                    self.wakeup.wait(timeout=ACK_TIMEOUT)
+                if not self.running:
+                    break
+                self.pending = False
+            self.pump()
+        with self.lock:
+            self.sender = None
+        print(f"send_task for {self.device_id} stopped")
+
+    def _reactor_pump(self):
+        """reactor 模式下的发送：在 I/O 循环中为每个观看者发送一个批次"""
+        with self.lock:
+            self.pump_scheduled = False
+            if not self.running:
+                if self.sender_reactor is not None:
+                    Scrcpy.reactors.release(self.sender_reactor)
+                    self.sender = self.sender_reactor = None
+                    print(f"send_task for {self.device_id} stopped")
+                return
+            self.pending = False
+        self.pump()
+
+    def _reactor_tick(self):
+        """定时唤醒，处理确认超时的观看者"""
+        with self.lock:
+            reactor = self.sender_reactor
+            if not self.running or reactor is None:
+                return
+            self.notify()
+        reactor.call_later(ACK_TIMEOUT, self._reactor_tick)
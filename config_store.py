@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+
+from dotenv import dotenv_values
+
+
+class ConfigStore:
+    """
+    data/.env 的内存缓存
+    读取时只做一次 os.stat 比较文件签名（修改时间、大小、inode），文件被外部修改或替换后才重新解析；
+    写入时先写同目录下的临时文件并 fsync，再用 os.replace 原子替换，进程内的并发写入由锁串行化
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.values = {}
+        self.signature = None
+        self.loads = 0  # 实际解析文件的次数
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _refresh(self):
+        """文件签名变化时重新加载，调用方需持有锁"""
+        signature = self._stat_signature()
+        if signature == self.signature and self.loads:
+            return
+        self.values = dict(dotenv_values(self.path)) if signature else {}
+        self.signature = signature
+        self.loads += 1
+
+    def get_all(self):
+        with self.lock:
+            self._refresh()
+            return dict(self.values)
+
+    def get(self, key, default=None):
+        with self.lock:
+            self._refresh()
+            value = self.values.get(key)
+            return default if value is None else value
+
+    def update(self, **values):
+        """更新若干配置项并原子写回文件"""
+        with self.lock:
+            self._refresh()
+            config = dict(self.values)
+            config.update(values)
+            self._write(config)
+            self.values = config
+            self.signature = self._stat_signature()
+
+    def _write(self, config):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.env.', dir=directory)
+        try:
+            # mkstemp 创建的文件权限为 0600，沿用原文件的权限
+            try:
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                for key, value in config.items():
+                    f.write(f'{key}={value}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
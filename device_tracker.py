@@ -0,0 +1,94 @@
+import threading
+import time
+
+from adb_client import ADBError
+
+TRACK_RETRY_INTERVAL = 5.0  # track-devices 连接断开或不可用时，轮询一次并等待多久后重连（秒）
+
+
+class DeviceTracker:
+    """
+    设备状态跟踪器
+    通过 host:track-devices 长连接接收 ADB server 推送的设备列表，维护内存中的设备表，
+    状态变化时以 [(serial, old_state, new_state)] 的形式回调 on_change，state 为 None 表示设备已消失。
+    原生协议不可用时退化为每 TRACK_RETRY_INTERVAL 秒轮询一次 adb devices
+    """
+
+    def __init__(self, adb_manager, on_change=None):
+        self.adb_manager = adb_manager
+        self.client = adb_manager.client
+        self.on_change = on_change
+        self.devices = {}      # serial -> state
+        self.synced = False    # 是否有活动的 track-devices 连接（设备表实时有效）
+        self.running = False
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.track_task, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        sock = self.sock
+        if sock:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def get_devices(self):
+        """返回设备表快照 [(serial, state)]"""
+        with self.lock:
+            return list(self.devices.items())
+
+    def get_state(self, serial):
+        with self.lock:
+            return self.devices.get(serial)
+
+    def update(self, devices):
+        """用一份完整的设备列表更新设备表，返回并回调状态变化"""
+        latest = dict(devices)
+        with self.lock:
+            changes = [(serial, state, latest.get(serial))
+                       for serial, state in self.devices.items() if latest.get(serial) != state]
+            changes += [(serial, None, state) for serial, state in latest.items() if serial not in self.devices]
+            self.devices = latest
+        if changes and self.on_change:
+            try:
+                self.on_change(changes)
+            except Exception as e:
+                print(f"Error handling device changes: {e}")
+        return changes
+
+    def poll(self):
+        """通过 ADBManager 查询一次设备列表（可能回退到 adb 子进程）"""
+        devices = self.adb_manager.refresh_devices()
+        if devices is not None:
+            self.update((d['id'], d['state']) for d in devices)
+
+    def track_task(self):
+        print("Device tracker started")
+        while self.running:
+            if self.adb_manager.native_available():
+                try:
+                    self.sock = self.client.open_track_devices()
+                    print("Tracking devices via adb server")
+                    while self.running:
+                        self.update(self.client.read_device_list(self.sock))
+                        self.synced = True
+                except (ADBError, OSError) as e:
+                    if self.running:
+                        print(f"Device tracking interrupted: {e}")
+                finally:
+                    self.synced = False
+                    if self.sock:
+                        self.sock.close()
+                        self.sock = None
+            if not self.running:
+                break
+            self.poll()
+            time.sleep(TRACK_RETRY_INTERVAL)
+        print("Device tracker stopped")
@@ -0,0 +1,472 @@
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection, wait
+from multiprocessing.shared_memory import SharedMemory
+
+from scrcpy import AccessUnit, Scrcpy, PACKET_HEADER_LENGTH, SERVER_CONNECT_TIMEOUT
+
+DEFAULT_RING_SIZE = 64 * 1024 * 1024  # 每个设备的共享内存环形缓冲区大小（字节）
+RING_HEADER_SIZE = 64                 # 头部：读端已释放的位置（tail，8 字节），其余保留
+WORKER_STOP_TIMEOUT = 5.0
+# 等待工作进程报告启动结果的最长时间（秒）：服务端就绪超时之外，留出设备检查、推送与转发的时间
+WORKER_START_TIMEOUT = SERVER_CONNECT_TIMEOUT + 10.0
+STATS_INTERVAL = 1.0                  # 工作进程上报统计的间隔（秒）
+KEYFRAME_REQUEST_INTERVAL = 1.0       # 缓冲区溢出后请求关键帧的最小间隔（秒）
+EVACUATE_HIGH_WATERMARK = 0.5         # 共享内存占用超过该比例时，把最早的数据包复制到堆内存
+EVACUATE_LOW_WATERMARK = 0.25         # 复制到占用低于该比例为止
+EVACUATE_GRACE = 1.0                  # 复制后多久归还共享内存空间（秒）
+TAIL = struct.Struct('<Q')
+
+
+class RingWriter:
+    """
+    环形缓冲区写端（工作进程）
+    位置用单调递增的绝对字节数表示，偏移为位置对容量取模；数据包必须连续存放，
+    末尾放不下时跳到缓冲区开头，跳过的部分随下一个数据包一起被读端释放
+    """
+
+    def __init__(self, buf, capacity):
+        self.buf = buf
+        self.capacity = capacity
+        self.head = 0
+
+    def write(self, data):
+        """写入一个数据包，返回 (position, end)；读端未释放足够空间时返回 None"""
+        length = len(data)
+        if length > self.capacity:
+            return None
+        position = self.head
+        offset = position % self.capacity
+        if offset + length > self.capacity:
+            position += self.capacity - offset
+            offset = 0
+        end = position + length
+        tail = TAIL.unpack_from(self.buf, 0)[0]
+        if end - tail > self.capacity:
+            return None
+        start = RING_HEADER_SIZE + offset
+        self.buf[start:start + length] = data
+        self.head = end
+        return position, end
+
+
+class _RingEntry:
+    """读端的一个数据包，作为 AccessUnit 的缓冲池：引用计数归零时释放其在环形缓冲区中的空间"""
+    __slots__ = ('ring', 'end', 'unit', 'released', 'reclaim_at')
+
+    def __init__(self, ring, end):
+        self.ring = ring
+        self.end = end
+        self.unit = None
+        self.released = False
+        self.reclaim_at = 0.0
+
+    def release(self, buffer):
+        self.ring.release(self)
+
+
+class RingReader:
+    """
+    环形缓冲区读端（web 进程）
+    每个数据包以共享内存上的 memoryview 交给广播器，不复制；数据包可能乱序释放，
+    只有最早的未释放数据包之前的空间才会归还给写端。
+    广播历史与 GOP 缓存会长期持有数据包，占用超过 EVACUATE_HIGH_WATERMARK 时把最早的数据包复制到堆内存，
+    其空间在 EVACUATE_GRACE 秒后归还，保证仍持有旧视图的读取方（均在广播器锁内短暂读取）已经读完
+    """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.outstanding = deque()
+        self.head = 0
+        self.tail = 0
+        self.closing = False
+        self.evacuated = 0  # 复制到堆内存的数据包数
+
+    def unit(self, position, end, length):
+        """把写端写入的数据包（12 字节包头 + 负载）包装为 AccessUnit"""
+        entry = _RingEntry(self, end)
+        start = RING_HEADER_SIZE + position % self.capacity
+        view = self.shm.buf[start:start + length]
+        unit = AccessUnit(entry, view, length, int.from_bytes(view[:8], 'big'))
+        with self.lock:
+            entry.unit = unit
+            self.outstanding.append(entry)
+            self.head = end
+        return unit
+
+    def release(self, entry):
+        with self.lock:
+            entry.released = True
+            entry.unit = None
+            self._advance(time.monotonic())
+
+    def maintain(self):
+        """由接收线程在每条消息后调用：按需把长期持有的数据包移出共享内存，并归还宽限期已过的空间"""
+        now = time.monotonic()
+        with self.lock:
+            if self.head - self.tail > self.capacity * EVACUATE_HIGH_WATERMARK:
+                for entry in self.outstanding:
+                    if self.head - entry.end < self.capacity * EVACUATE_LOW_WATERMARK:
+                        break
+                    if entry.released:
+                        continue
+                    unit = entry.unit
+                    data = bytearray(unit.data)
+                    unit._buffer = data
+                    unit._pool = BYTES_POOL
+                    unit.data = memoryview(data)
+                    entry.unit = None
+                    entry.released = True
+                    entry.reclaim_at = now + EVACUATE_GRACE
+                    self.evacuated += 1
+            self._advance(now)
+
+    def _advance(self, now):
+        """归还最早的一段已释放空间，调用方需持有锁"""
+        tail = None
+        while self.outstanding and self.outstanding[0].released and self.outstanding[0].reclaim_at <= now:
+            tail = self.outstanding.popleft().end
+        if tail is not None and not self.closing:
+            self.tail = tail
+            TAIL.pack_into(self.shm.buf, 0, tail)
+        if self.closing and not self.outstanding:
+            self._close()
+
+    def close(self):
+        """会话结束后调用，广播器仍持有的数据包全部释放后才真正解除映射"""
+        with self.lock:
+            self.closing = True
+            for entry in self.outstanding:
+                if entry.released:
+                    entry.reclaim_at = 0.0
+            self._advance(time.monotonic())
+
+    def _close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有数据包视图未被回收，映射随其被垃圾回收时释放
+            pass
+
+
+class _BytesPool:
+    """音频包直接经连接传递，复制后的 bytearray 不需要回收"""
+
+    def release(self, buffer):
+        pass
+
+
+BYTES_POOL = _BytesPool()
+
+
+class WorkerScrcpy:
+    """
+    在独立工作进程中运行的 scrcpy 会话，接口与 Scrcpy 相同，供 VideoBroadcaster 替换使用
+    工作进程负责 adb、scrcpy-server 与三个 socket 的全部 I/O，视频包写入共享内存环形缓冲区，
+    通过连接只传递位置等元数据；音频、控制消息和统计信息体积小，直接经连接传递
+    """
+
+    def __init__(self, ring_size=None):
+        self.ring_size = ring_size or DEFAULT_RING_SIZE
+        self.device_id = None
+        self.max_size = 0
+        self.max_fps = 0
+        self.audio = False
+        self.audio_codec = 'opus'
+        self.control = True
+        self.audio_callback = None
+        self.video_callback = None
+        self.header_callback = None
+
+        self.session_header = None
+        self.device_name = None
+        self.codec_id = None
+        self.width = None
+        self.height = None
+        self.startup_timings = {}
+        self.video_frames = 0
+        self.video_bytes = 0
+        self.audio_bytes = 0
+        self.control_writes = 0
+        self.control_messages = 0
+        self.control_rejected = 0
+        self.control_bytes = 0
+        self.control_write_time = 0.0
+        self.control_pending = 0
+        self.ring_overflows = 0  # 工作进程因缓冲区已满丢弃的视频包数
+
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.shm = None
+        self.ring = None
+        self.reader_thread = None
+        self.started = threading.Event()
+        self.start_ok = False
+        self.stop = False
+
+    def _send(self, message):
+        with self.send_lock:
+            try:
+                self.conn.send(message)
+                return True
+            except (OSError, ValueError):
+                return False
+
+    def scrcpy_start(self, video_callback, video_bit_rate, header_callback=None):
+        self.video_callback = video_callback
+        self.header_callback = header_callback
+        self.stop = False
+        self.shm = SharedMemory(create=True, size=RING_HEADER_SIZE + self.ring_size)
+        TAIL.pack_into(self.shm.buf, 0, 0)
+        self.ring = RingReader(self.shm, self.ring_size)
+        # 通过继承的 socketpair 与工作进程通信，描述符只有双方持有，无需监听端口和认证
+        parent_sock, child_sock = socket.socketpair()
+        settings = {
+            "device_id": self.device_id,
+            "video_bit_rate": video_bit_rate,
+            "max_size": self.max_size,
+            "max_fps": self.max_fps,
+            "audio": self.audio,
+            "audio_codec": self.audio_codec,
+            "control": self.control,
+            "shm_name": self.shm.name,
+            "ring_size": self.ring_size,
+        }
+        worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_worker.py')
+        self.conn = connection_from_socket(parent_sock)
+        child_fd = child_sock.fileno()
+        try:
+            self.process = subprocess.Popen([sys.executable, worker_path, str(child_fd)], pass_fds=(child_fd,))
+        except OSError as e:
+            print(f"Failed to start worker for {self.device_id}: {e}")
+            self.scrcpy_stop()
+            return False
+        finally:
+            child_sock.close()
+        if not self._send(settings):
+            print(f"Failed to send settings to worker for {self.device_id}")
+            self.scrcpy_stop()
+            return False
+        self.reader_thread = threading.Thread(target=self.receive_task, daemon=True)
+        self.reader_thread.start()
+        # 工作进程异常退出时接收线程会读到 EOF 并置位；卡住不报告时按超时放弃，避免调用方一直持有设备锁
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while not self.started.wait(0.5):
+            if self.process.poll() is not None:
+                print(f"Worker for {self.device_id} exited during startup with code {self.process.returncode}")
+                break
+            if time.monotonic() >= deadline:
+                print(f"Worker for {self.device_id} did not report startup within {WORKER_START_TIMEOUT}s")
+                break
+        if not (self.started.is_set() and self.start_ok):
+            self.start_ok = False
+            self.scrcpy_stop()
+        return self.start_ok
+
+    def receive_task(self):
+        """接收工作进程的消息并回调广播器，相当于单进程模式下的视频/音频接收线程"""
+        try:
+            while True:
+                # 先等待可读再接收：gevent 模式下 select 会让出给其它协程，而 recv 内部的 os.read 不会
+                wait([self.conn])
+                message = self.conn.recv()
+                self.ring.maintain()
+                kind = message[0]
+                if kind == 'video':
+                    _, position, end, length, received, device_delay = message
+                    unit = self.ring.unit(position, end, length)
+                    unit.received = received
+                    unit.device_delay = device_delay
+                    self.video_frames += 1
+                    self.video_bytes += unit.size
+                    try:
+                        self.video_callback(unit)
+                    finally:
+                        unit.release()
+                elif kind == 'audio':
+                    data = message[1]
+                    self.audio_bytes += len(data) - PACKET_HEADER_LENGTH
+                    if self.audio_callback:
+                        self.audio_callback(AccessUnit(BYTES_POOL, bytearray(data), len(data),
+                                                       int.from_bytes(data[:8], 'big')))
+                elif kind == 'header':
+                    _, header, info = message
+                    self.session_header = header
+                    for key, value in info.items():
+                        setattr(self, key, value)
+                    if self.header_callback:
+                        self.header_callback(header)
+                elif kind == 'stats':
+                    for key, value in message[1].items():
+                        setattr(self, key, value)
+                elif kind == 'started':
+                    self.start_ok, self.startup_timings = message[1], message[2]
+                    self.started.set()
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.started.set()
+            if not self.stop:
+                print(f"Worker for {self.device_id} exited")
+
+    def scrcpy_stop(self):
+        self.stop = True
+        if self.conn:
+            self._send(('stop',))
+        if self.process:
+            try:
+                self.process.wait(timeout=WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                print(f"Worker for {self.device_id} did not stop, killing it")
+                self.process.kill()
+                self.process.wait()
+        if self.reader_thread and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join(timeout=WORKER_STOP_TIMEOUT)
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        if self.shm:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.ring.close()
+            self.shm = None
+        print(f"Worker session for {self.device_id} stopped")
+
+    def scrcpy_send_control(self, data):
+        """
+        转发给工作进程的控制写入队列，写入连接后即返回，不等待工作进程处理，避免阻塞 Socket.IO 的处理函数；
+        工作进程中队列已满被拒绝的批次计入 control_rejected，随统计信息异步上报
+        """
+        if not self.control or self.conn is None:
+            print("Error: Control socket not initialized")
+            return False
+        return self._send(('control', bytes(data)))
+
+    def request_keyframe(self):
+        return self.conn is not None and self._send(('keyframe',))
+
+    def control_queue_depth(self):
+        return self.control_pending
+
+
+def attach_shared_memory(name):
+    """附加到 web 进程创建的共享内存，生命周期由 web 进程管理，不交给本进程的 resource_tracker"""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python 3.13 之前没有 track 参数
+        shm = SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def connection_from_socket(sock):
+    """
+    把 socket 转为 multiprocessing 的 Connection
+    gevent 模式下 socket 的底层描述符总是非阻塞的，而 Connection 直接调用 os.read / os.write，需改回阻塞模式
+    """
+    fd = sock.detach()
+    os.set_blocking(fd, True)
+    return Connection(fd)
+
+
+def worker_main(fd):
+    """工作进程入口：通过继承的描述符与 web 进程通信，运行一个 Scrcpy 会话直到收到 stop 或连接断开"""
+    os.set_blocking(fd, True)  # 描述符由 gevent 模式下的 web 进程创建时是非阻塞的
+    conn = Connection(fd)
+    settings = conn.recv()
+    shm = attach_shared_memory(settings["shm_name"])
+    writer = RingWriter(shm.buf, settings["ring_size"])
+    send_lock = threading.Lock()
+    state = {"waiting_keyframe": False, "overflows": 0, "last_keyframe_request": 0.0}
+
+    def send(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, ValueError):
+                pass
+
+    scpy = Scrcpy()
+    scpy.device_id = settings["device_id"]
+    scpy.max_size = settings["max_size"]
+    scpy.max_fps = settings["max_fps"]
+    scpy.audio = settings["audio"]
+    scpy.audio_codec = settings["audio_codec"]
+    scpy.control = settings["control"]
+
+    def on_video(unit):
+        # 缓冲区已满时丢弃该包，之后等待关键帧，避免把缺少参考帧的数据交给观看者
+        if state["waiting_keyframe"] and not (unit.config or unit.keyframe):
+            state["overflows"] += 1
+            return
+        slot = writer.write(unit.data)
+        if slot is None:
+            state["overflows"] += 1
+            state["waiting_keyframe"] = True
+            now = time.monotonic()
+            if scpy.control and now - state["last_keyframe_request"] >= KEYFRAME_REQUEST_INTERVAL:
+                state["last_keyframe_request"] = now
+                scpy.request_keyframe()
+            return
+        if unit.keyframe:
+            state["waiting_keyframe"] = False
+        send(('video', slot[0], slot[1], len(unit.data), unit.received, unit.device_delay))
+
+    def on_header(header):
+        send(('header', bytes(header), {"device_name": scpy.device_name, "codec_id": scpy.codec_id,
+                                        "width": scpy.width, "height": scpy.height}))
+
+    def on_audio(unit):
+        send(('audio', unit.data.tobytes()))
+
+    def stats_task():
+        while not scpy.stop:
+            time.sleep(STATS_INTERVAL)
+            send(('stats', {
+                "audio_codec": scpy.audio_codec,
+                "control_writes": scpy.control_writes,
+                "control_messages": scpy.control_messages,
+                "control_rejected": scpy.control_rejected,
+                "control_bytes": scpy.control_bytes,
+                "control_write_time": scpy.control_write_time,
+                "control_pending": scpy.control_queue_depth(),
+                "ring_overflows": state["overflows"],
+            }))
+
+    scpy.audio_callback = on_audio
+    ok = scpy.scrcpy_start(on_video, settings["video_bit_rate"], header_callback=on_header)
+    send(('started', ok, scpy.startup_timings))
+    try:
+        if ok:
+            threading.Thread(target=stats_task, daemon=True).start()
+            while True:
+                message = conn.recv()
+                if message[0] == 'control':
+                    scpy.scrcpy_send_control(message[1])
+                elif message[0] == 'keyframe':
+                    scpy.request_keyframe()
+                elif message[0] == 'stop':
+                    break
+    except (EOFError, OSError):
+        pass
+    finally:
+        if ok:
+            scpy.scrcpy_stop()
+        shm.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    worker_main(int(sys.argv[1]))
@@ -0,0 +1,124 @@
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 以秒为单位的直方图桶
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    按标签分组的直方图，observe() 只做一次二分查找和计数累加，可在热路径中调用
+    """
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # 标签值 -> [各桶计数..., 溢出桶计数, 总和]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = [(key, list(series)) for key, series in self.series.items()]
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    指标注册表
+    直方图在事件发生时记录；计数器和瞬时值由采集函数在抓取时从各会话已有的统计字段读取，
+    热路径上只保留普通的整数累加
+    """
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help_text, labels, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def register_collector(self, collector):
+        """
+        collector 为无参函数，返回 [(name, type, help, labels, [(label_values, value)])]
+        type 为 'counter' 或 'gauge'
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, metric_type, help_text, labels, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for label_values, value in samples:
+                    lines.append(f'{name}{_format_labels(labels, label_values)} {_format_value(value)}')
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+EMIT_LATENCY = REGISTRY.histogram(
+    'scrcpy_emit_latency_seconds', '视频批次从发送到确认（Socket.IO）或发送完成（WebSocket）的耗时',
+    labels=('device', 'transport'))
+SESSION_START_PHASE = REGISTRY.histogram(
+    'scrcpy_session_start_phase_seconds', 'scrcpy 会话启动各阶段耗时',
+    labels=('phase',), buckets=DURATION_BUCKETS)
+FRAME_LATENCY = REGISTRY.histogram(
+    'scrcpy_frame_latency_seconds',
+    '采样视频帧各阶段延迟：device 设备到主机（相对最快一帧）、queue 服务器排队、network 网络传输、'
+    'decode 浏览器解码到显示、total 合计',
+    labels=('device', 'stage'))
+ADB_COMMAND_DURATION = REGISTRY.histogram(
+    'adb_command_duration_seconds', 'ADB 命令耗时',
+    labels=('command', 'method'), buckets=DURATION_BUCKETS)
@@ -0,0 +1,179 @@
+import heapq
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+
+class Reactor:
+    """
+    基于 selectors 的单线程 I/O 循环
+    多个会话的 socket 与管道注册到同一个循环上，就绪时调用注册的回调，不再为每个连接占用一个阻塞线程。
+    回调在循环线程中执行，必须是非阻塞的；其它线程通过 call_soon / call_later / run_sync 把操作投递到循环线程
+    """
+
+    def __init__(self, name='reactor'):
+        self.name = name
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.ready = deque()
+        self.timers = []  # 最小堆：[到期时间, 序号, 回调, 参数]，取消时回调置为 None
+        self.timer_seq = 0
+        self.thread = None
+        self.running = False
+        self.sessions = 0  # 分配到本循环的会话数，由 ReactorPool 维护
+        self.events = 0    # 已处理的 I/O 事件数
+        # 其它线程投递任务时写入一个字节，唤醒阻塞在 select 上的循环
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, self._drain_wakeup)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wakeup()
+        if self.thread and not self.in_loop():
+            self.thread.join(timeout=3)
+
+    def in_loop(self):
+        return threading.current_thread() is self.thread
+
+    def _wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # 缓冲区已满说明循环已被唤醒
+
+    def _drain_wakeup(self, mask):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def call_soon(self, callback, *args):
+        """在循环线程中尽快执行 callback，可从任意线程调用"""
+        with self.lock:
+            self.ready.append((callback, args))
+        if not self.in_loop():
+            self._wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """delay 秒后在循环线程中执行 callback，返回的句柄可传给 cancel()"""
+        with self.lock:
+            self.timer_seq += 1
+            timer = [time.monotonic() + delay, self.timer_seq, callback, args]
+            heapq.heappush(self.timers, timer)
+        if not self.in_loop():
+            self._wakeup()
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            timer[2] = None
+
+    def run_sync(self, callback, *args, timeout=5.0):
+        """在循环线程中执行 callback 并等待返回值；已在循环线程中时直接调用"""
+        if self.in_loop() or not self.running:
+            return callback(*args)
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(callback(*args))
+            finally:
+                done.set()
+
+        self.call_soon(run)
+        if not done.wait(timeout):
+            print(f"{self.name}: timed out waiting for {getattr(callback, '__name__', callback)}")
+        return result[0] if result else None
+
+    # 以下三个方法只能在循环线程中调用（或通过 call_soon / run_sync 投递）
+    def register(self, fileobj, events, callback):
+        """注册文件对象，就绪时以事件掩码调用 callback(mask)"""
+        self.selector.register(fileobj, events, callback)
+
+    def modify(self, fileobj, events, callback):
+        self.selector.modify(fileobj, events, callback)
+
+    def unregister(self, fileobj):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass  # 未注册或已关闭
+
+    def _next_timeout(self):
+        with self.lock:
+            if self.ready:
+                return 0
+            while self.timers and self.timers[0][2] is None:
+                heapq.heappop(self.timers)
+            if self.timers:
+                return max(0.0, self.timers[0][0] - time.monotonic())
+        return None
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"{self.name}: error in {getattr(callback, '__name__', callback)}: {e}")
+
+    def run(self):
+        print(f"{self.name} started")
+        while self.running:
+            for key, mask in self.selector.select(self._next_timeout()):
+                self.events += 1
+                self._run_callback(key.data, (mask,))
+            now = time.monotonic()
+            due = []
+            with self.lock:
+                while self.timers and (self.timers[0][2] is None or self.timers[0][0] <= now):
+                    timer = heapq.heappop(self.timers)
+                    if timer[2] is not None:
+                        due.append((timer[2], timer[3]))
+                # 只执行本轮开始前已投递的任务，回调中再投递的任务留到下一轮，避免饿死 I/O
+                for _ in range(len(self.ready)):
+                    due.append(self.ready.popleft())
+            for callback, args in due:
+                self._run_callback(callback, args)
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+        print(f"{self.name} stopped")
+
+
+class ReactorPool:
+    """固定数量的 I/O 循环，新会话分配给当前会话数最少的循环"""
+
+    def __init__(self, count):
+        self.reactors = [Reactor(f"io-reactor-{i}") for i in range(max(1, count))]
+        self.lock = threading.Lock()
+
+    def start(self):
+        for reactor in self.reactors:
+            reactor.start()
+
+    def stop(self):
+        for reactor in self.reactors:
+            reactor.stop()
+
+    def acquire(self):
+        with self.lock:
+            reactor = min(self.reactors, key=lambda r: r.sessions)
+            reactor.sessions += 1
+            return reactor
+
+    def release(self, reactor):
+        with self.lock:
+            reactor.sessions -= 1
+
+    def get_metrics(self):
+        return [{"name": r.name, "sessions": r.sessions, "events": r.events} for r in self.reactors]
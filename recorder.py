@@ -0,0 +1,249 @@
+import os
+import queue
+import re
+import struct
+import threading
+import time
+
+RECORDINGS_DIR = os.path.join('data', 'recordings')
+DEFAULT_QUEUE_FRAMES = 600   # 写入队列上限（帧），写盘跟不上时丢帧直到下一个关键帧，不阻塞直播
+FRAGMENT_MAX_FRAMES = 60     # 单个 fMP4 分片最多包含的帧数
+TIMESCALE = 1000000          # scrcpy 的 pts 以微秒为单位
+CODEC_H264 = 0x68323634
+
+SAMPLE_FLAGS_KEY = 0x02000000       # sample_depends_on = 2（不依赖其他帧）
+SAMPLE_FLAGS_NON_KEY = 0x01010000   # sample_depends_on = 1，is_non_sync_sample = 1
+IDENTITY_MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+def split_annexb(data):
+    """按起始码（00 00 01 / 00 00 00 01）拆分 Annex-B 数据，返回 NAL 单元列表"""
+    nals = []
+    start = None
+    i = 0
+    length = len(data)
+    while i + 2 < length:
+        if data[i] == 0 and data[i + 1] == 0 and data[i + 2] == 1:
+            if start is not None:
+                end = i - 1 if i > 0 and data[i - 1] == 0 else i
+                nals.append(data[start:end])
+            i += 3
+            start = i
+        else:
+            i += 1
+    if start is not None and start < length:
+        nals.append(data[start:])
+    return [nal for nal in nals if nal]
+
+
+def box(box_type, *payloads):
+    body = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+
+def full_box(box_type, version, flags, *payloads):
+    return box(box_type, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+class FragmentedMP4Writer:
+    """
+    最小的 H.264 fragmented MP4 封装：ftyp + moov（空样本表 + mvex），之后每批帧写一个 moof + mdat
+    只做封装（Annex-B 转为 4 字节长度前缀），不转码
+    """
+
+    def __init__(self, path, width, height, sps, pps):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.sequence = 0
+        self.file.write(self._init_segment(width, height, sps, pps))
+
+    def _init_segment(self, width, height, sps, pps):
+        ftyp = box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isom', b'iso6', b'avc1', b'mp41')
+        mvhd = full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, TIMESCALE, 0),
+                        struct.pack('>IH', 0x00010000, 0x0100), bytes(10), IDENTITY_MATRIX, bytes(24),
+                        struct.pack('>I', 2))
+        tkhd = full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0), bytes(8),
+                        struct.pack('>hhhH', 0, 0, 0, 0), IDENTITY_MATRIX,
+                        struct.pack('>II', width << 16, height << 16))
+        mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55c4, 0))
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s', 0, b'vide'), bytes(12), b'VideoHandler\0')
+        avcc = box(b'avcC', bytes([1, sps[1], sps[2], sps[3], 0xff, 0xe1]),
+                   struct.pack('>H', len(sps)), sps, bytes([1]), struct.pack('>H', len(pps)), pps)
+        avc1 = box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+                   struct.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1),
+                   bytes(32), struct.pack('>Hh', 0x0018, -1), avcc)
+        stbl = box(b'stbl',
+                   full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+                   full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+                   full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+                   full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+                   full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+        minf = box(b'minf', full_box(b'vmhd', 0, 1, bytes(8)), dinf, stbl)
+        trak = box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, minf))
+        trex = full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0))
+        return ftyp + box(b'moov', mvhd, trak, box(b'mvex', trex))
+
+    def write_fragment(self, samples, base_time):
+        """写入一个分片，samples 为 [(duration, keyframe, avcc_data)]，base_time 为首帧解码时间"""
+        self.sequence += 1
+        entries = b''.join(
+            struct.pack('>III', duration, len(data), SAMPLE_FLAGS_KEY if keyframe else SAMPLE_FLAGS_NON_KEY)
+            for duration, keyframe, data in samples)
+        # trun 的 data_offset 以 moof 起点计算，需先确定 moof 大小：固定部分 + 每帧 12 字节
+        moof_size = 8 + 16 + 8 + 16 + 20 + 20 + len(entries)
+        trun = full_box(b'trun', 0, 0x000701, struct.pack('>Ii', len(samples), moof_size + 8), entries)
+        traf = box(b'traf', full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1)),
+                   full_box(b'tfdt', 1, 0, struct.pack('>Q', base_time)), trun)
+        moof = box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', self.sequence)), traf)
+        self.file.write(moof)
+        self.file.write(box(b'mdat', *(data for _, _, data in samples)))
+
+    def close(self):
+        self.file.close()
+
+
+class SessionRecorder:
+    """
+    会话录制器：把 scrcpy 输出的 H.264 访问单元原样封装为 fragmented MP4 写入 data/recordings
+    feed() 在视频接收线程中调用，只复制数据并放入有界队列；封装与写盘由独立的写入线程完成。
+    会话中途分辨率变化（新的 SPS）时另起一个文件继续录制
+    """
+
+    def __init__(self, device_id, width, height, directory=RECORDINGS_DIR, max_queue=DEFAULT_QUEUE_FRAMES):
+        self.device_id = device_id
+        self.width = width
+        self.height = height
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.running = False
+        self.thread = None
+        self.files = []
+        self.frames = 0
+        self.dropped_frames = 0
+        self.waiting_keyframe = True  # 丢帧后需等关键帧才能继续写入
+        self.started_at = None
+
+    def _new_path(self):
+        safe_id = re.sub(r'[^0-9A-Za-z._-]', '_', self.device_id)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        suffix = f'_part{len(self.files) + 1}' if self.files else ''
+        return os.path.join(self.directory, f'{safe_id}_{stamp}{suffix}.mp4')
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self.write_task, daemon=True)
+        self.thread.start()
+        print(f"Recording started for {self.device_id}")
+
+    def set_video_size(self, width, height):
+        self.width = width
+        self.height = height
+
+    def feed(self, unit):
+        """由视频接收线程调用，不阻塞：队列已满时丢弃该帧并等待下一个关键帧"""
+        if not self.running:
+            return
+        if self.waiting_keyframe and not (unit.config or unit.keyframe):
+            self.dropped_frames += 1
+            return
+        try:
+            self.queue.put_nowait((unit.pts, unit.config, unit.keyframe, bytes(unit.payload)))
+            if unit.keyframe:
+                self.waiting_keyframe = False
+        except queue.Full:
+            self.dropped_frames += 1
+            self.waiting_keyframe = True
+
+    def stop(self):
+        """停止录制并等待写入线程落盘，返回录制文件列表"""
+        if not self.running:
+            return self.files
+        self.running = False
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join()
+        print(f"Recording stopped for {self.device_id}: {self.frames} frames, {self.dropped_frames} dropped")
+        return self.files
+
+    def get_info(self):
+        return {
+            "device_id": self.device_id,
+            "files": [os.path.basename(path) for path in self.files],
+            "frames": self.frames,
+            "dropped_frames": self.dropped_frames,
+            "duration": round(time.time() - self.started_at, 1) if self.started_at else 0
+        }
+
+    def write_task(self):
+        writer = None
+        sps = pps = None
+        start_pts = None
+        pending = []  # [(pts, keyframe, avcc_data)]，最后一帧的时长要等下一帧到达才能确定
+        last_duration = TIMESCALE // 60
+
+        def flush(final=False):
+            nonlocal last_duration
+            if writer is None or not pending:
+                return
+            count = len(pending) if final else len(pending) - 1
+            if count <= 0:
+                return
+            samples = []
+            for i in range(count):
+                pts, keyframe, data = pending[i]
+                if i + 1 < len(pending):
+                    duration = max(pending[i + 1][0] - pts, 1)
+                    last_duration = duration
+                else:
+                    duration = last_duration
+                samples.append((duration, keyframe, data))
+            writer.write_fragment(samples, pending[0][0] - start_pts)
+            del pending[:count]
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                pts, config, keyframe, payload = item
+                nals = split_annexb(payload)
+                if config:
+                    new_sps = next((nal for nal in nals if nal[0] & 0x1f == 7), None)
+                    new_pps = next((nal for nal in nals if nal[0] & 0x1f == 8), None)
+                    if new_sps and new_pps and (new_sps, new_pps) != (sps, pps):
+                        flush(final=True)
+                        if writer:
+                            writer.close()
+                            writer = None
+                        sps, pps = new_sps, new_pps
+                    continue
+                if writer is not None and pending and pts < pending[-1][0]:
+                    # 会话重启后 pts 从头计数，另起一个文件
+                    flush(final=True)
+                    writer.close()
+                    writer = None
+                if writer is None:
+                    if not keyframe or sps is None:
+                        continue
+                    path = self._new_path()
+                    writer = FragmentedMP4Writer(path, self.width, self.height, sps, pps)
+                    self.files.append(path)
+                    start_pts = pts
+                    print(f"Recording {self.device_id} to {path}")
+                # 参数集已写入 avcC，样本中只保留图像相关的 NAL
+                data = b''.join(struct.pack('>I', len(nal)) + nal
+                                for nal in nals if nal[0] & 0x1f not in (7, 8))
+                pending.append((pts, keyframe, data))
+                self.frames += 1
+                if keyframe or len(pending) > FRAGMENT_MAX_FRAMES:
+                    flush()
+            flush(final=True)
+        except Exception as e:
+            print(f"Recording error for {self.device_id}: {e}")
+            self.running = False
+        finally:
+            if writer:
+                writer.close()
@@ -1,15 +1,348 @@
-from threading import Thread
+from threading import Thread, Lock, Condition
+from collections import OrderedDict, deque
+import hashlib
+import os
+import selectors
 import subprocess
 import socket
 import time
 import random
 from adb_manager import ADBManager
+from metrics import SESSION_START_PHASE
 
 SCRCPY_SERVER_PATH = "scrcpy-server"
 DEVICE_SERVER_PATH = "/data/local/tmp/scrcpy-server.jar"
-BASE_PORT = 6666  # 改为基础端口，避免与5555冲突
+SCRCPY_SOCKET_NAME = "localabstract:scrcpy"
+DEVICE_NAME_LENGTH = 64
+CODEC_META_LENGTH = 12  # codec id + width + height
+PACKET_HEADER_LENGTH = 12  # pts/flags (8) + size (4)
+PACKET_FLAG_CONFIG = 1 << 63
+PACKET_FLAG_KEY_FRAME = 1 << 62
+PACKET_PTS_MASK = PACKET_FLAG_KEY_FRAME - 1
+NAL_START_CODE = b'\x00\x00\x01'  # 4 字节起始码 00 00 00 01 以它结尾
+NAL_TYPES_SLICE = (1, 5)  # 非 IDR / IDR 图像的 slice
+NAL_SCAN_LIMIT = 4096  # 查找第一个 slice 时最多检查的负载字节数，超出仍未找到时按不可丢弃处理
+AUDIO_CODECS = {
+    0x6f707573: 'opus',
+    0x00616163: 'aac',
+}
+AUDIO_DISABLED = 0  # 设备不支持音频采集（如 Android 11 以下）
+AUDIO_ERROR = 1
+CONTROL_MSG_TYPE_RESET_VIDEO = 17  # 让设备重启编码器，立即输出新的 SPS/PPS 和关键帧
+CONTROL_MSG_TYPE_INJECT_TOUCH = 2
+TOUCH_ACTION_MOVE = 2
+TOUCH_POINTER_ID = slice(2, 10)  # 触摸消息中 8 字节 pointer id 的位置（类型、动作之后）
+# 定长控制消息的长度（scrcpy 3.1），用于把一批控制消息拆分为单条
+CONTROL_MSG_LENGTHS = {
+    0: 14,   # INJECT_KEYCODE
+    2: 32,   # INJECT_TOUCH_EVENT
+    3: 21,   # INJECT_SCROLL_EVENT
+    4: 2,    # BACK_OR_SCREEN_ON
+    5: 1,    # EXPAND_NOTIFICATION_PANEL
+    6: 1,    # EXPAND_SETTINGS_PANEL
+    7: 1,    # COLLAPSE_PANELS
+    8: 2,    # GET_CLIPBOARD
+    10: 2,   # SET_DISPLAY_POWER
+    11: 1,   # ROTATE_DEVICE
+    17: 1,   # RESET_VIDEO
+}
+MAX_CONTROL_QUEUE = 256  # 控制写入队列上限（条），写入跟不上时拒绝新事件而不阻塞调用方
+MAX_PACKETS_PER_EVENT = 16  # reactor 模式下单次可读事件最多解析的数据包数，避免一个会话占满 I/O 循环
+
+SERVER_CONNECT_TIMEOUT = 5.0          # 等待设备端 scrcpy-server 就绪的最长时间（秒）
+SERVER_CONNECT_RETRY_INTERVAL = 0.1   # 就绪探测的重试间隔（秒）
+
+# 按设备序列号缓存已推送的 scrcpy-server 内容哈希，内容一致时跳过推送
+PUSHED_SERVER_HASHES = {}
+PUSH_CACHE_LOCK = Lock()
+_server_hash_cache = None  # (mtime, size, sha256)
+
+def get_server_hash():
+    """计算本地 scrcpy-server 的 sha256，文件未变化时复用上次结果"""
+    global _server_hash_cache
+    stat = os.stat(SCRCPY_SERVER_PATH)
+    if _server_hash_cache and _server_hash_cache[:2] == (stat.st_mtime, stat.st_size):
+        return _server_hash_cache[2]
+    digest = hashlib.sha256()
+    with open(SCRCPY_SERVER_PATH, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _server_hash_cache = (stat.st_mtime, stat.st_size, digest.hexdigest())
+    return _server_hash_cache[2]
+
+def forget_pushed_server(serial):
+    """设备上的 jar 可能已失效（如重启后被清理），下次启动时重新校验"""
+    with PUSH_CACHE_LOCK:
+        PUSHED_SERVER_HASHES.pop(serial or '', None)
+
+def first_slice_nal_header(payload):
+    """
+    返回访问单元中第一个 slice NAL 的头字节，跳过其前面的 AUD、SEI 等 NAL，兼容 3 字节与 4 字节起始码；
+    在前 NAL_SCAN_LIMIT 字节内找不到时返回 None
+    """
+    head = bytes(payload[:NAL_SCAN_LIMIT])
+    position = head.find(NAL_START_CODE)
+    while 0 <= position < len(head) - len(NAL_START_CODE):
+        header = head[position + len(NAL_START_CODE)]
+        if header & 0x1f in NAL_TYPES_SLICE:
+            return header
+        position = head.find(NAL_START_CODE, position + len(NAL_START_CODE))
+    return None
+
+def recv_into_exact(sock, view):
+    """把数据精确读入 view（memoryview），连接关闭时返回 False"""
+    received = 0
+    size = len(view)
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return False
+        received += n
+    return True
+
+class BufferPool:
+    """
+    视频包缓冲池
+    按 2 的幂分级复用 bytearray，避免热路径上每个包都分配新对象
+    """
+
+    def __init__(self, min_size=4096, max_free_per_class=32):
+        self.min_size = min_size
+        self.max_free_per_class = max_free_per_class
+        self.free = {}
+        self.lock = Lock()
+
+    def acquire(self, size):
+        capacity = max(self.min_size, 1 << (size - 1).bit_length())
+        with self.lock:
+            buffers = self.free.get(capacity)
+            if buffers:
+                return buffers.pop()
+        return bytearray(capacity)
+
+    def release(self, buffer):
+        with self.lock:
+            buffers = self.free.setdefault(len(buffer), [])
+            if len(buffers) < self.max_free_per_class:
+                buffers.append(buffer)
+
+class AccessUnit:
+    """
+    一个完整的 scrcpy 视频包（访问单元）
+    data 为包头 + 负载的 memoryview，指向缓冲池中的 bytearray，保持与浏览器端相同的帧格式。
+    持有者通过 retain/release 管理引用，计数归零后缓冲区回收到缓冲池。
+    """
+    __slots__ = ('pts', 'config', 'keyframe', 'size', 'data', 'received', 'device_delay', '_buffer', '_pool', '_refs')
+
+    def __init__(self, pool, buffer, length, pts_flags):
+        self.received = time.time()  # 服务器收齐该包的时间（秒）
+        self.device_delay = None     # 设备到主机的相对延迟（秒），见 PtsClock
+        self.pts = pts_flags & PACKET_PTS_MASK
+        self.config = bool(pts_flags & PACKET_FLAG_CONFIG)
+        self.keyframe = bool(pts_flags & PACKET_FLAG_KEY_FRAME)
+        self.size = length - PACKET_HEADER_LENGTH
+        self.data = memoryview(buffer)[:length]
+        self._buffer = buffer
+        self._pool = pool
+        self._refs = 1
+
+    @property
+    def payload(self):
+        return self.data[PACKET_HEADER_LENGTH:]
+
+    @property
+    def droppable(self):
+        """
+        是否为可丢弃的非参考帧（H.264 nal_ref_idc == 0）
+        以第一个 slice 为准：其前面的 AUD、SEI 的 nal_ref_idc 总是 0，同一图像各 slice 的 nal_ref_idc 相同
+        """
+        if self.config or self.keyframe:
+            return False
+        header = first_slice_nal_header(self.payload)
+        return header is not None and (header >> 5) & 0x3 == 0
+
+    def retain(self):
+        self._refs += 1
+        return self
+
+    def release(self):
+        self._refs -= 1
+        if self._refs == 0:
+            self.data = None
+            self._pool.release(self._buffer)
+            self._buffer = None
+
+class PtsClock:
+    """
+    根据 PTS 估计视频包从设备编码到主机收齐的延迟
+    PTS 来自设备时钟、从编码器启动时归零，与主机时钟没有共同基准，因此以编码器启动以来观察到的
+    最小 (接收时间 - PTS) 作为基准：返回的是相对最快一帧的额外延迟（设备端排队、编码与 adb 传输的抖动），
+    不含两端之间固定的最小传输时间。编码器重启（收到新的配置包）时重新建立基准
+    """
+
+    def __init__(self):
+        self.offset = None
+
+    def reset(self):
+        self.offset = None
+
+    def observe(self, pts, received):
+        offset = received - pts / 1_000_000
+        if self.offset is None or offset < self.offset:
+            self.offset = offset
+        return offset - self.offset
+
+
+class PacketReader:
+    """
+    reactor 模式下非阻塞地增量解析 scrcpy 数据流
+    先读取定长前缀（视频为会话头，音频为编码标识），之后逐个读取 12 字节包头与负载，
+    每读完一个完整的包以 AccessUnit 交给 on_packet；on_prefix 返回 False 时停止读取
+    """
+
+    def __init__(self, sock, pool, prefix_length, on_prefix, on_packet):
+        self.sock = sock
+        self.pool = pool
+        self.on_prefix = on_prefix
+        self.on_packet = on_packet
+        self.prefix = bytearray(prefix_length)
+        self.header = bytearray(PACKET_HEADER_LENGTH)
+        self.target = memoryview(self.prefix)  # 当前正在填充的区域
+        self.filled = 0
+        self.reading_prefix = True
+        self.buffer = None
+        self.length = 0
+        self.pts_flags = 0
+
+    def on_readable(self):
+        """读取已到达的数据，返回 False 表示连接已关闭或不再需要读取"""
+        packets = 0
+        while packets < MAX_PACKETS_PER_EVENT:
+            if self.filled < len(self.target):
+                try:
+                    n = self.sock.recv_into(self.target[self.filled:])
+                except (BlockingIOError, InterruptedError):
+                    return True
+                if n == 0:
+                    return False
+                self.filled += n
+                if self.filled < len(self.target):
+                    continue
+            if self.reading_prefix:
+                self.reading_prefix = False
+                if self.on_prefix(bytes(self.prefix)) is False:
+                    return False
+                self._expect_header()
+            elif self.buffer is None:
+                self.pts_flags = int.from_bytes(self.header[0:8], 'big')
+                self.length = PACKET_HEADER_LENGTH + int.from_bytes(self.header[8:12], 'big')
+                self.buffer = self.pool.acquire(self.length)
+                self.buffer[:PACKET_HEADER_LENGTH] = self.header
+                self.target = memoryview(self.buffer)[PACKET_HEADER_LENGTH:self.length]
+                self.filled = 0
+            else:
+                unit = AccessUnit(self.pool, self.buffer, self.length, self.pts_flags)
+                self.buffer = None
+                self._expect_header()
+                packets += 1
+                self.on_packet(unit)
+        return True
+
+    def _expect_header(self):
+        self.target = memoryview(self.header)
+        self.filled = 0
+
+    def close(self):
+        if self.buffer is not None:
+            self.pool.release(self.buffer)
+            self.buffer = None
+
+
+def split_control_messages(data):
+    """
+    把一批首尾相接的控制消息拆分为单条，返回 [(is_move, message)]
+    遇到不定长或未知类型的消息时，剩余部分整体作为一条普通消息，保持原有顺序
+    """
+    messages = []
+    offset = 0
+    while offset < len(data):
+        msg_type = data[offset]
+        length = CONTROL_MSG_LENGTHS.get(msg_type)
+        if length is None or offset + length > len(data):
+            messages.append((False, data[offset:]))
+            break
+        message = data[offset:offset + length]
+        is_move = msg_type == CONTROL_MSG_TYPE_INJECT_TOUCH and message[1] == TOUCH_ACTION_MOVE
+        messages.append((is_move, message))
+        offset += length
+    return messages
+
+
+class ControlQueue:
+    """
+    控制消息优先级队列
+    按键、触摸按下/抬起等普通消息按顺序排在前面；触摸移动按 pointer id 各保留最新一条（后者覆盖前者），
+    在普通消息之后写出。触摸按下/抬起自带坐标，会丢弃同一指针尚未写出的旧移动，不影响其它指针（多点触控）
+    """
+
+    def __init__(self, max_size=MAX_CONTROL_QUEUE):
+        self.max_size = max_size
+        self.urgent = deque()
+        self.moves = OrderedDict()  # pointer id -> 最新的移动消息
+        self.closed = False
+        self.condition = Condition()
+
+    def put(self, data):
+        """放入一批控制消息，队列已满时返回 False，不阻塞"""
+        messages = split_control_messages(bytes(data))
+        with self.condition:
+            if self.closed or len(self.urgent) + len(messages) > self.max_size:
+                return False
+            for is_move, message in messages:
+                if is_move:
+                    self.moves[message[TOUCH_POINTER_ID]] = message
+                else:
+                    if message[0] == CONTROL_MSG_TYPE_INJECT_TOUCH:
+                        self.moves.pop(message[TOUCH_POINTER_ID], None)
+                    self.urgent.append(message)
+            self.condition.notify()
+        return True
+
+    def take(self):
+        """阻塞取出当前所有待写消息并合并为一块，队列关闭时返回 None"""
+        with self.condition:
+            while not self.urgent and not self.moves and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            return self._drain()
+
+    def take_nowait(self):
+        """非阻塞地取出当前所有待写消息，没有消息或队列关闭时返回 None"""
+        with self.condition:
+            if self.closed or (not self.urgent and not self.moves):
+                return None
+            return self._drain()
+
+    def _drain(self):
+        """取出普通消息与各指针的最新移动并合并为一块，调用方需持有锁"""
+        parts = list(self.urgent)
+        parts.extend(self.moves.values())
+        self.urgent.clear()
+        self.moves.clear()
+        return b''.join(parts), len(parts)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
 
 class Scrcpy:
+    # 共享的 I/O 循环池（reactor.ReactorPool），设置后会话的 socket 与服务端日志管道由 I/O 循环处理，
+    # 不再为每个会话启动接收与写入线程；为 None 时每个会话使用独立线程
+    reactors = None
+
     def __init__(self):
         self.video_socket = None
         self.audio_socket = None
@@ -19,79 +352,127 @@ class Scrcpy:
         self.video_thread = None
         self.audio_thread = None
         self.control_thread = None
+        self.control_writer_thread = None
+        self.control_queue = None
+        self.reactor = None          # reactor 模式下分配到的 I/O 循环
+        self.readers = []            # reactor 模式下的 PacketReader
+        self.control_out = None      # reactor 模式下尚未写完的控制数据 (memoryview, 消息数, 开始时间)
+        self.control_flush_scheduled = False
+        self.server_log = bytearray()  # reactor 模式下尚未凑成整行的服务端日志
+        self.server_log_fd = None
+        self.control_writing = False   # reactor 模式下控制 socket 是否在等待可写事件
         self.android_process = None
         
         self.adb_manager = ADBManager()
         self.adb_path = self.adb_manager.adb_path
         self.device_id = None
         self.local_port = None  # 动态分配的本地端口
-        
-    def find_available_port(self, start_port=BASE_PORT, max_attempts=100):
-        """查找可用的端口"""
-        for i in range(max_attempts):
-            port = start_port + i
-            try:
-                # 检查端口是否可用
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('127.0.0.1', port))
-                    return port
-            except OSError:
-                continue
-        raise Exception(f"无法找到可用端口，尝试了 {max_attempts} 个端口")
+        self.max_size = 0  # 视频最长边上限，0 表示不限制
+        self.max_fps = 0   # 帧率上限，0 表示不限制
+        self.audio = False  # 是否开启音频流，未开启时设备不进行音频编码
+        self.audio_codec = 'opus'
+        self.control = True  # 是否开启控制通道，仅观看时可关闭
+        self.audio_callback = None
+
+        self.buffer_pool = BufferPool()
+        self.pts_clock = PtsClock()
+        self.session_header = None
+        self.device_name = None
+        self.codec_id = None
+        self.width = None
+        self.height = None
+        self.startup_timings = {}  # 启动各阶段耗时（秒）
+        self.video_frames = 0
+        self.video_bytes = 0
+        self.audio_bytes = 0
+        self.control_writes = 0        # 控制通道写入次数（每次写入合并后的一批控制消息）
+        self.control_messages = 0
+        self.control_rejected = 0      # 因队列已满被拒绝的控制批次
+        self.control_bytes = 0
+        self.control_write_time = 0.0  # 控制通道累计写入耗时（秒）
         
     def cleanup_adb_forward(self):
         """清理ADB端口转发"""
         if self.local_port:
             try:
-                cmd = [self.adb_path]
-                if self.device_id:
-                    cmd.extend(['-s', self.device_id])
-                cmd.extend(["forward", "--remove", f"tcp:{self.local_port}"])
-                subprocess.run(cmd, check=False)  # 不抛出异常，因为可能已经被清理
+                # 不检查结果，转发可能已经被清理
+                self.adb_manager.remove_forward(f"tcp:{self.local_port}", self.device_id)
                 print(f"Cleaned up ADB forward for port {self.local_port}")
             except Exception as e:
                 print(f"Error cleaning up ADB forward: {e}")
             finally:
                 self.local_port = None
 
+    def get_device_server_hash(self):
+        """读取设备上 scrcpy-server.jar 的 sha256，不存在或设备不支持时返回 None"""
+        success, output = self.adb_manager.shell(f"sha256sum {DEVICE_SERVER_PATH}", self.device_id, timeout=10)
+        digest = output.split()[0].lower() if success and output.strip() else ''
+        # 原生 shell 协议不返回退出码，文件不存在时输出的是错误信息，需校验格式
+        return digest if len(digest) == 64 and all(c in '0123456789abcdef' for c in digest) else None
+
     def push_server_to_device(self):
-        print("Pushing scrcpy-server.jar to device...")
-        cmd = [self.adb_path]
-        if self.device_id:
-            cmd.extend(['-s', self.device_id])
-        cmd.extend(["push", SCRCPY_SERVER_PATH, DEVICE_SERVER_PATH])
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"Error pushing server: {result.stderr}")
-            return False
+        """
+        推送 scrcpy-server.jar，设备上已有相同内容时跳过
+        先查主机端按序列号的缓存，未命中时再到设备上校验哈希，都不一致才真正推送
+        """
+        server_hash = get_server_hash()
+        serial = self.device_id or ''
+        with PUSH_CACHE_LOCK:
+            cached = PUSHED_SERVER_HASHES.get(serial)
+        if cached == server_hash:
+            print("scrcpy-server.jar already on device (cached), skipping push")
+            return True
+        if self.get_device_server_hash() == server_hash:
+            print("scrcpy-server.jar on device is up to date, skipping push")
+        else:
+            print("Pushing scrcpy-server.jar to device...")
+            success, output = self.adb_manager.push(SCRCPY_SERVER_PATH, DEVICE_SERVER_PATH, self.device_id)
+            if not success:
+                print(f"Error pushing server: {output}")
+                return False
+        with PUSH_CACHE_LOCK:
+            PUSHED_SERVER_HASHES[serial] = server_hash
         return True
 
     def setup_adb_forward(self):
         # 首先清理可能存在的旧转发
         self.cleanup_adb_forward()
         
-        # 分配新的可用端口
-        self.local_port = self.find_available_port()
-        print(f"Setting up ADB forward: tcp:{self.local_port} -> localabstract:scrcpy")
-        
-        cmd = [self.adb_path]
-        if self.device_id:
-            cmd.extend(['-s', self.device_id])
-        cmd.extend(["forward", f"tcp:{self.local_port}", "localabstract:scrcpy"])
-        
-        subprocess.run(cmd, check=True)
+        # tcp:0 由 adb server 原子地绑定一个空闲端口并返回端口号，并发会话不会选中同一端口
+        success, output = self.adb_manager.forward("tcp:0", SCRCPY_SOCKET_NAME, self.device_id)
+        if not success or not output.strip().isdigit():
+            raise Exception(f"ADB forward failed: {output}")
+        self.local_port = int(output.strip())
+        print(f"Set up ADB forward: tcp:{self.local_port} -> {SCRCPY_SOCKET_NAME}")
 
-    def start_server(self):
+    def build_server_args(self):
+        """生成 scrcpy-server 的启动参数"""
+        args = ["tunnel_forward=true", "log_level=VERBOSE", f"video_bit_rate={self.video_bit_rate}"]
+        if self.max_size:
+            args.append(f"max_size={self.max_size}")
+        if self.max_fps:
+            args.append(f"max_fps={self.max_fps}")
+        if self.audio:
+            args.append(f"audio_codec={self.audio_codec}")
+        else:
+            args.append("audio=false")
+        if not self.control:
+            args.append("control=false")
+        return " ".join(args)
+
+    def spawn_server(self):
         print("Starting scrcpy server in background...")
         cmd = [self.adb_path]
         if self.device_id:
             cmd.extend(['-s', self.device_id])
         cmd.extend([
             "shell",
-            f"CLASSPATH={DEVICE_SERVER_PATH} app_process / com.genymobile.scrcpy.Server 3.1 tunnel_forward=true log_level=VERBOSE video_bit_rate=" + self.video_bit_rate
+            f"CLASSPATH={DEVICE_SERVER_PATH} app_process / com.genymobile.scrcpy.Server 3.1 " + self.build_server_args()
         ])
         self.android_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def start_server(self):
+        self.spawn_server()
         while not self.stop:
             stderr_line = self.android_process.stderr.readline().decode().strip()
             if not stderr_line:
@@ -101,16 +482,34 @@ class Scrcpy:
         self.android_process.wait()
         print("Server stopped")
 
+    def parse_session_header(self, header):
+        """解析会话头：64 字节设备名 + codec id、宽、高"""
+        self.session_header = bytes(header)
+        self.device_name = self.session_header[:DEVICE_NAME_LENGTH].rstrip(b'\0').decode(errors='replace')
+        meta = self.session_header[DEVICE_NAME_LENGTH:]
+        self.codec_id = int.from_bytes(meta[0:4], 'big')
+        self.width = int.from_bytes(meta[4:8], 'big')
+        self.height = int.from_bytes(meta[8:12], 'big')
+
     def receive_video_data(self):
+        """
+        按 scrcpy 协议分帧读取视频流
+        会话头通过 header_callback 传递，之后每个完整的视频包以 AccessUnit 形式传给 video_callback，
+        回调返回后本方法释放自己的引用，需要保留该包的回调方应调用 retain()
+        """
         print("Receiving video data (H.264)...")
+        header_view = memoryview(bytearray(PACKET_HEADER_LENGTH))
         try:
-            self.video_socket.recv(1)
+            session_header = bytearray(DEVICE_NAME_LENGTH + CODEC_META_LENGTH)
+            if not recv_into_exact(self.video_socket, memoryview(session_header)):
+                raise ConnectionError("video stream closed before session header")
+            self.handle_session_header(session_header)
             while not self.stop:
                 try:
-                    data = self.video_socket.recv(20480)
-                    if not data:
+                    unit = self.read_packet(self.video_socket, header_view)
+                    if unit is None:
                         break
-                    self.video_callback(data)
+                    self.handle_video_packet(unit)
                 except (OSError, ConnectionError, socket.error) as e:
                     if not self.stop:
                         print(f"Video socket error: {e}")
@@ -120,15 +519,57 @@ class Scrcpy:
                 print(f"Video socket initialization error: {e}")
         print("Video data reception stopped")
 
+    def handle_session_header(self, header):
+        self.parse_session_header(header)
+        print(f"Device name: {self.device_name}, size: {self.width}x{self.height}")
+        if self.header_callback:
+            self.header_callback(self.session_header)
+
+    def handle_video_packet(self, unit):
+        """把视频包交给 video_callback，回调返回后释放本方的引用"""
+        if unit.config:
+            self.pts_clock.reset()
+        else:
+            unit.device_delay = self.pts_clock.observe(unit.pts, unit.received)
+        self.video_frames += 1
+        self.video_bytes += unit.size
+        try:
+            self.video_callback(unit)
+        finally:
+            unit.release()
+
+    def read_packet(self, sock, header_view):
+        """读取一个完整的 scrcpy 数据包，连接关闭时返回 None"""
+        if not recv_into_exact(sock, header_view):
+            return None
+        pts_flags = int.from_bytes(header_view[0:8], 'big')
+        length = PACKET_HEADER_LENGTH + int.from_bytes(header_view[8:12], 'big')
+        buffer = self.buffer_pool.acquire(length)
+        buffer[:PACKET_HEADER_LENGTH] = header_view
+        if not recv_into_exact(sock, memoryview(buffer)[PACKET_HEADER_LENGTH:length]):
+            self.buffer_pool.release(buffer)
+            return None
+        return AccessUnit(self.buffer_pool, buffer, length, pts_flags)
+
     def receive_audio_data(self):
+        """
+        读取音频流：先是 4 字节编码标识，之后与视频相同的分帧格式（首个为配置包）
+        每个数据包以 AccessUnit 形式传给 audio_callback
+        """
         print("Receiving audio data...")
+        header_view = memoryview(bytearray(PACKET_HEADER_LENGTH))
         try:
-            self.audio_socket.recv(1)
+            codec_meta = bytearray(4)
+            if not recv_into_exact(self.audio_socket, memoryview(codec_meta)):
+                raise ConnectionError("audio stream closed before codec id")
+            if not self.handle_audio_codec(codec_meta):
+                return
             while not self.stop:
                 try:
-                    data = self.audio_socket.recv(1024)
-                    if not data:
+                    unit = self.read_packet(self.audio_socket, header_view)
+                    if unit is None:
                         break
+                    self.handle_audio_packet(unit)
                 except (OSError, ConnectionError, socket.error) as e:
                     if not self.stop:
                         print(f"Audio socket error: {e}")
@@ -136,7 +577,29 @@ class Scrcpy:
         except (OSError, ConnectionError, socket.error) as e:
             if not self.stop:
                 print(f"Audio socket initialization error: {e}")
-        print("Audio data reception stopped")
+        finally:
+            print("Audio data reception stopped")
+
+    def handle_audio_codec(self, codec_meta):
+        """解析 4 字节音频编码标识，设备不支持或采集失败时返回 False"""
+        codec_id = int.from_bytes(codec_meta, 'big')
+        if codec_id == AUDIO_DISABLED:
+            print("Audio is not supported by the device")
+            return False
+        if codec_id == AUDIO_ERROR or codec_id not in AUDIO_CODECS:
+            print(f"Audio capture failed on the device (codec id {codec_id:#x})")
+            return False
+        self.audio_codec = AUDIO_CODECS[codec_id]
+        print(f"Audio codec: {self.audio_codec}")
+        return True
+
+    def handle_audio_packet(self, unit):
+        self.audio_bytes += unit.size
+        try:
+            if self.audio_callback:
+                self.audio_callback(unit)
+        finally:
+            unit.release()
 
     def handle_control_conn(self):
         print("Control connection established (idle)...")
@@ -157,67 +620,277 @@ class Scrcpy:
                 print(f"Control socket initialization error: {e}")
         print("Control connection stopped")
 
-    def scrcpy_start(self, video_callback, video_bit_rate):
+    def control_writer_task(self):
+        """控制写入线程：从优先级队列取出消息，合并后以 sendall 完整写入控制通道"""
+        while not self.stop:
+            item = self.control_queue.take()
+            if item is None:
+                break
+            data, count = item
+            try:
+                started = time.monotonic()
+                self.control_socket.sendall(data)
+                self.control_writes += 1
+                self.control_messages += count
+                self.control_bytes += len(data)
+                self.control_write_time += time.monotonic() - started
+            except (OSError, ConnectionError, socket.error) as e:
+                if not self.stop:
+                    print(f"Control socket connection lost: {e}")
+                break
+        print("Control writer stopped")
+
+    def attach_server_log(self):
+        """reactor 模式：把服务端的 stderr 管道注册到 I/O 循环，按行打印"""
+        self.server_log_fd = self.android_process.stderr.fileno()
+        os.set_blocking(self.server_log_fd, False)
+        self.reactor.register(self.server_log_fd, selectors.EVENT_READ, self.on_server_log)
+
+    def on_server_log(self, mask):
+        try:
+            data = os.read(self.server_log_fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.reactor.unregister(self.server_log_fd)
+            self.server_log_fd = None
+            print("Server stopped")
+            return
+        self.server_log += data
+        *lines, rest = self.server_log.split(b'\n')
+        self.server_log = bytearray(rest)
+        for line in lines:
+            line = line.decode(errors='replace').strip()
+            if line:
+                print(f"Server error: {line}")
+
+    def attach_streams(self):
+        """reactor 模式：把视频、音频、控制 socket 注册到 I/O 循环，需在循环线程中执行"""
+        self.attach_reader('Video', PacketReader(self.video_socket, self.buffer_pool,
+                                                 DEVICE_NAME_LENGTH + CODEC_META_LENGTH,
+                                                 self.handle_session_header, self.handle_video_packet))
+        if self.audio:
+            self.attach_reader('Audio', PacketReader(self.audio_socket, self.buffer_pool, 4,
+                                                     self.handle_audio_codec, self.handle_audio_packet))
+        if self.control:
+            self.control_socket.setblocking(False)
+            self.control_writing = False
+            self.reactor.register(self.control_socket, selectors.EVENT_READ, self.on_control_event)
+
+    def attach_reader(self, name, reader):
+        def on_readable(mask):
+            try:
+                alive = reader.on_readable()
+            except OSError as e:
+                alive = False
+                if not self.stop:
+                    print(f"{name} socket error: {e}")
+            if not alive or self.stop:
+                self.reactor.unregister(reader.sock)
+                reader.close()
+                print(f"{name} data reception stopped")
+
+        print(f"Receiving {name.lower()} data...")
+        reader.sock.setblocking(False)
+        self.readers.append(reader)
+        self.reactor.register(reader.sock, selectors.EVENT_READ, on_readable)
+
+    def on_control_event(self, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.control_socket.recv(1024)
+            except BlockingIOError:
+                data = None
+            except OSError as e:
+                if not self.stop:
+                    print(f"Control socket error: {e}")
+                data = b''
+            if data == b'':
+                self.reactor.unregister(self.control_socket)
+                self.control_out = None
+                print("Control connection stopped")
+                return
+            if data:
+                print("Control Mesg:", data)
+        if mask & selectors.EVENT_WRITE:
+            self.flush_control()
+
+    def flush_control(self):
+        """reactor 模式：写出控制队列中的消息，socket 发送缓冲区已满时等待可写事件后继续"""
+        self.control_flush_scheduled = False
+        while not self.stop:
+            if self.control_out is None:
+                item = self.control_queue.take_nowait()
+                if item is None:
+                    break
+                self.control_out = (memoryview(item[0]), item[1], time.monotonic())
+            view, count, started = self.control_out
+            try:
+                sent = self.control_socket.send(view)
+            except BlockingIOError:
+                sent = 0
+            except OSError as e:
+                if not self.stop:
+                    print(f"Control socket connection lost: {e}")
+                self.reactor.unregister(self.control_socket)
+                self.control_out = None
+                return
+            self.control_bytes += sent
+            if sent < len(view):
+                self.control_out = (view[sent:], count, started)
+                break
+            self.control_out = None
+            self.control_writes += 1
+            self.control_messages += count
+            self.control_write_time += time.monotonic() - started
+        writing = self.control_out is not None
+        if writing != self.control_writing:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            try:
+                self.reactor.modify(self.control_socket, events, self.on_control_event)
+                self.control_writing = writing
+            except (KeyError, ValueError):
+                pass  # 控制通道已关闭
+
+    def detach_streams(self):
+        """reactor 模式：从 I/O 循环注销本会话的全部 socket 与管道，需在循环线程中执行"""
+        for reader in self.readers:
+            self.reactor.unregister(reader.sock)
+            reader.close()
+        self.readers = []
+        if self.control_socket:
+            self.reactor.unregister(self.control_socket)
+        self.control_out = None
+        attached = self.server_log_fd is not None
+        if attached:
+            self.reactor.unregister(self.server_log_fd)
+            self.server_log_fd = None
+        return attached
+
+    def connect_video_socket(self):
+        """
+        就绪探测：连接转发端口并读取服务器发送的 1 字节占位数据
+        设备端服务尚未监听时 adb 会接受连接后立即关闭，此时按固定间隔重试直到超时
+        """
+        deadline = time.monotonic() + SERVER_CONNECT_TIMEOUT
+        attempts = 0
+        while not self.stop:
+            attempts += 1
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(max(deadline - time.monotonic(), SERVER_CONNECT_RETRY_INTERVAL))
+                sock.connect(('localhost', self.local_port))
+                if sock.recv(1):
+                    sock.settimeout(None)
+                    return sock
+            except OSError:
+                pass
+            sock.close()
+            server_exited = self.android_process is not None and self.android_process.poll() is not None
+            if server_exited or time.monotonic() >= deadline:
+                break
+            time.sleep(SERVER_CONNECT_RETRY_INTERVAL)
+        raise ConnectionError(f"scrcpy server not ready after {attempts} attempts")
+
+    def mark_phase(self, phase, started):
+        """记录启动阶段耗时，返回当前时间作为下一阶段的起点"""
+        now = time.monotonic()
+        self.startup_timings[phase] = now - started
+        return now
+
+    def scrcpy_start(self, video_callback, video_bit_rate, header_callback=None):
         self.video_bit_rate = video_bit_rate
         self.video_callback = video_callback
+        self.header_callback = header_callback
         self.stop = False
+        self.startup_timings = {}
+        started = phase_start = time.monotonic()
 
         # 检查设备连接状态
-        cmd = [self.adb_path]
-        if self.device_id:
-            cmd.extend(['-s', self.device_id])
-        cmd.append('devices')
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if "device" not in result.stdout:
-            print(f"Device {self.device_id} not found or not authorized.")
+        success, state = self.adb_manager.get_state(self.device_id)
+        if not success or state != "device":
+            print(f"Device {self.device_id} not found or not authorized: {state}")
             return False
-        print(f"Device check result: {result.stdout}")
+        print(f"Device check result: {state}")
+        phase_start = self.mark_phase('device_check', phase_start)
 
         if not self.push_server_to_device():
             print("Failed to push server files to device.")
             return False
+        phase_start = self.mark_phase('push', phase_start)
 
         self.setup_adb_forward()
-        self.android_thread = Thread(target=self.start_server, daemon=True)
-        self.android_thread.start()
-        time.sleep(1)
+        phase_start = self.mark_phase('forward', phase_start)
+        if self.reactors:
+            self.reactor = self.reactors.acquire()
+            self.spawn_server()
+            self.reactor.run_sync(self.attach_server_log)
+        else:
+            self.android_thread = Thread(target=self.start_server, daemon=True)
+            self.android_thread.start()
 
         try:
-            # video connection
-            self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.video_socket.connect(('localhost', self.local_port))
+            # 连接顺序必须与服务器一致：video、audio（若开启）、control（若开启）
+            # video connection（同时作为服务器就绪探测）
+            self.video_socket = self.connect_video_socket()
+            phase_start = self.mark_phase('server_ready', phase_start)
             print("Video connection established")
 
             # audio connection
-            self.audio_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.audio_socket.connect(('localhost', self.local_port))
-            print("Audio connection established")
+            if self.audio:
+                self.audio_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.audio_socket.connect(('localhost', self.local_port))
+                print("Audio connection established")
 
             # contorl connection
-            self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.control_socket.connect(('localhost', self.local_port))
-            print("Control connection established")
-
-            self.video_thread = Thread(target=self.receive_video_data, daemon=True)
-            self.audio_thread = Thread(target=self.receive_audio_data, daemon=True)
-            self.control_thread = Thread(target=self.handle_control_conn, daemon=True)
-            self.video_thread.start()
-            self.audio_thread.start()
-            self.control_thread.start()
+            if self.control:
+                self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.control_socket.connect(('localhost', self.local_port))
+                print("Control connection established")
+
+            if self.control:
+                self.control_queue = ControlQueue()
+            if self.reactor:
+                self.reactor.run_sync(self.attach_streams)
+            else:
+                self.video_thread = Thread(target=self.receive_video_data, daemon=True)
+                self.video_thread.start()
+                if self.audio:
+                    self.audio_thread = Thread(target=self.receive_audio_data, daemon=True)
+                    self.audio_thread.start()
+                if self.control:
+                    self.control_thread = Thread(target=self.handle_control_conn, daemon=True)
+                    self.control_thread.start()
+                    self.control_writer_thread = Thread(target=self.control_writer_task, daemon=True)
+                    self.control_writer_thread.start()
             print("Background tasks started")
+            self.mark_phase('connect', phase_start)
+            self.startup_timings['total'] = time.monotonic() - started
+            timings = " ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in self.startup_timings.items())
+            for phase, seconds in self.startup_timings.items():
+                SESSION_START_PHASE.observe(seconds, phase)
+            print(f"Startup timings for {self.device_id}: {timings}")
             
             return True  # 成功启动
             
         except Exception as e:
             print(f"Error establishing connections: {e}")
+            forget_pushed_server(self.device_id)
             self.scrcpy_stop()  # 清理资源
             return False
 
     def scrcpy_stop(self):
         print("Stopping Scrcpy")
         self.stop = True
-        
+        if self.control_queue:
+            self.control_queue.close()
+        server_log_attached = False
+        if self.reactor:
+            # 先从 I/O 循环注销，之后关闭的描述符不会再被 select
+            server_log_attached = self.reactor.run_sync(self.detach_streams)
+
         # 安全地关闭socket连接
         sockets_to_close = [
             ('video_socket', self.video_socket),
@@ -240,7 +913,8 @@ class Scrcpy:
         threads_to_join = [
             ('video_thread', self.video_thread),
             ('audio_thread', self.audio_thread),
-            ('control_thread', self.control_thread)
+            ('control_thread', self.control_thread),
+            ('control_writer_thread', self.control_writer_thread)
         ]
         
         for thread_name, thread in threads_to_join:
@@ -264,7 +938,9 @@ class Scrcpy:
                     self.android_process.kill()
             except Exception as e:
                 print(f"Error terminating Android process: {e}")
-                
+            if server_log_attached:
+                print("Server stopped")
+
         if self.android_thread and self.android_thread.is_alive():
             try:
                 self.android_thread.join(timeout=3)
@@ -278,28 +954,36 @@ class Scrcpy:
             self.cleanup_adb_forward()
         except Exception as e:
             print(f"Error cleaning up ADB forward: {e}")
-        
+
+        if self.reactor:
+            self.reactors.release(self.reactor)
+            self.reactor = None
+
         print("Scrcpy stopped")
 
     def scrcpy_send_control(self, data):
-        try:
-            if not hasattr(self, 'control_socket') or self.control_socket is None:
-                print("Error: Control socket not initialized")
-                return False
-            
-            # 检查套接字是否仍然连接
-            try:
-                # 尝试发送数据
-                self.control_socket.send(data)
-                print(f"Control data sent successfully: {len(data)} bytes")
-                return True
-            except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
-                print(f"Control socket connection lost: {e}")
-                return False
-            except Exception as e:
-                print(f"Error sending control data: {e}")
-                return False
-                
-        except Exception as e:
-            print(f"Unexpected error in scrcpy_send_control: {e}")
-            return False
\ No newline at end of file
+        """
+        把一批控制消息放入控制写入队列，由控制写入线程完成写入，调用方不会被阻塞
+        返回是否已接受，队列已满或控制通道未建立时返回 False
+        """
+        if self.control_socket is None or self.control_queue is None:
+            print("Error: Control socket not initialized")
+            return False
+        if not self.control_queue.put(data):
+            self.control_rejected += 1
+            return False
+        if self.reactor and not self.control_flush_scheduled:
+            self.control_flush_scheduled = True
+            self.reactor.call_soon(self.flush_control)
+        return True
+
+    def control_queue_depth(self):
+        """控制写入队列中待写的消息数"""
+        queue = self.control_queue
+        if queue is None:
+            return 0
+        return len(queue.urgent) + len(queue.moves)
+
+    def request_keyframe(self):
+        """通过控制通道请求设备重新输出配置包和关键帧"""
+        return self.scrcpy_send_control(bytes([CONTROL_MSG_TYPE_RESET_VIDEO]))
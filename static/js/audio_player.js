@@ -0,0 +1,113 @@
+// 设备音频播放器：WebCodecs AudioDecoder 解码 Opus/AAC，Web Audio 按顺序排程播放
+class AudioPlayer {
+    constructor(options = {}) {
+        this.sampleRate = options.sampleRate || 48000;   // scrcpy 默认采样率
+        this.channels = options.channels || 2;
+        this.startDelay = options.startDelay || 0.05;    // 起播/欠载后的缓冲（秒）
+        this.maxLatency = options.maxLatency || 0.3;     // 排程超前超过该值时丢弃积压，避免延迟累积
+        this.context = null;
+        this.decoder = null;
+        this.nextTime = 0;
+        this.configured = false;
+    }
+
+    static isSupported() {
+        return typeof AudioDecoder !== 'undefined' && typeof AudioContext !== 'undefined';
+    }
+
+    // 浏览器要求在用户手势中创建/恢复 AudioContext
+    resume() {
+        if (!AudioPlayer.isSupported()) return;
+        if (!this.context) {
+            this.context = new AudioContext({ sampleRate: this.sampleRate, latencyHint: 'interactive' });
+        }
+        if (this.context.state === 'suspended') {
+            this.context.resume().catch(() => { });
+        }
+    }
+
+    // 处理服务器的 audio_config 事件：{ codec: 'opus' | 'aac', config: OpusHead / AudioSpecificConfig }
+    configure({ codec, config }) {
+        if (!AudioPlayer.isSupported()) {
+            console.warn('WebCodecs AudioDecoder is not supported, audio disabled');
+            return;
+        }
+        this.resume();
+        this.closeDecoder();
+        const description = config ? new Uint8Array(config) : undefined;
+        this.decoder = new AudioDecoder({
+            output: (audioData) => this.play(audioData),
+            error: (e) => {
+                console.warn('Audio decode error:', e);
+                this.configured = false;
+            }
+        });
+        try {
+            this.decoder.configure({
+                codec: codec === 'aac' ? 'mp4a.40.2' : 'opus',
+                sampleRate: this.sampleRate,
+                numberOfChannels: this.channels,
+                description
+            });
+            this.configured = true;
+            this.nextTime = 0;
+        } catch (e) {
+            console.warn('Audio decoder configure error:', e);
+            this.configured = false;
+        }
+    }
+
+    // 处理服务器的 audio_data 事件：12 字节 scrcpy 包头 + 编码帧
+    appendPacket(data) {
+        if (!this.configured || this.decoder.state !== 'configured') return;
+        const packet = data instanceof Uint8Array ? data : new Uint8Array(data);
+        if (packet.length <= 12) return;
+        const view = new DataView(packet.buffer, packet.byteOffset, packet.byteLength);
+        // 高两位为配置/关键帧标志，其余为以微秒计的 pts
+        const pts = (view.getUint32(0, false) & 0x3fffffff) * 4294967296 + view.getUint32(4, false);
+        this.decoder.decode(new EncodedAudioChunk({
+            type: 'key',
+            timestamp: pts,
+            data: packet.subarray(12)
+        }));
+    }
+
+    play(audioData) {
+        try {
+            if (!this.context) return;
+            const frames = audioData.numberOfFrames;
+            const channels = Math.min(audioData.numberOfChannels, this.channels);
+            const buffer = this.context.createBuffer(channels, frames, audioData.sampleRate);
+            for (let ch = 0; ch < channels; ch++) {
+                audioData.copyTo(buffer.getChannelData(ch), { planeIndex: ch, format: 'f32-planar' });
+            }
+            const now = this.context.currentTime;
+            if (this.nextTime < now || this.nextTime - now > this.maxLatency) {
+                // 欠载或积压过多：重新以少量缓冲对齐到当前时间
+                this.nextTime = now + this.startDelay;
+            }
+            const source = this.context.createBufferSource();
+            source.buffer = buffer;
+            source.connect(this.context.destination);
+            source.start(this.nextTime);
+            this.nextTime += buffer.duration;
+        } finally {
+            audioData.close();
+        }
+    }
+
+    closeDecoder() {
+        if (this.decoder && this.decoder.state !== 'closed') {
+            try {
+                this.decoder.close();
+            } catch (e) { }
+        }
+        this.decoder = null;
+        this.configured = false;
+    }
+
+    close() {
+        this.closeDecoder();
+        this.nextTime = 0;
+    }
+}
@@ -5,6 +5,11 @@ class ScrcpyInput {
         this.height = height
         this.debug = debug
         this.videoElement = videoElement
+        // 控制事件批处理：同一帧内同一指针的多次移动只保留最后一次；
+        // 其他事件（按下、抬起、按键、滚轮）立即与尚未发送的移动一起，按原顺序合并为一条二进制消息发送
+        this.pendingMoves = new Map();
+        this.queue = [];
+        this.flushScheduled = false;
         // 绑定处理器引用，便于后续解绑
         this._onMouseDown = null;
         this._onMouseUp = null;
@@ -30,7 +35,7 @@ class ScrcpyInput {
                     mouseY = (local_y / (rect.bottom - rect.top)) * this.height;
 
                     let data = this.createTouchProtocolData(0, mouseX, mouseY, this.width, this.height, 0, 0, 65535);
-                    this.callback(data);
+                    this.emit(data);
                 } else if (event.button === 2) {
                     rightButtonIsPressed = true;
 
@@ -57,7 +62,7 @@ class ScrcpyInput {
                 }
     
                 let data = this.createTouchProtocolData(1, mouseX, mouseY, this.width, this.height, 0, 0, 0);
-                this.callback(data);
+                this.emit(data);
 
             } else if (event.button === 2 && rightButtonIsPressed) {
                 rightButtonIsPressed = false;
@@ -80,7 +85,7 @@ class ScrcpyInput {
                 mouseY = (local_y / (rect.bottom - rect.top)) * this.height;
 
                 let data = this.createTouchProtocolData(2, mouseX, mouseY, this.width, this.height, 0, 0, 65535);
-                this.callback(data);
+                this.emit(data, 'mouse');
             }
         };
         document.addEventListener('mousemove', this._onMouseMove);
@@ -108,7 +113,9 @@ class ScrcpyInput {
             const width = rect.right - rect.left;
             const height = rect.bottom - rect.top;
 
-            console.log(`Scroll event: deltaX=${hScroll}, deltaY=${vScroll}, x=${relativeX}, y=${relativeY}`);
+            if (this.debug) {
+                console.log(`Scroll event: deltaX=${hScroll}, deltaY=${vScroll}, x=${relativeX}, y=${relativeY}`);
+            }
 
             // switch (deltaMode) {
             //     case WheelEvent.DOM_DELTA_PIXEL:
@@ -124,7 +131,7 @@ class ScrcpyInput {
             //         deltaModeValue.textContent = 'unknown';
             // }
             let data = this.createScrollProtocolData(relativeX, relativeY, width, height, hScroll, vScroll, button);
-            this.callback(data);
+            this.emit(data);
         };
         videoElement.addEventListener('wheel', this._onWheel);
 
@@ -157,6 +164,42 @@ class ScrcpyInput {
         videoElement.addEventListener('keyup', this._onKeyUp);
     }
 
+    // pointerId 不为空表示可合并的移动事件，同一指针在下一帧前只保留最新位置
+    emit(data, pointerId = null) {
+        if (pointerId !== null) {
+            this.pendingMoves.set(pointerId, data);
+            if (!this.flushScheduled) {
+                this.flushScheduled = true;
+                const schedule = typeof requestAnimationFrame === 'function'
+                    ? requestAnimationFrame
+                    : (fn) => setTimeout(fn, 16);
+                schedule(() => this.flush());
+            }
+            return;
+        }
+        this.queue.push(...this.pendingMoves.values(), data);
+        this.pendingMoves.clear();
+        this.flush();
+    }
+
+    flush() {
+        this.flushScheduled = false;
+        this.queue.push(...this.pendingMoves.values());
+        this.pendingMoves.clear();
+        if (this.queue.length === 0) return;
+
+        const total = this.queue.reduce((size, buffer) => size + buffer.byteLength, 0);
+        const batch = new Uint8Array(total);
+        let offset = 0;
+        for (const buffer of this.queue) {
+            batch.set(new Uint8Array(buffer), offset);
+            offset += buffer.byteLength;
+        }
+        const count = this.queue.length;
+        this.queue = [];
+        this.callback(batch.buffer, count);
+    }
+
     resizeScreen(width, height) {
         this.width = width;
         this.height = height;
@@ -292,7 +335,7 @@ class ScrcpyInput {
         //     metakey |= 0x400000;
         // }
         let data = this.createKeyProtocolData(action, keycode, keyevent.repeat, metakey);
-        this.callback(data);
+        this.emit(data);
     }
 
     createTouchProtocolData(action, x, y, width, height, actionButton, buttons, pressure) {
@@ -441,11 +484,12 @@ class ScrcpyInput {
     screen_on_off(action) {
         let data = null;
         data = this.createScreenProtocolData(action);
-        this.callback(data)
+        this.emit(data);
     }
 
     destroy() {
         try {
+            this.flush();
             document.removeEventListener('mousedown', this._onMouseDown);
             document.removeEventListener('mouseup', this._onMouseUp);
             document.removeEventListener('mousemove', this._onMouseMove);
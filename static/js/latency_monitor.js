@@ -0,0 +1,123 @@
+// 画面延迟采样参数
+const CLOCK_SYNC_INTERVAL = 30 * 1000;  // 时钟同步间隔（毫秒）
+const CLOCK_SYNC_BURST = 5;             // 开始镜像时连续同步的次数
+const CLOCK_SYNC_SAMPLES = 8;           // 取最近若干次同步中往返时间最短的一次
+const LATENCY_REPORT_INTERVAL = 2000;   // 上报间隔（毫秒）
+const LATENCY_WINDOW = 100;             // 页面显示统计使用的最近样本数
+const MAX_EXPECTED_TIMINGS = 64;        // 等待匹配的帧时间信息上限
+
+// 画面延迟（glass-to-glass）采样：服务器按固定间隔为部分视频帧发送时间信息（video_timing：pts、设备到主机延迟、
+// 服务器收到与发出的时间），浏览器记录该帧到达与显示的时间，用往返时间最短的一次时钟同步换算到服务器时钟，
+// 按阶段上报（latency_report）：device 设备到主机、queue 服务器排队、network 网络传输、decode 解码到显示
+class LatencyMonitor {
+    constructor(socket, onUpdate) {
+        this.socket = socket;
+        this.onUpdate = onUpdate;
+        this.deviceId = null;
+        this.expected = new Map();  // pts -> 服务器时间信息
+        this.reports = [];
+        this.window = [];
+        this.syncSamples = [];
+        this.clockOffset = null;    // 服务器时钟 - 本地时钟（毫秒），未同步时为 null
+        this.syncTimer = null;
+        this.reportTimer = null;
+    }
+
+    static now() {
+        return performance.timeOrigin + performance.now();
+    }
+
+    start(deviceId) {
+        this.stop();
+        this.deviceId = deviceId;
+        for (let i = 0; i < CLOCK_SYNC_BURST; i++) {
+            setTimeout(() => this.syncClock(), i * 200);
+        }
+        this.syncTimer = setInterval(() => this.syncClock(), CLOCK_SYNC_INTERVAL);
+        this.reportTimer = setInterval(() => this.flush(), LATENCY_REPORT_INTERVAL);
+    }
+
+    stop() {
+        this.flush();
+        clearInterval(this.syncTimer);
+        clearInterval(this.reportTimer);
+        this.syncTimer = null;
+        this.reportTimer = null;
+        this.deviceId = null;
+        this.expected.clear();
+        this.window = [];
+    }
+
+    syncClock() {
+        const sentAt = LatencyMonitor.now();
+        this.socket.emit('clock_sync', {}, (serverTime) => {
+            const receivedAt = LatencyMonitor.now();
+            this.syncSamples.push({ rtt: receivedAt - sentAt, offset: serverTime - (sentAt + receivedAt) / 2 });
+            if (this.syncSamples.length > CLOCK_SYNC_SAMPLES) {
+                this.syncSamples.shift();
+            }
+            this.clockOffset = this.syncSamples.reduce((best, s) => (s.rtt < best.rtt ? s : best)).offset;
+        });
+    }
+
+    // 收到服务器的帧时间信息，对应的视频数据紧随其后到达
+    handleTiming(timing) {
+        if (!this.deviceId || !timing) return;
+        this.expected.set(timing.pts, timing);
+        if (this.expected.size > MAX_EXPECTED_TIMINGS) {
+            this.expected.delete(this.expected.keys().next().value);
+        }
+    }
+
+    // 解析出视频帧时调用，返回该帧的采样（没有时间信息时返回 null），显示后传给 framePresented
+    frameReceived(pts) {
+        const timing = this.expected.get(pts);
+        if (!timing) return null;
+        this.expected.delete(pts);
+        return { timing, arrivedAt: LatencyMonitor.now() };
+    }
+
+    // presentedAt 为帧实际显示的本地时间（与 LatencyMonitor.now() 同一时钟）
+    framePresented(sample, presentedAt) {
+        if (!this.deviceId) return;
+        const { timing, arrivedAt } = sample;
+        const result = {
+            device: timing.device,
+            queue: Math.max(0, timing.sent - timing.received),
+            network: this.clockOffset === null ? null : Math.max(0, arrivedAt + this.clockOffset - timing.sent),
+            decode: Math.max(0, presentedAt - arrivedAt),
+        };
+        this.reports.push(result);
+        this.window.push(result);
+        if (this.window.length > LATENCY_WINDOW) {
+            this.window.shift();
+        }
+        if (this.onUpdate) {
+            this.onUpdate(this.summary());
+        }
+    }
+
+    flush() {
+        if (this.deviceId && this.reports.length) {
+            this.socket.emit('latency_report', { device_id: this.deviceId, samples: this.reports });
+        }
+        this.reports = [];
+    }
+
+    // 最近样本各阶段的中位数，以及完整样本合计的中位数与 P95（毫秒）
+    summary() {
+        const percentile = (values, p) => {
+            if (!values.length) return null;
+            const sorted = [...values].sort((a, b) => a - b);
+            return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+        };
+        const stages = {};
+        for (const stage of ['device', 'queue', 'network', 'decode']) {
+            stages[stage] = percentile(this.window.map(s => s[stage]).filter(v => typeof v === 'number'), 0.5);
+        }
+        const totals = this.window
+            .filter(s => [s.device, s.queue, s.network, s.decode].every(v => typeof v === 'number'))
+            .map(s => s.device + s.queue + s.network + s.decode);
+        return { stages, total: percentile(totals, 0.5), totalP95: percentile(totals, 0.95), samples: this.window.length };
+    }
+}
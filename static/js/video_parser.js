@@ -1,7 +1,16 @@
+const SCRCPY_DEVICE_NAME_LENGTH = 64;
+const SCRCPY_HEADER_LENGTH = 12;  // 视频会话头（codec id、宽、高）与每个包的包头长度相同
+
 class VideoParser {
     constructor(onNaluCallback, debug = false) {
         this.debug = debug
-        this.buffer = new Uint8Array(0);
+        // 未消费的数据按收到的块依次保存，不再合并成一个大数组；
+        // 包完整位于一个块内时直接返回子视图，跨块时只拷贝该包一次
+        this.chunks = [];
+        this.chunkOffset = 0;  // 第一个块中已消费的字节数
+        this.length = 0;       // 未消费的总字节数
+        this.header = new Uint8Array(SCRCPY_HEADER_LENGTH);
+        this.headerView = new DataView(this.header.buffer);
         this.name = null;
         this.width = null;
         this.height = null;
@@ -18,54 +27,92 @@ class VideoParser {
         if (!data || data.length === 0) {
             return;
         }
-        const newBuffer = new Uint8Array(this.buffer.length + data.length);
-        newBuffer.set(this.buffer, 0);
-        newBuffer.set(data, this.buffer.length);
-        this.buffer = newBuffer;
+        this.chunks.push(data);
+        this.length += data.length;
         this.scrcpyProcessBuffer();
     }
 
+    // 把接下来的 target.length 字节拷贝到 target，不消费数据
+    peek(target) {
+        let filled = 0;
+        let offset = this.chunkOffset;
+        for (const chunk of this.chunks) {
+            const n = Math.min(chunk.length - offset, target.length - filled);
+            target.set(chunk.subarray(offset, offset + n), filled);
+            filled += n;
+            offset = 0;
+            if (filled === target.length) break;
+        }
+    }
+
+    // 取出接下来的 n 字节，调用方需保证数据足够
+    take(n) {
+        const first = this.chunks[0];
+        if (n === 0) {
+            return new Uint8Array(0);
+        }
+        if (first.length - this.chunkOffset >= n) {
+            const view = first.subarray(this.chunkOffset, this.chunkOffset + n);
+            this.skip(n);
+            return view;
+        }
+        const result = new Uint8Array(n);
+        this.peek(result);
+        this.skip(n);
+        return result;
+    }
+
+    skip(n) {
+        this.length -= n;
+        while (n > 0) {
+            const remaining = this.chunks[0].length - this.chunkOffset;
+            if (n < remaining) {
+                this.chunkOffset += n;
+                return;
+            }
+            n -= remaining;
+            this.chunks.shift();
+            this.chunkOffset = 0;
+        }
+    }
+
     scrcpyProcessBuffer() {
-        let startIndex = 0;
         if (this.name == null) {
-            if (this.buffer.length >= 64) {
-                const name = this.buffer.slice(0, 64);
-                this.name = new TextDecoder().decode(name);
-                console.log("Device name:" + this.name);
-                if (this.onNaluCallback) {
-                    this.onNaluCallback({
-                        type: 'name',
-                        data: { "name": this.name }
-                    });
-                }
-                startIndex = 64;
-            }
-        } else if (this.width == null) {
-            if (this.buffer.length >= 12) {
-                const id = new DataView(this.buffer.buffer).getInt32(0, false);
-                this.width = new DataView(this.buffer.buffer).getInt32(4, false);
-                this.height = new DataView(this.buffer.buffer).getInt32(8, false);
-                console.log("width:" + this.width + " height:" + this.height);
-                if (this.onNaluCallback) {
-                    this.onNaluCallback({
-                        type: 'screen_size',
-                        data: { "width": this.width, "height": this.height }
-                    });
-                }
-                startIndex += 12;
+            if (this.length < SCRCPY_DEVICE_NAME_LENGTH) return;
+            this.name = new TextDecoder().decode(this.take(SCRCPY_DEVICE_NAME_LENGTH));
+            console.log("Device name:" + this.name);
+            if (this.onNaluCallback) {
+                this.onNaluCallback({
+                    type: 'name',
+                    data: { "name": this.name }
+                });
             }
-        } else while (this.buffer.length - startIndex > 12) {
-            // const flag = new DataView(this.buffer.buffer).getInt64(0, false);
-            const size = new DataView(this.buffer.buffer).getInt32(startIndex + 8, false);
-            if (this.buffer.length - startIndex >= 12 + size) {
-                const nalu = this.buffer.slice(startIndex + 12, startIndex + 12 + size);
-                this.processBuffer(nalu)
-                startIndex = startIndex + 12 + size;
-            } else {
-                break;
+        }
+        if (this.width == null) {
+            if (this.length < SCRCPY_HEADER_LENGTH) return;
+            this.peek(this.header);
+            this.skip(SCRCPY_HEADER_LENGTH);
+            this.width = this.headerView.getInt32(4, false);
+            this.height = this.headerView.getInt32(8, false);
+            console.log("width:" + this.width + " height:" + this.height);
+            if (this.onNaluCallback) {
+                this.onNaluCallback({
+                    type: 'screen_size',
+                    data: { "width": this.width, "height": this.height }
+                });
             }
         }
-        this.buffer = this.buffer.slice(startIndex);
+        while (this.length >= SCRCPY_HEADER_LENGTH) {
+            // 包头前 8 字节：最高两位为配置包/关键帧标志，其余 62 位为 pts（微秒）
+            this.peek(this.header);
+            const flags = this.headerView.getUint32(0, false);
+            const keyframe = (flags & 0x40000000) !== 0;
+            const pts = (flags & 0x3fffffff) * 4294967296 + this.headerView.getUint32(4, false);
+            const size = this.headerView.getInt32(8, false);
+            if (this.length < SCRCPY_HEADER_LENGTH + size) break;
+            this.skip(SCRCPY_HEADER_LENGTH);
+            this.processBuffer(this.take(size), pts, keyframe);
+        }
     }
 
     findSequence(arr, sequence, startIndex = 0) {
@@ -85,7 +132,8 @@ class VideoParser {
         return -1;
     }
 
-    processBuffer(nalu) {
+    // keyframe 为包头中的关键帧标志：包内第一个 NAL 可能是 AUD、SEI 等，不能据此判断
+    processBuffer(nalu, pts = null, keyframe = false) {
         // Need at least NALU header (0 0 0 1 XX)
         if (!nalu || nalu.length < 5) {
             if (this.debug) console.warn('skip short nalu', nalu && nalu.length);
@@ -104,7 +152,7 @@ class VideoParser {
                 this.sps = nalu.slice(0, next_pos)
                 if (this.debug)
                     console.log("sps", next_pos)
-                this.processBuffer(nalu.slice(next_pos))
+                this.processBuffer(nalu.slice(next_pos), pts, keyframe)
             } else {
                 this.sps = nalu
                 if (this.debug)
@@ -129,7 +177,7 @@ class VideoParser {
                 this.pps = nalu.slice(0, next_pos)
                 if (this.debug)
                     console.log("pps", next_pos)
-                this.processBuffer(nalu.slice(next_pos))
+                this.processBuffer(nalu.slice(next_pos), pts, keyframe)
             } else {
                 this.pps = nalu
                 if (this.debug)
@@ -157,7 +205,9 @@ class VideoParser {
         if (this.onNaluCallback) {
             this.onNaluCallback({
                 type: 'nalu',
-                data: nalu
+                data: nalu,
+                pts: pts,
+                keyframe: keyframe
             });
         }
     }
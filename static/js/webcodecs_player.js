@@ -0,0 +1,178 @@
+// 低延迟视频播放器：WebCodecs VideoDecoder 解码 H.264（Annex B），在 requestAnimationFrame 中把最新一帧绘制到 canvas，
+// 不经过 MSE 的缓冲。丢帧策略：解码队列积压时丢弃非关键帧并等待下一个关键帧；绘制前有更新的帧解码完成时直接丢弃旧帧
+class WebCodecsPlayer {
+    constructor(canvas, options = {}) {
+        this.canvas = canvas;
+        this.context = canvas.getContext('2d');
+        this.maxDecodeQueue = options.maxDecodeQueue || 3;      // 解码队列超过该帧数时开始丢帧
+        this.onKeyframeNeeded = options.onKeyframeNeeded || null;  // 丢帧后请求服务器发送关键帧
+        this.onFramePresented = options.onFramePresented || null;  // (sample, presentedAt) 带采样的帧显示后回调
+        this.decoder = null;
+        this.sps = null;
+        this.pps = null;
+        this.awaitingKeyframe = true;
+        this.pendingFrame = null;  // 已解码、等待下一次绘制的帧
+        this.renderId = null;
+        this.samples = new Map();  // 帧时间戳 -> 画面延迟采样
+        this.nextTimestamp = 0;
+        this.decodedFrames = 0;
+        this.droppedFrames = 0;
+    }
+
+    static isSupported() {
+        return typeof VideoDecoder !== 'undefined' && typeof EncodedVideoChunk !== 'undefined';
+    }
+
+    // sps 以起始码开头，其后依次为 NAL 头、profile_idc、约束标志、level_idc
+    static codecString(sps) {
+        const hex = (b) => b.toString(16).padStart(2, '0');
+        return 'avc1.' + hex(sps[5]) + hex(sps[6]) + hex(sps[7]);
+    }
+
+    static sameBytes(a, b) {
+        if (!a || !b || a.length !== b.length) return false;
+        for (let i = 0; i < a.length; i++) {
+            if (a[i] !== b[i]) return false;
+        }
+        return true;
+    }
+
+    // 处理解析器的 init 事件；服务器为新观看者重发相同的 SPS/PPS 时不重建解码器
+    configure(sps, pps) {
+        if (this.decoder && this.decoder.state === 'configured' &&
+            WebCodecsPlayer.sameBytes(sps, this.sps) && WebCodecsPlayer.sameBytes(pps, this.pps)) {
+            return;
+        }
+        this.sps = sps;
+        this.pps = pps;
+        this.createDecoder();
+    }
+
+    createDecoder() {
+        this.closeDecoder();
+        this.decoder = new VideoDecoder({
+            output: (frame) => this.onFrame(frame),
+            error: (e) => {
+                console.warn('Video decode error:', e);
+                this.waitForKeyframe();
+            }
+        });
+        try {
+            this.decoder.configure({ codec: WebCodecsPlayer.codecString(this.sps), optimizeForLatency: true });
+        } catch (e) {
+            console.warn('Video decoder configure error:', e);
+        }
+        this.awaitingKeyframe = true;
+    }
+
+    closeDecoder() {
+        if (this.decoder && this.decoder.state !== 'closed') {
+            try {
+                this.decoder.close();
+            } catch (e) { }
+        }
+        this.decoder = null;
+    }
+
+    waitForKeyframe() {
+        this.awaitingKeyframe = true;
+        if (this.onKeyframeNeeded) this.onKeyframeNeeded();
+    }
+
+    // 解码一个视频帧，keyframe 取自 scrcpy 包头的关键帧标志，sample 为该帧的画面延迟采样（可为 null），
+    // 返回是否送入了解码器
+    decode(data, pts, keyframe, sample = null) {
+        if (!this.sps || !this.pps) return false;
+        if (!this.decoder || this.decoder.state === 'closed') {
+            this.createDecoder();
+        }
+        if (this.awaitingKeyframe) {
+            if (!keyframe) {
+                this.droppedFrames++;
+                return false;
+            }
+            this.awaitingKeyframe = false;
+        } else if (!keyframe && this.decoder.decodeQueueSize > this.maxDecodeQueue) {
+            // 后续的 P 帧都依赖被丢弃的帧，只能等下一个关键帧
+            this.droppedFrames++;
+            this.waitForKeyframe();
+            return false;
+        }
+        const timestamp = typeof pts === 'number' ? pts : this.nextTimestamp;
+        this.nextTimestamp = timestamp + 1;
+        if (sample) {
+            this.samples.set(timestamp, sample);
+            if (this.samples.size > 64) {
+                this.samples.delete(this.samples.keys().next().value);
+            }
+        }
+        let payload = data;
+        if (keyframe) {
+            // Annex B 模式没有 description，关键帧需带上 SPS/PPS
+            payload = new Uint8Array(this.sps.length + this.pps.length + data.length);
+            payload.set(this.sps, 0);
+            payload.set(this.pps, this.sps.length);
+            payload.set(data, this.sps.length + this.pps.length);
+        }
+        try {
+            this.decoder.decode(new EncodedVideoChunk({ type: keyframe ? 'key' : 'delta', timestamp, data: payload }));
+        } catch (e) {
+            console.warn('Video decode error:', e);
+            this.waitForKeyframe();
+            return false;
+        }
+        return true;
+    }
+
+    onFrame(frame) {
+        this.decodedFrames++;
+        if (this.pendingFrame) {
+            // 上一帧还没来得及绘制就被更新的帧取代
+            this.samples.delete(this.pendingFrame.timestamp);
+            this.pendingFrame.close();
+            this.droppedFrames++;
+        }
+        this.pendingFrame = frame;
+        if (this.renderId === null) {
+            this.renderId = requestAnimationFrame(() => this.render());
+        }
+    }
+
+    render() {
+        this.renderId = null;
+        const frame = this.pendingFrame;
+        if (!frame) return;
+        this.pendingFrame = null;
+        if (this.canvas.width !== frame.displayWidth || this.canvas.height !== frame.displayHeight) {
+            this.canvas.width = frame.displayWidth;
+            this.canvas.height = frame.displayHeight;
+        }
+        this.context.drawImage(frame, 0, 0);
+        const sample = this.samples.get(frame.timestamp);
+        frame.close();
+        if (sample) {
+            this.samples.delete(frame.timestamp);
+            if (this.onFramePresented) {
+                this.onFramePresented(sample, performance.timeOrigin + performance.now());
+            }
+        }
+    }
+
+    // 停止镜像或切换设备时调用：关闭解码器并清空画面，收到新的 SPS/PPS 后重新配置
+    reset() {
+        this.closeDecoder();
+        if (this.renderId !== null) {
+            cancelAnimationFrame(this.renderId);
+            this.renderId = null;
+        }
+        if (this.pendingFrame) {
+            this.pendingFrame.close();
+            this.pendingFrame = null;
+        }
+        this.samples.clear();
+        this.sps = null;
+        this.pps = null;
+        this.awaitingKeyframe = true;
+        this.context.clearRect(0, 0, this.canvas.width, this.canvas.height);
+    }
+}